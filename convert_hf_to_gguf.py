@@ -14,13 +14,13 @@ import sys
 from enum import IntEnum
 from pathlib import Path
 from hashlib import sha256
-from typing import TYPE_CHECKING, Any, Callable, ContextManager, Iterable, Iterator, Literal, Sequence, TypeVar, cast
+from typing import TYPE_CHECKING, Any, Callable, ContextManager, Iterable, Iterator, Literal, Sequence, TypeVar
 from itertools import chain
 
 import math
 import numpy as np
-import torch
 
+# torch is only imported by the models which modify their tensors (see Model.uses_torch)
 if TYPE_CHECKING:
     from torch import Tensor
 
@@ -61,7 +61,10 @@ class Model:
     block_count: int
     tensor_map: gguf.TensorNameMap
     tensor_names: set[str] | None
+    thread_count: int
     gguf_writer: gguf.GGUFWriter
+    # tensors of the experts of MoE models which are being merged
+    expert_stacks: dict[str, ExpertStack]
     model_name: str | None
     metadata_override: Path | None
     dir_model_card: Path
@@ -73,7 +76,9 @@ class Model:
                  use_temp_file: bool = False, eager: bool = False,
                  metadata_override: Path | None = None, model_name: str | None = None,
                  split_max_tensors: int = 0, split_max_size: int = 0, dry_run: bool = False,
-                 small_first_shard: bool = False, hparams: dict[str, Any] | None = None):
+                 small_first_shard: bool = False, hparams: dict[str, Any] | None = None,
+                 thread_count: int = 1, max_inflight_size: int = 0, imatrix: Path | None = None,
+                 load_order: bool = False, data_alignment: int | None = None, use_cache: bool = True):
         if type(self) is Model:
             raise TypeError(f"{type(self).__name__!r} should not be directly instantiated")
 
@@ -92,24 +97,38 @@ class Model:
         self.block_count = self.find_hparam(["n_layers", "num_hidden_layers", "n_layer", "num_layers"])
         self.tensor_map = gguf.get_tensor_name_map(self.model_arch, self.block_count)
         self.tensor_names = None
+        self.thread_count = thread_count
+        self.expert_stacks = {}
         self.metadata_override = metadata_override
         self.model_name = model_name
         self.dir_model_card = dir_model  # overridden in convert_lora_to_gguf.py
+        self.imatrix_file = imatrix
+        self.imatrix = gguf.ImportanceMatrix.load(imatrix) if imatrix is not None else None
+        self.use_cache = use_cache
 
         # Apply heuristics to figure out typical tensor encoding based on first layer tensor encoding type
         if self.ftype == gguf.LlamaFileType.GUESSED:
             # NOTE: can't use field "torch_dtype" in config.json, because some finetunes lie.
-            _, first_tensor = next(self.get_tensors())
-            if first_tensor.dtype == torch.float16:
-                logger.info(f"choosing --outtype f16 from first tensor type ({first_tensor.dtype})")
+            if self.uses_torch():
+                import torch
+                _, first_tensor = next(self.get_tensors())
+                first_dtype, is_f16 = first_tensor.dtype, first_tensor.dtype == torch.float16
+            else:
+                _, _, first_dtype = next(self.get_numpy_tensors())
+                is_f16 = first_dtype == "F16"
+            if is_f16:
+                logger.info(f"choosing --outtype f16 from first tensor type ({first_dtype})")
                 self.ftype = gguf.LlamaFileType.MOSTLY_F16
             else:
-                logger.info(f"choosing --outtype bf16 from first tensor type ({first_tensor.dtype})")
+                logger.info(f"choosing --outtype bf16 from first tensor type ({first_dtype})")
                 self.ftype = gguf.LlamaFileType.MOSTLY_BF16
 
         # Configure GGUF Writer
         self.gguf_writer = gguf.GGUFWriter(path=None, arch=gguf.MODEL_ARCH_NAMES[self.model_arch], endianess=self.endianess, use_temp_file=self.use_temp_file,
-                                           split_max_tensors=split_max_tensors, split_max_size=split_max_size, dry_run=dry_run, small_first_shard=small_first_shard)
+                                           split_max_tensors=split_max_tensors, split_max_size=split_max_size, dry_run=dry_run, small_first_shard=small_first_shard,
+                                           thread_count=thread_count, max_inflight_size=max_inflight_size, load_order=load_order)
+        if data_alignment is not None:
+            self.gguf_writer.add_custom_alignment(data_alignment)
 
     @classmethod
     def __init_subclass__(cls):
@@ -129,7 +148,8 @@ class Model:
     def set_vocab(self):
         self._set_vocab_gpt2()
 
-    def get_tensors(self) -> Iterator[tuple[str, Tensor]]:
+    # Opens the model parts one at a time, and checks that all the tensors were found
+    def _get_model_parts(self) -> Iterator[Any]:
         tensor_names_from_parts: set[str] = set()
 
         index_name = "model.safetensors" if self.is_safetensors else "pytorch_model.bin"
@@ -153,26 +173,15 @@ class Model:
             logger.info(f"gguf: loading model part '{part_name}'")
             ctx: ContextManager[Any]
             if self.is_safetensors:
-                from safetensors import safe_open
-                ctx = cast(ContextManager[Any], safe_open(self.dir_model / part_name, framework="pt", device="cpu"))
+                # copy-on-write, to allow in-place operations on the tensors without modifying the files
+                ctx = contextlib.nullcontext(gguf.SafetensorsReader(self.dir_model / part_name, mode="c"))
             else:
+                import torch
                 ctx = contextlib.nullcontext(torch.load(str(self.dir_model / part_name), map_location="cpu", mmap=True, weights_only=True))
 
             with ctx as model_part:
                 tensor_names_from_parts.update(model_part.keys())
-
-                for name in model_part.keys():
-                    if self.is_safetensors:
-                        if self.lazy:
-                            data = model_part.get_slice(name)
-                            data = LazyTorchTensor.from_safetensors_slice(data)
-                        else:
-                            data = model_part.get_tensor(name)
-                    else:
-                        data = model_part[name]
-                        if self.lazy:
-                            data = LazyTorchTensor.from_eager(data)
-                    yield name, data
+                yield model_part
 
         # verify tensor name presence and identify potentially missing files
         if len(tensor_names_from_parts.symmetric_difference(self.tensor_names)) > 0:
@@ -186,6 +195,50 @@ class Model:
                                  f"Missing tensors: {missing}\n"
                                  f"Extra tensors: {extra}")
 
+    def get_tensors(self) -> Iterator[tuple[str, Tensor]]:
+        from gguf.lazy_torch import LazyTorchTensor
+
+        for model_part in self._get_model_parts():
+            for name in model_part.keys():
+                if self.is_safetensors:
+                    data = LazyTorchTensor.from_safetensors_tensor(model_part.tensors[name])
+                    if not self.lazy:
+                        data = LazyTorchTensor.to_eager(data)
+                else:
+                    data = model_part[name]
+                    if self.lazy:
+                        data = LazyTorchTensor.from_eager(data)
+                yield name, data
+
+    # Whether the tensors go through torch. They don't need to when the model doesn't modify nor generate them:
+    # the tensors of safetensors files are then read with NumPy (see get_numpy_tensors), without importing torch.
+    def uses_torch(self) -> bool:
+        return not self.is_safetensors or any(
+            getattr(type(self), method) is not getattr(Model, method)
+            for method in ("get_tensors", "generate_extra_tensors", "modify_tensors")
+        )
+
+    # Same as get_tensors for safetensors files, but with NumPy instead of torch (the tensors are gguf.LazyNumpyTensor when lazy).
+    # Like in prepare_tensors, the types other than float16 and float32 are converted to float32.
+    # Also yields the original type of each tensor.
+    def get_numpy_tensors(self) -> Iterator[tuple[str, np.ndarray, str]]:
+        assert self.is_safetensors
+        for model_part in self._get_model_parts():
+            for name in model_part.keys():
+                tensor: gguf.SafetensorsTensor = model_part.tensors[name]
+                data: np.ndarray = model_part.get_lazy_tensor(name)
+                if tensor.dtype == "BF16":
+                    data = gguf.LazyNumpyTensor._wrap_fn(gguf.bf16_to_f32, meta_noop=np.float32)(data)
+                elif tensor.dtype in ("F8_E4M3", "F8_E5M2"):
+                    # NumPy doesn't have these types
+                    from gguf.lazy_torch import LazyTorchTensor
+                    data = LazyTorchTensor.from_safetensors_tensor(tensor).float().numpy()
+                elif tensor.data.dtype not in (np.float16, np.float32):
+                    data = data.astype(np.float32)
+                if not self.lazy:
+                    data = gguf.LazyNumpyTensor.to_eager(data)
+                yield name, data, tensor.dtype
+
     def format_tensor_name(self, key: gguf.MODEL_TENSOR, bid: int | None = None, suffix: str = ".weight") -> str:
         if key not in gguf.MODEL_TENSORS[self.model_arch]:
             raise ValueError(f"Missing {key!r} for MODEL_TENSORS of {self.model_arch!r}")
@@ -265,21 +318,144 @@ class Model:
 
         return [(self.map_tensor_name(name), data_torch)]
 
+    # For MoE models, to merge the tensors of the experts into 3d tensors as they are read.
+    # At most one copy of them is held (see ExpertStack).
+    def add_expert(self, merged_name: str, xid: int, n_experts: int, data_torch: Tensor):
+        if (stack := self.expert_stacks.get(merged_name)) is None:
+            stack = self.expert_stacks[merged_name] = ExpertStack(merged_name, n_experts)
+        stack.add(xid, data_torch)
+
+    # Returns the merged tensors (with mapped names) once all of their experts have been added, otherwise nothing
+    def pop_merged_experts(self, merged_names: Sequence[str]) -> list[tuple[str, Tensor]]:
+        if not all(name in self.expert_stacks and self.expert_stacks[name].is_complete() for name in merged_names):
+            return []
+        return [(self.map_tensor_name(name), self.expert_stacks.pop(name).stack()) for name in merged_names]
+
     def tensor_force_quant(self, name: str, new_name: str, bid: int | None, n_dims: int) -> gguf.GGMLQuantizationType | bool:
         del name, new_name, bid, n_dims  # unused
 
         return False
 
+    # Simplified version of llama_tensor_get_type in llama.cpp, for the K-quant and IQ4 mixes
+    def k_quant_type(self, new_name: str, bid: int | None) -> gguf.GGMLQuantizationType:
+        Q = gguf.GGMLQuantizationType
+        ftype = self.ftype
+        LFT = gguf.LlamaFileType
+
+        default_type = {
+            LFT.MOSTLY_Q2_K:   Q.Q2_K,
+            LFT.MOSTLY_Q3_K_S: Q.Q3_K,
+            LFT.MOSTLY_Q3_K_M: Q.Q3_K,
+            LFT.MOSTLY_Q3_K_L: Q.Q3_K,
+            LFT.MOSTLY_Q4_K_S: Q.Q4_K,
+            LFT.MOSTLY_Q4_K_M: Q.Q4_K,
+            LFT.MOSTLY_Q5_K_S: Q.Q5_K,
+            LFT.MOSTLY_Q5_K_M: Q.Q5_K,
+            LFT.MOSTLY_Q6_K:   Q.Q6_K,
+            LFT.MOSTLY_IQ4_NL: Q.IQ4_NL,
+            LFT.MOSTLY_IQ4_XS: Q.IQ4_XS,
+        }[ftype]
+
+        if self.match_model_tensor_name(new_name, gguf.MODEL_TENSOR.OUTPUT, bid):
+            return Q.Q6_K
+
+        def use_more_bits(i_layer: int, n_layers: int) -> bool:
+            return i_layer < n_layers // 8 or i_layer >= 7 * n_layers // 8 or (i_layer - n_layers // 8) % 3 == 2
+
+        i_layer = bid if bid is not None else 0
+        n_layers = self.block_count
+        n_head = self.find_hparam(["num_attention_heads", "n_head"], optional=True)
+        n_head_kv = self.hparams.get("num_key_value_heads", n_head)
+        n_gqa = n_head // n_head_kv if n_head and n_head_kv else 1
+
+        if self.match_model_tensor_name(new_name, gguf.MODEL_TENSOR.ATTN_V, bid):
+            if ftype == LFT.MOSTLY_Q2_K:
+                return Q.Q3_K
+            elif ftype == LFT.MOSTLY_Q3_K_M:
+                return Q.Q5_K if i_layer < 2 else Q.Q4_K
+            elif ftype == LFT.MOSTLY_Q3_K_L:
+                return Q.Q5_K
+            elif ftype in (LFT.MOSTLY_IQ4_NL, LFT.MOSTLY_IQ4_XS) and n_gqa >= 4:
+                return Q.Q5_K
+            elif ftype in (LFT.MOSTLY_Q4_K_M, LFT.MOSTLY_Q5_K_M) and use_more_bits(i_layer, n_layers):
+                return Q.Q6_K
+            elif ftype == LFT.MOSTLY_Q4_K_S and i_layer < 4:
+                return Q.Q5_K
+        elif self.match_model_tensor_name(new_name, gguf.MODEL_TENSOR.FFN_DOWN, bid):
+            if ftype == LFT.MOSTLY_Q2_K:
+                return Q.Q3_K
+            elif ftype == LFT.MOSTLY_Q3_K_M:
+                return Q.Q5_K if i_layer < n_layers // 16 else Q.Q4_K
+            elif ftype == LFT.MOSTLY_Q3_K_L:
+                return Q.Q5_K
+            elif ftype in (LFT.MOSTLY_Q4_K_M, LFT.MOSTLY_Q5_K_M) and use_more_bits(i_layer, n_layers):
+                return Q.Q6_K
+            elif ftype in (LFT.MOSTLY_IQ4_NL, LFT.MOSTLY_IQ4_XS) and i_layer < n_layers // 8 and self.imatrix is None:
+                return Q.Q5_K
+            elif ftype == LFT.MOSTLY_Q4_K_S and i_layer < n_layers // 8:
+                return Q.Q5_K
+        elif self.match_model_tensor_name(new_name, gguf.MODEL_TENSOR.ATTN_OUT, bid):
+            if ftype == LFT.MOSTLY_Q3_K_M:
+                return Q.Q4_K
+            elif ftype == LFT.MOSTLY_Q3_K_L:
+                return Q.Q5_K
+
+        return default_type
+
     # some models need extra generated tensors (like rope_freqs)
     def generate_extra_tensors(self) -> Iterable[tuple[str, Tensor]]:
         return ()
 
-    def prepare_tensors(self):
-        max_name_len = max(len(s) for _, s in self.tensor_map.mapping.values()) + len(".weight,")
+    _k_quant_ftypes = (
+        gguf.LlamaFileType.MOSTLY_Q2_K,
+        gguf.LlamaFileType.MOSTLY_Q3_K_S,
+        gguf.LlamaFileType.MOSTLY_Q3_K_M,
+        gguf.LlamaFileType.MOSTLY_Q3_K_L,
+        gguf.LlamaFileType.MOSTLY_Q4_K_S,
+        gguf.LlamaFileType.MOSTLY_Q4_K_M,
+        gguf.LlamaFileType.MOSTLY_Q5_K_S,
+        gguf.LlamaFileType.MOSTLY_Q5_K_M,
+        gguf.LlamaFileType.MOSTLY_Q6_K,
+        gguf.LlamaFileType.MOSTLY_IQ4_NL,
+        gguf.LlamaFileType.MOSTLY_IQ4_XS,
+    )
+
+    _quant_fallback: dict[gguf.GGMLQuantizationType, gguf.GGMLQuantizationType] = {
+        gguf.GGMLQuantizationType.Q2_K: gguf.GGMLQuantizationType.IQ4_NL,
+        gguf.GGMLQuantizationType.Q3_K: gguf.GGMLQuantizationType.IQ4_NL,
+        gguf.GGMLQuantizationType.Q4_K: gguf.GGMLQuantizationType.Q5_0,
+        gguf.GGMLQuantizationType.Q5_K: gguf.GGMLQuantizationType.Q5_1,
+        gguf.GGMLQuantizationType.Q6_K: gguf.GGMLQuantizationType.Q8_0,
+        gguf.GGMLQuantizationType.IQ4_XS: gguf.GGMLQuantizationType.IQ4_NL,
+    }
+
+    # we don't need these
+    _skipped_tensor_suffixes = (".attention.masked_bias", ".attention.bias", ".rotary_emb.inv_freq")
+
+    @staticmethod
+    def _get_block_id(name: str) -> int | None:
+        # use the first number-like part of the tensor name as the block id
+        for part in name.split("."):
+            if part.isdecimal():
+                return int(part)
+        return None
+
+    # The name, block id and original type of each tensor, with the tensors it's modified into (with their new names) as NumPy arrays
+    def _get_torch_tensors(self) -> Iterator[tuple[str, int | None, Any, Iterator[tuple[str, Any]]]]:
+        import torch
+
+        def to_numpy(new_tensors: Iterable[tuple[str, Tensor]]) -> Iterator[tuple[str, Any]]:
+            for new_name, data_torch in new_tensors:
+                data = data_torch.squeeze().numpy()
+
+                # if data ends up empty, it means data_torch was a scalar tensor -> restore
+                if len(data.shape) == 0:
+                    data = data_torch.numpy()
+
+                yield new_name, data
 
         for name, data_torch in chain(self.generate_extra_tensors(), self.get_tensors()):
-            # we don't need these
-            if name.endswith((".attention.masked_bias", ".attention.bias", ".rotary_emb.inv_freq")):
+            if name.endswith(self._skipped_tensor_suffixes):
                 continue
 
             old_dtype = data_torch.dtype
@@ -288,20 +464,29 @@ class Model:
             if data_torch.dtype not in (torch.float16, torch.float32):
                 data_torch = data_torch.to(torch.float32)
 
-            # use the first number-like part of the tensor name as the block id
-            bid = None
-            for part in name.split("."):
-                if part.isdecimal():
-                    bid = int(part)
-                    break
+            bid = self._get_block_id(name)
 
-            for new_name, data_torch in (self.modify_tensors(data_torch, name, bid)):
-                data = data_torch.squeeze().numpy()
+            yield name, bid, old_dtype, to_numpy(self.modify_tensors(data_torch, name, bid))
 
-                # if data ends up empty, it means data_torch was a scalar tensor -> restore
-                if len(data.shape) == 0:
-                    data = data_torch.numpy()
+    # Same as _get_torch_tensors, for the models which don't modify their tensors
+    def _get_unmodified_tensors(self) -> Iterator[tuple[str, int | None, Any, Iterator[tuple[str, Any]]]]:
+        for name, data, old_dtype in self.get_numpy_tensors():
+            if name.endswith(self._skipped_tensor_suffixes):
+                continue
 
+            # like in _get_torch_tensors, the scalar tensors are not squeezed
+            squeezed = data.squeeze()
+            if len(squeezed.shape) > 0:
+                data = squeezed
+
+            # (the same new name as with Model.modify_tensors)
+            yield name, self._get_block_id(name), old_dtype, iter([(self.map_tensor_name(name), data)])
+
+    def prepare_tensors(self):
+        max_name_len = self.tensor_map.max_name_length() + len(".weight,")
+
+        for name, bid, old_dtype, new_tensors in (self._get_torch_tensors() if self.uses_torch() else self._get_unmodified_tensors()):
+            for new_name, data in new_tensors:
                 n_dims = len(data.shape)
                 data_qtype: gguf.GGMLQuantizationType | bool = self.tensor_force_quant(name, new_name, bid, n_dims)
 
@@ -358,15 +543,27 @@ class Model:
                         data_qtype = gguf.GGMLQuantizationType.TQ1_0
                     elif self.ftype == gguf.LlamaFileType.MOSTLY_TQ2_0:
                         data_qtype = gguf.GGMLQuantizationType.TQ2_0
+                    elif self.ftype in self._k_quant_ftypes:
+                        data_qtype = self.k_quant_type(new_name, bid)
                     else:
                         raise ValueError(f"Unknown file type: {self.ftype.name}")
 
-                try:
-                    data = gguf.quants.quantize(data, data_qtype)
-                except gguf.QuantError as e:
-                    logger.warning("%s, %s", e, "falling back to F16")
-                    data_qtype = gguf.GGMLQuantizationType.F16
-                    data = gguf.quants.quantize(data, data_qtype)
+                imatrix = None
+                if self.imatrix is not None:
+                    try:
+                        imatrix = self.imatrix.get(new_name, data.shape)
+                    except ValueError as e:
+                        logger.warning("%s, ignoring it", e)
+
+                while True:
+                    try:
+                        data = gguf.quants.quantize(data, data_qtype, imatrix)
+                        break
+                    except gguf.QuantError as e:
+                        # same fallbacks as in llama.cpp when the row size is not a multiple of the block size
+                        fallback_qtype = self._quant_fallback.get(data_qtype, gguf.GGMLQuantizationType.F16)
+                        logger.warning("%s, falling back to %s", e, fallback_qtype.name)
+                        data_qtype = fallback_qtype
 
                 shape = gguf.quant_shape_from_byte_shape(data.shape, data_qtype) if data.dtype == np.uint8 else data.shape
 
@@ -378,6 +575,10 @@ class Model:
 
                 self.gguf_writer.add_tensor(new_name, data, raw_dtype=data_qtype)
 
+        if len(self.expert_stacks) > 0:
+            experts = [stack.missing_experts() for stack in self.expert_stacks.values()]
+            raise ValueError(f"Unprocessed experts: {experts}")
+
     def set_type(self):
         self.gguf_writer.add_type(gguf.GGUFType.MODEL)
 
@@ -430,6 +631,15 @@ class Model:
         logger.info("Set model quantization version")
         self.gguf_writer.add_quantization_version(gguf.GGML_QUANT_VERSION)
 
+        if self.imatrix is not None and not vocab_only:
+            assert self.imatrix_file is not None
+            self.gguf_writer.add_quantize_imatrix_file(str(self.imatrix_file))
+            if self.imatrix.dataset:
+                self.gguf_writer.add_quantize_imatrix_dataset(self.imatrix.dataset)
+            self.gguf_writer.add_quantize_imatrix_entries_count(len(self.imatrix))
+            if self.imatrix.chunks_count > 0:
+                self.gguf_writer.add_quantize_imatrix_chunks_count(self.imatrix.chunks_count)
+
     def write(self):
         self.prepare_tensors()
         self.prepare_metadata(vocab_only=False)
@@ -508,15 +718,23 @@ class Model:
         tokens: list[str] = []
         toktypes: list[int] = []
 
-        from transformers import AutoTokenizer
-        tokenizer = AutoTokenizer.from_pretrained(self.dir_model)
-        vocab_size = self.hparams.get("vocab_size", len(tokenizer.vocab))
-        assert max(tokenizer.vocab.values()) < vocab_size
+        try:
+            # read the vocab from tokenizer.json when it's the same as the one of AutoTokenizer
+            # (the tokenizer then only gets loaded by get_vocab_base_pre if its hash isn't cached)
+            tokenizer_json = gguf.TokenizerJsonVocab(self.dir_model)
+            tokenizer = None
+            vocab, added_vocab, special_ids = tokenizer_json.vocab, tokenizer_json.added_tokens, tokenizer_json.special_ids
+        except FileNotFoundError:
+            from transformers import AutoTokenizer
+            tokenizer = AutoTokenizer.from_pretrained(self.dir_model)
+            vocab, added_vocab = tokenizer.vocab, tokenizer.get_added_vocab()
+            special_ids = {id_ for id_, added_token in tokenizer.added_tokens_decoder.items() if added_token.special}
+        vocab_size = self.hparams.get("vocab_size", len(vocab))
+        assert max(vocab.values()) < vocab_size
 
         tokpre = self.get_vocab_base_pre(tokenizer)
 
-        reverse_vocab = {id_: encoded_tok for encoded_tok, id_ in tokenizer.vocab.items()}
-        added_vocab = tokenizer.get_added_vocab()
+        reverse_vocab = {id_: encoded_tok for encoded_tok, id_ in vocab.items()}
 
         for i in range(vocab_size):
             if i not in reverse_vocab:
@@ -525,7 +743,7 @@ class Model:
             else:
                 token: str = reverse_vocab[i]
                 if token in added_vocab:
-                    if tokenizer.added_tokens_decoder[i].special or self.does_token_look_special(token):
+                    if i in special_ids or self.does_token_look_special(token):
                         toktypes.append(gguf.TokenType.CONTROL)
                     else:
                         token = token.replace(b"\xe2\x96\x81".decode("utf-8"), " ")  # pre-normalize user-defined spaces
@@ -540,7 +758,7 @@ class Model:
     #       do not modify it manually!
     # ref:  https://github.com/ggerganov/llama.cpp/pull/6920
     # Marker: Start get_vocab_base_pre
-    def get_vocab_base_pre(self, tokenizer) -> str:
+    def get_vocab_base_pre(self, tokenizer=None) -> str:
         # encoding this string and hashing the resulting tokens would (hopefully) give us a unique identifier that
         # is specific for the BPE pre-tokenizer used by the model
         # we will use this unique identifier to write a "tokenizer.ggml.pre" entry in the GGUF file which we can
@@ -548,10 +766,19 @@ class Model:
 
         chktxt = '\n \n\n \n\n\n \t \t\t \t\n  \n   \n    \n     \n🚀 (normal) 😶\u200d🌫️ (multiple emojis concatenated) ✅ 🦙🦙 3 33 333 3333 33333 333333 3333333 33333333 3.3 3..3 3...3 កាន់តែពិសេសអាច😁 ?我想在apple工作1314151天～ ------======= нещо на Български \'\'\'\'\'\'```````""""......!!!!!!?????? I\'ve been \'told he\'s there, \'RE you sure? \'M not sure I\'ll make it, \'D you like some tea? We\'Ve a\'lL'
 
-        chktok = tokenizer.encode(chktxt)
-        chkhsh = sha256(str(chktok).encode()).hexdigest()
+        # the hash only depends on the tokenizer files, so it's cached to avoid loading the tokenizer again
+        def get_chkhsh() -> str:
+            nonlocal tokenizer
+            if tokenizer is None:
+                from transformers import AutoTokenizer
+                tokenizer = AutoTokenizer.from_pretrained(self.dir_model)
+
+            chktok = tokenizer.encode(chktxt)
+            logger.debug(f"chktok: {chktok}")
+            return sha256(str(chktok).encode()).hexdigest()
+
+        chkhsh = gguf.cached_chkhsh(self.dir_model, chktxt, get_chkhsh, use_cache=self.use_cache)
 
-        logger.debug(f"chktok: {chktok}")
         logger.debug(f"chkhsh: {chkhsh}")
 
         res = None
@@ -707,12 +934,10 @@ class Model:
         vocab = {}
         mergeable_ranks = tokenizer.mergeable_ranks
         for token, rank in mergeable_ranks.items():
-            vocab[QwenModel.token_bytes_to_string(token)] = rank
-            if len(token) == 1:
-                continue
-            merged = QwenModel.bpe(mergeable_ranks, token, max_rank=rank)
+            vocab[gguf.token_bytes_to_string(token)] = rank
+        for merged in gguf.tiktoken_merges(mergeable_ranks, n_workers=self.thread_count):
             assert len(merged) == 2
-            merges.append(' '.join(map(QwenModel.token_bytes_to_string, merged)))
+            merges.append(' '.join(map(gguf.token_bytes_to_string, merged)))
 
         # for this kind of tokenizer, added_vocab is not a subset of vocab, so they need to be combined
         added_vocab = tokenizer.special_tokens
@@ -861,47 +1086,47 @@ class Model:
     def _set_vocab_builtin(self, model_name: Literal["gpt-neox", "llama-spm"], vocab_size: int):
         tokenizer_path = Path(sys.path[0]) / "models" / f"ggml-vocab-{model_name}.gguf"
         logger.warning(f"Using tokenizer from '{os.path.relpath(tokenizer_path, os.getcwd())}'")
-        vocab_reader = gguf.GGUFReader(tokenizer_path, "r")
+        vocab_reader = gguf.GGUFReader(tokenizer_path, "r", lazy=True)
 
         default_pre = "mpt" if model_name == "gpt-neox" else "default"
 
         field = vocab_reader.get_field(gguf.Keys.Tokenizer.MODEL)
         assert field  # tokenizer model
-        self.gguf_writer.add_tokenizer_model(bytes(field.parts[-1]).decode("utf-8"))
+        self.gguf_writer.add_tokenizer_model(field.contents())
 
         field = vocab_reader.get_field(gguf.Keys.Tokenizer.PRE)
-        self.gguf_writer.add_tokenizer_pre(bytes(field.parts[-1]).decode("utf-8") if field else default_pre)
+        self.gguf_writer.add_tokenizer_pre(field.contents() if field else default_pre)
 
         field = vocab_reader.get_field(gguf.Keys.Tokenizer.LIST)
-        assert field  # token list
-        self.gguf_writer.add_token_list([bytes(field.parts[i]) for i in field.data][:vocab_size])
+        assert isinstance(field, gguf.LazyReaderField)  # token list
+        self.gguf_writer.add_token_list(field.strings().get_bytes(slice(vocab_size)))
 
         if model_name == "llama-spm":
             field = vocab_reader.get_field(gguf.Keys.Tokenizer.SCORES)
             assert field  # token scores
-            self.gguf_writer.add_token_scores([field.parts[i].tolist()[0] for i in field.data][:vocab_size])
+            self.gguf_writer.add_token_scores(field.contents(slice(vocab_size)))
 
         field = vocab_reader.get_field(gguf.Keys.Tokenizer.TOKEN_TYPE)
         assert field  # token types
-        self.gguf_writer.add_token_types([field.parts[i].tolist()[0] for i in field.data][:vocab_size])
+        self.gguf_writer.add_token_types(field.contents(slice(vocab_size)))
 
         if model_name != "llama-spm":
             field = vocab_reader.get_field(gguf.Keys.Tokenizer.MERGES)
-            assert field  # token merges
-            self.gguf_writer.add_token_merges([bytes(field.parts[i]) for i in field.data])
+            assert isinstance(field, gguf.LazyReaderField)  # token merges
+            self.gguf_writer.add_token_merges(field.strings().get_bytes(slice(None)))
 
         if (field := vocab_reader.get_field(gguf.Keys.Tokenizer.BOS_ID)) is not None:
-            self.gguf_writer.add_bos_token_id(field.parts[-1].tolist()[0])
+            self.gguf_writer.add_bos_token_id(field.contents())
         if (field := vocab_reader.get_field(gguf.Keys.Tokenizer.EOS_ID)) is not None:
-            self.gguf_writer.add_eos_token_id(field.parts[-1].tolist()[0])
+            self.gguf_writer.add_eos_token_id(field.contents())
         if (field := vocab_reader.get_field(gguf.Keys.Tokenizer.UNK_ID)) is not None:
-            self.gguf_writer.add_unk_token_id(field.parts[-1].tolist()[0])
+            self.gguf_writer.add_unk_token_id(field.contents())
         if (field := vocab_reader.get_field(gguf.Keys.Tokenizer.PAD_ID)) is not None:
-            self.gguf_writer.add_pad_token_id(field.parts[-1].tolist()[0])
+            self.gguf_writer.add_pad_token_id(field.contents())
         if (field := vocab_reader.get_field(gguf.Keys.Tokenizer.ADD_BOS)) is not None:
-            self.gguf_writer.add_add_bos_token(field.parts[-1].tolist()[0])
+            self.gguf_writer.add_add_bos_token(field.contents())
         if (field := vocab_reader.get_field(gguf.Keys.Tokenizer.ADD_EOS)) is not None:
-            self.gguf_writer.add_add_eos_token(field.parts[-1].tolist()[0])
+            self.gguf_writer.add_add_eos_token(field.contents())
 
 
 @Model.register("GPTNeoXForCausalLM")
@@ -923,6 +1148,8 @@ class GPTNeoXModel(Model):
         self.gguf_writer.add_layer_norm_eps(self.hparams["layer_norm_eps"])
 
     def modify_tensors(self, data_torch: Tensor, name: str, bid: int | None) -> Iterable[tuple[str, Tensor]]:
+        import torch
+
         del bid  # unused
 
         n_head = self.hparams.get("n_head", self.hparams.get("num_attention_heads"))
@@ -978,6 +1205,8 @@ class BloomModel(Model):
         self.gguf_writer.add_file_type(self.ftype)
 
     def modify_tensors(self, data_torch: Tensor, name: str, bid: int | None) -> Iterable[tuple[str, Tensor]]:
+        import torch
+
         del bid  # unused
 
         n_head = self.hparams.get("n_head", self.hparams.get("num_attention_heads"))
@@ -1319,6 +1548,8 @@ class FalconModel(Model):
         self.gguf_writer.add_file_type(self.ftype)
 
     def modify_tensors(self, data_torch: Tensor, name: str, bid: int | None) -> Iterable[tuple[str, Tensor]]:
+        import torch
+
         del bid  # unused
 
         # QKV tensor transform
@@ -1489,6 +1720,8 @@ class StableLMModel(Model):
         return [(self.map_tensor_name(name), data_torch)]
 
     def _stack_qk_norm(self, bid: int, n_head: int, norms: dict[str, Tensor], layer_name: str = "q_layernorm"):
+        import torch
+
         datas: list[Tensor] = []
         # extract the norms in order
         for xid in range(n_head):
@@ -1577,8 +1810,6 @@ class LlamaModel(Model):
                 .swapaxes(1, 2)
                 .reshape(weights.shape))
 
-    _experts: list[dict[str, Tensor]] | None = None
-
     def modify_tensors(self, data_torch: Tensor, name: str, bid: int | None) -> Iterable[tuple[str, Tensor]]:
         n_head = self.hparams["num_attention_heads"]
         n_kv_head = self.hparams.get("num_key_value_heads")
@@ -1594,37 +1825,18 @@ class LlamaModel(Model):
 
             assert bid is not None
 
-            if self._experts is None:
-                self._experts = [{} for _ in range(self.block_count)]
-
-            self._experts[bid][name] = data_torch
-
-            if len(self._experts[bid]) >= n_experts * 3:
-                tensors: list[tuple[str, Tensor]] = []
-
-                # merge the experts into a single 3d tensor
-                for wid in ["w1", "w2", "w3"]:
-                    datas: list[Tensor] = []
+            # model.layers.{bid}.block_sparse_moe.experts.{xid}.{wid}.weight
+            xid, wid = name.split(".")[-3:-1]
+            self.add_expert(f"layers.{bid}.feed_forward.experts.{wid}.weight", int(xid), n_experts, data_torch)
 
-                    for xid in range(n_experts):
-                        ename = f"model.layers.{bid}.block_sparse_moe.experts.{xid}.{wid}.weight"
-                        datas.append(self._experts[bid][ename])
-                        del self._experts[bid][ename]
-
-                    data_torch = torch.stack(datas, dim=0)
-
-                    merged_name = f"layers.{bid}.feed_forward.experts.{wid}.weight"
-
-                    new_name = self.map_tensor_name(merged_name)
-
-                    tensors.append((new_name, data_torch))
-                return tensors
-            else:
-                return []
+            # merge the experts into a single 3d tensor
+            return self.pop_merged_experts([f"layers.{bid}.feed_forward.experts.{wid}.weight" for wid in ["w1", "w2", "w3"]])
 
         return [(self.map_tensor_name(name), data_torch)]
 
     def generate_extra_tensors(self) -> Iterable[tuple[str, Tensor]]:
+        import torch
+
         if rope_scaling := self.find_hparam(["rope_scaling"], optional=True):
             if rope_scaling.get("rope_type", '').lower() == "llama3":
                 base = self.hparams.get("rope_theta", 10000.0)
@@ -1653,15 +1865,6 @@ class LlamaModel(Model):
 
                 yield (self.format_tensor_name(gguf.MODEL_TENSOR.ROPE_FREQS), torch.tensor(rope_factors, dtype=torch.float32))
 
-    def prepare_tensors(self):
-        super().prepare_tensors()
-
-        if self._experts is not None:
-            # flatten `list[dict[str, Tensor]]` into `list[str]`
-            experts = [k for d in self._experts for k in d.keys()]
-            if len(experts) > 0:
-                raise ValueError(f"Unprocessed experts: {experts}")
-
 
 @Model.register("BitnetForCausalLM")
 class BitnetModel(Model):
@@ -1717,8 +1920,6 @@ class GrokModel(Model):
     def set_gguf_parameters(self):
         super().set_gguf_parameters()
 
-    _experts: list[dict[str, Tensor]] | None = None
-
     def modify_tensors(self, data_torch: Tensor, name: str, bid: int | None) -> Iterable[tuple[str, Tensor]]:
         # process the experts separately
         if name.find(".moe.") != -1:
@@ -1726,33 +1927,12 @@ class GrokModel(Model):
 
             assert bid is not None
 
-            if self._experts is None:
-                self._experts = [{} for _ in range(self.block_count)]
-
-            self._experts[bid][name] = data_torch
-
-            if len(self._experts[bid]) >= n_experts * 3:
-                tensors: list[tuple[str, Tensor]] = []
-
-                # merge the experts into a single 3d tensor
-                for wid in ["linear", "linear_1", "linear_v"]:
-                    datas: list[Tensor] = []
+            # transformer.decoder_layer.{bid}.moe.{xid}.{wid}.weight
+            xid, wid = name.split(".")[-3:-1]
+            self.add_expert(f"transformer.decoder_layer.{bid}.moe.{wid}.weight", int(xid), n_experts, data_torch)
 
-                    for xid in range(n_experts):
-                        ename = f"transformer.decoder_layer.{bid}.moe.{xid}.{wid}.weight"
-                        datas.append(self._experts[bid][ename])
-                        del self._experts[bid][ename]
-
-                    data_torch = torch.stack(datas, dim=0)
-
-                    merged_name = f"transformer.decoder_layer.{bid}.moe.{wid}.weight"
-
-                    new_name = self.map_tensor_name(merged_name)
-
-                    tensors.append((new_name, data_torch))
-                return tensors
-            else:
-                return []
+            # merge the experts into a single 3d tensor
+            return self.pop_merged_experts([f"transformer.decoder_layer.{bid}.moe.{wid}.weight" for wid in ["linear", "linear_1", "linear_v"]])
 
         return [(self.map_tensor_name(name), data_torch)]
 
@@ -1893,6 +2073,8 @@ class MiniCPM3Model(Model):
         self.gguf_writer.add_rope_dimension_count(hparams["qk_rope_head_dim"])
 
     def generate_extra_tensors(self) -> Iterable[tuple[str, Tensor]]:
+        import torch
+
         rope_scaling = self.find_hparam(['rope_scaling'], True)
         if rope_scaling is not None:
             rope_dims = self.hparams["qk_rope_head_dim"]
@@ -1929,26 +2111,11 @@ class QwenModel(Model):
 
     @staticmethod
     def token_bytes_to_string(b):
-        from transformers.models.gpt2.tokenization_gpt2 import bytes_to_unicode
-        byte_encoder = bytes_to_unicode()
-        return ''.join([byte_encoder[ord(char)] for char in b.decode('latin-1')])
+        return gguf.token_bytes_to_string(b)
 
     @staticmethod
     def bpe(mergeable_ranks: dict[bytes, int], token: bytes, max_rank: int | None = None) -> list[bytes]:
-        parts = [bytes([b]) for b in token]
-        while True:
-            min_idx = None
-            min_rank = None
-            for i, pair in enumerate(zip(parts[:-1], parts[1:])):
-                rank = mergeable_ranks.get(pair[0] + pair[1])
-                if rank is not None and (min_rank is None or rank < min_rank):
-                    min_idx = i
-                    min_rank = rank
-            if min_rank is None or (max_rank is not None and min_rank >= max_rank):
-                break
-            assert min_idx is not None
-            parts = parts[:min_idx] + [parts[min_idx] + parts[min_idx + 1]] + parts[min_idx + 2:]
-        return parts
+        return gguf.bpe_merge(mergeable_ranks, token, max_rank=max_rank)
 
     def set_vocab(self):
         self._set_vocab_qwen()
@@ -1991,53 +2158,21 @@ class Qwen2MoeModel(Model):
             self.gguf_writer.add_expert_shared_feed_forward_length(shared_expert_intermediate_size)
             logger.info(f"gguf: expert shared feed forward length = {shared_expert_intermediate_size}")
 
-    _experts: list[dict[str, Tensor]] | None = None
-
     def modify_tensors(self, data_torch: Tensor, name: str, bid: int | None) -> Iterable[tuple[str, Tensor]]:
         # process the experts separately
         if name.find("experts") != -1:
             n_experts = self.hparams["num_experts"]
             assert bid is not None
 
-            if self._experts is None:
-                self._experts = [{} for _ in range(self.block_count)]
-
-            self._experts[bid][name] = data_torch
-
-            if len(self._experts[bid]) >= n_experts * 3:
-                tensors: list[tuple[str, Tensor]] = []
-
-                # merge the experts into a single 3d tensor
-                for w_name in ["down_proj", "gate_proj", "up_proj"]:
-                    datas: list[Tensor] = []
-
-                    for xid in range(n_experts):
-                        ename = f"model.layers.{bid}.mlp.experts.{xid}.{w_name}.weight"
-                        datas.append(self._experts[bid][ename])
-                        del self._experts[bid][ename]
-
-                    data_torch = torch.stack(datas, dim=0)
-
-                    merged_name = f"model.layers.{bid}.mlp.experts.{w_name}.weight"
+            # model.layers.{bid}.mlp.experts.{xid}.{w_name}.weight
+            xid, w_name = name.split(".")[-3:-1]
+            self.add_expert(f"model.layers.{bid}.mlp.experts.{w_name}.weight", int(xid), n_experts, data_torch)
 
-                    new_name = self.map_tensor_name(merged_name)
-
-                    tensors.append((new_name, data_torch))
-                return tensors
-            else:
-                return []
+            # merge the experts into a single 3d tensor
+            return self.pop_merged_experts([f"model.layers.{bid}.mlp.experts.{w_name}.weight" for w_name in ["down_proj", "gate_proj", "up_proj"]])
 
         return [(self.map_tensor_name(name), data_torch)]
 
-    def prepare_tensors(self):
-        super().prepare_tensors()
-
-        if self._experts is not None:
-            # flatten `list[dict[str, Tensor]]` into `list[str]`
-            experts = [k for d in self._experts for k in d.keys()]
-            if len(experts) > 0:
-                raise ValueError(f"Unprocessed experts: {experts}")
-
 
 @Model.register("GPT2LMHeadModel")
 class GPT2Model(Model):
@@ -2223,6 +2358,8 @@ class Phi3MiniModel(Model):
         self.gguf_writer.add_sliding_window(self.find_hparam(["sliding_window"]))
 
     def generate_extra_tensors(self) -> Iterable[tuple[str, Tensor]]:
+        import torch
+
         n_embd = self.find_hparam(["hidden_size", "n_embd"])
         n_head = self.find_hparam(["num_attention_heads", "n_head"])
         max_pos_embds = self.find_hparam(["n_positions", "max_position_embeddings"])
@@ -2283,6 +2420,8 @@ class PlamoModel(Model):
         self.gguf_writer.add_file_type(self.ftype)
 
     def shuffle_attn_q_weight(self, data_torch):
+        import torch
+
         assert data_torch.size() == (5120, 5120)
         data_torch = data_torch.reshape(8, 5, 128, 5120)
         data_torch = torch.permute(data_torch, (1, 0, 2, 3))
@@ -2290,6 +2429,8 @@ class PlamoModel(Model):
         return data_torch
 
     def shuffle_attn_output_weight(self, data_torch):
+        import torch
+
         assert data_torch.size() == (5120, 5120)
         data_torch = data_torch.reshape(5120, 8, 5, 128)
         data_torch = torch.permute(data_torch, (0, 2, 1, 3))
@@ -2972,6 +3113,8 @@ class MambaModel(Model):
     _tok_embd = None
 
     def modify_tensors(self, data_torch: Tensor, name: str, bid: int | None) -> Iterable[tuple[str, Tensor]]:
+        import torch
+
         del bid  # unused
 
         output_name = self.format_tensor_name(gguf.MODEL_TENSOR.OUTPUT)
@@ -3055,8 +3198,6 @@ class OlmoeModel(Model):
         if (n_experts := self.hparams.get("num_experts")) is not None:
             self.gguf_writer.add_expert_count(n_experts)
 
-    _experts: list[dict[str, Tensor]] | None = None
-
     # Copied from: Qwen2MoeModel
     def modify_tensors(self, data_torch: Tensor, name: str, bid: int | None) -> Iterable[tuple[str, Tensor]]:
         # process the experts separately
@@ -3064,46 +3205,15 @@ class OlmoeModel(Model):
             n_experts = self.hparams["num_experts"]
             assert bid is not None
 
-            if self._experts is None:
-                self._experts = [{} for _ in range(self.block_count)]
-
-            self._experts[bid][name] = data_torch
-
-            if len(self._experts[bid]) >= n_experts * 3:
-                tensors: list[tuple[str, Tensor]] = []
-
-                # merge the experts into a single 3d tensor
-                for w_name in ["down_proj", "gate_proj", "up_proj"]:
-                    datas: list[Tensor] = []
-
-                    for xid in range(n_experts):
-                        ename = f"model.layers.{bid}.mlp.experts.{xid}.{w_name}.weight"
-                        datas.append(self._experts[bid][ename])
-                        del self._experts[bid][ename]
+            # model.layers.{bid}.mlp.experts.{xid}.{w_name}.weight
+            xid, w_name = name.split(".")[-3:-1]
+            self.add_expert(f"model.layers.{bid}.mlp.experts.{w_name}.weight", int(xid), n_experts, data_torch)
 
-                    data_torch = torch.stack(datas, dim=0)
-
-                    merged_name = f"model.layers.{bid}.mlp.experts.{w_name}.weight"
-
-                    new_name = self.map_tensor_name(merged_name)
-
-                    tensors.append((new_name, data_torch))
-                return tensors
-            else:
-                return []
+            # merge the experts into a single 3d tensor
+            return self.pop_merged_experts([f"model.layers.{bid}.mlp.experts.{w_name}.weight" for w_name in ["down_proj", "gate_proj", "up_proj"]])
 
         return [(self.map_tensor_name(name), data_torch)]
 
-    # Copied from: Qwen2MoeModel
-    def prepare_tensors(self):
-        super().prepare_tensors()
-
-        if self._experts is not None:
-            # flatten `list[dict[str, Tensor]]` into `list[str]`
-            experts = [k for d in self._experts for k in d.keys()]
-            if len(experts) > 0:
-                raise ValueError(f"Unprocessed experts: {experts}")
-
 
 @Model.register("JinaBertModel", "JinaBertForMaskedLM")
 class JinaBertV2Model(BertModel):
@@ -3321,8 +3431,6 @@ class ArcticModel(Model):
         self.gguf_writer.add_vocab_size(hparams["vocab_size"])
         self.gguf_writer.add_rope_dimension_count(hparams["hidden_size"] // hparams["num_attention_heads"])
 
-    _experts: list[dict[str, Tensor]] | None = None
-
     def modify_tensors(self, data_torch: Tensor, name: str, bid: int | None) -> Iterable[tuple[str, Tensor]]:
         n_head = self.hparams["num_attention_heads"]
         n_kv_head = self.hparams.get("num_key_value_heads")
@@ -3338,45 +3446,15 @@ class ArcticModel(Model):
 
             assert bid is not None
 
-            if self._experts is None:
-                self._experts = [{} for _ in range(self.block_count)]
-
-            self._experts[bid][name] = data_torch
-
-            if len(self._experts[bid]) >= n_experts * 3:
-                tensors: list[tuple[str, Tensor]] = []
-
-                # merge the experts into a single 3d tensor
-                for wid in ["w1", "w2", "w3"]:
-                    datas: list[Tensor] = []
-
-                    for xid in range(n_experts):
-                        ename = f"model.layers.{bid}.block_sparse_moe.experts.{xid}.{wid}.weight"
-                        datas.append(self._experts[bid][ename])
-                        del self._experts[bid][ename]
-
-                    data_torch = torch.stack(datas, dim=0)
+            # model.layers.{bid}.block_sparse_moe.experts.{xid}.{wid}.weight
+            xid, wid = name.split(".")[-3:-1]
+            self.add_expert(f"layers.{bid}.feed_forward.experts.{wid}.weight", int(xid), n_experts, data_torch)
 
-                    merged_name = f"layers.{bid}.feed_forward.experts.{wid}.weight"
-
-                    new_name = self.map_tensor_name(merged_name)
-
-                    tensors.append((new_name, data_torch))
-                return tensors
-            else:
-                return []
+            # merge the experts into a single 3d tensor
+            return self.pop_merged_experts([f"layers.{bid}.feed_forward.experts.{wid}.weight" for wid in ["w1", "w2", "w3"]])
 
         return [(self.map_tensor_name(name), data_torch)]
 
-    def prepare_tensors(self):
-        super().prepare_tensors()
-
-        if self._experts is not None:
-            # flatten `list[dict[str, Tensor]]` into `list[str]`
-            experts = [k for d in self._experts for k in d.keys()]
-            if len(experts) > 0:
-                raise ValueError(f"Unprocessed experts: {experts}")
-
 
 @Model.register("DeepseekV2ForCausalLM")
 class DeepseekV2Model(Model):
@@ -3409,53 +3487,21 @@ class DeepseekV2Model(Model):
                 self.gguf_writer.add_rope_scaling_orig_ctx_len(self.hparams["rope_scaling"]["original_max_position_embeddings"])
                 self.gguf_writer.add_rope_scaling_yarn_log_mul(0.1 * hparams["rope_scaling"]["mscale_all_dim"])
 
-    _experts: list[dict[str, Tensor]] | None = None
-
     def modify_tensors(self, data_torch: Tensor, name: str, bid: int | None) -> Iterable[tuple[str, Tensor]]:
         # process the experts separately
         if name.find("mlp.experts") != -1:
             n_experts = self.hparams["n_routed_experts"]
             assert bid is not None
 
-            if self._experts is None:
-                self._experts = [{} for _ in range(self.block_count)]
-
-            self._experts[bid][name] = data_torch
+            # model.layers.{bid}.mlp.experts.{xid}.{w_name}.weight
+            xid, w_name = name.split(".")[-3:-1]
+            self.add_expert(f"model.layers.{bid}.mlp.experts.{w_name}.weight", int(xid), n_experts, data_torch)
 
-            if len(self._experts[bid]) >= n_experts * 3:
-                tensors: list[tuple[str, Tensor]] = []
-
-                # merge the experts into a single 3d tensor
-                for w_name in ["down_proj", "gate_proj", "up_proj"]:
-                    datas: list[Tensor] = []
-
-                    for xid in range(n_experts):
-                        ename = f"model.layers.{bid}.mlp.experts.{xid}.{w_name}.weight"
-                        datas.append(self._experts[bid][ename])
-                        del self._experts[bid][ename]
-
-                    data_torch = torch.stack(datas, dim=0)
-
-                    merged_name = f"model.layers.{bid}.mlp.experts.{w_name}.weight"
-
-                    new_name = self.map_tensor_name(merged_name)
-
-                    tensors.append((new_name, data_torch))
-                return tensors
-            else:
-                return []
+            # merge the experts into a single 3d tensor
+            return self.pop_merged_experts([f"model.layers.{bid}.mlp.experts.{w_name}.weight" for w_name in ["down_proj", "gate_proj", "up_proj"]])
 
         return [(self.map_tensor_name(name), data_torch)]
 
-    def prepare_tensors(self):
-        super().prepare_tensors()
-
-        if self._experts is not None:
-            # flatten `list[dict[str, Tensor]]` into `list[str]`
-            experts = [k for d in self._experts for k in d.keys()]
-            if len(experts) > 0:
-                raise ValueError(f"Unprocessed experts: {experts}")
-
 
 @Model.register("T5WithLMHeadModel")
 @Model.register("T5ForConditionalGeneration")
@@ -3895,26 +3941,11 @@ class ChatGLMModel(Model):
 
     @staticmethod
     def token_bytes_to_string(b):
-        from transformers.models.gpt2.tokenization_gpt2 import bytes_to_unicode
-        byte_encoder = bytes_to_unicode()
-        return ''.join([byte_encoder[ord(char)] for char in b.decode('latin-1')])
+        return gguf.token_bytes_to_string(b)
 
     @staticmethod
     def bpe(mergeable_ranks: dict[bytes, int], token: bytes, max_rank: int | None = None) -> list[bytes]:
-        parts = [bytes([b]) for b in token]
-        while True:
-            min_idx = None
-            min_rank = None
-            for i, pair in enumerate(zip(parts[:-1], parts[1:])):
-                rank = mergeable_ranks.get(pair[0] + pair[1])
-                if rank is not None and (min_rank is None or rank < min_rank):
-                    min_idx = i
-                    min_rank = rank
-            if min_rank is None or (max_rank is not None and min_rank >= max_rank):
-                break
-            assert min_idx is not None
-            parts = parts[:min_idx] + [parts[min_idx] + parts[min_idx + 1]] + parts[min_idx + 2:]
-        return parts
+        return gguf.bpe_merge(mergeable_ranks, token, max_rank=max_rank)
 
     def set_vocab(self):
         if "THUDM/chatglm3-6b" in self.hparams.get("_name_or_path", ""):
@@ -3937,12 +3968,10 @@ class ChatGLMModel(Model):
         vocab = {}
         mergeable_ranks = tokenizer.mergeable_ranks
         for token, rank in mergeable_ranks.items():
-            vocab[ChatGLMModel.token_bytes_to_string(token)] = rank
-            if len(token) == 1:
-                continue
-            merged = ChatGLMModel.bpe(mergeable_ranks, token, max_rank=rank)
+            vocab[gguf.token_bytes_to_string(token)] = rank
+        for merged in gguf.tiktoken_merges(mergeable_ranks, n_workers=self.thread_count):
             assert len(merged) >= 2 and len(merged) <= 7
-            merges.append(' '.join(map(ChatGLMModel.token_bytes_to_string, merged)))
+            merges.append(' '.join(map(gguf.token_bytes_to_string, merged)))
 
         # for this kind of tokenizer, added_vocab is not a subset of vocab, so they need to be combined
         added_vocab = tokenizer.get_added_vocab()
@@ -4086,6 +4115,8 @@ class ExaoneModel(Model):
                 self.gguf_writer.add_rope_scaling_factor(hparams["rope_scaling"]["factor"])
 
     def generate_extra_tensors(self) -> Iterable[tuple[str, Tensor]]:
+        import torch
+
         if rope_scaling := self.find_hparam(["rope_scaling"], optional=True):
             if rope_scaling.get("rope_type", '').lower() == "llama3":
                 base = self.hparams.get("rope_theta", 10000.0)
@@ -4218,70 +4249,57 @@ class ChameleonModel(Model):
 ###### CONVERSION LOGIC ######
 
 
-# tree of lazy tensors
-class LazyTorchTensor(gguf.LazyBase):
-    _tensor_type = torch.Tensor
-    # to keep the type-checker happy
-    dtype: torch.dtype
-    shape: torch.Size
-
-    # only used when converting a torch.Tensor to a np.ndarray
-    _dtype_map: dict[torch.dtype, type] = {
-        torch.float16: np.float16,
-        torch.float32: np.float32,
-    }
-
-    # used for safetensors slices
-    # ref: https://github.com/huggingface/safetensors/blob/079781fd0dc455ba0fe851e2b4507c33d0c0d407/bindings/python/src/lib.rs#L1046
-    # TODO: uncomment U64, U32, and U16, ref: https://github.com/pytorch/pytorch/issues/58734
-    _dtype_str_map: dict[str, torch.dtype] = {
-        "F64": torch.float64,
-        "F32": torch.float32,
-        "BF16": torch.bfloat16,
-        "F16": torch.float16,
-        # "U64": torch.uint64,
-        "I64": torch.int64,
-        # "U32": torch.uint32,
-        "I32": torch.int32,
-        # "U16": torch.uint16,
-        "I16": torch.int16,
-        "U8": torch.uint8,
-        "I8": torch.int8,
-        "BOOL": torch.bool,
-        "F8_E4M3": torch.float8_e4m3fn,
-        "F8_E5M2": torch.float8_e5m2,
-    }
-
-    def numpy(self) -> gguf.LazyNumpyTensor:
-        dtype = self._dtype_map[self.dtype]
-        return gguf.LazyNumpyTensor(
-            meta=gguf.LazyNumpyTensor.meta_with_dtype_and_shape(dtype, self.shape),
-            args=(self,),
-            func=(lambda s: s.numpy())
-        )
-
-    @classmethod
-    def meta_with_dtype_and_shape(cls, dtype: torch.dtype, shape: tuple[int, ...]) -> Tensor:
-        return torch.empty(size=shape, dtype=dtype, device="meta")
-
-    @classmethod
-    def from_safetensors_slice(cls, st_slice: Any) -> Tensor:
-        dtype = cls._dtype_str_map[st_slice.get_dtype()]
-        shape: tuple[int, ...] = tuple(st_slice.get_shape())
-        lazy = cls(meta=cls.meta_with_dtype_and_shape(dtype, shape), args=(st_slice,), func=lambda s: s[:])
-        return cast(torch.Tensor, lazy)
+# The tensors of the experts of a layer of a MoE model, merged into a 3d tensor.
+# Eager tensors are copied into the merged tensor as soon as they're added,
+# and lazy tensors are evaluated one at a time directly into it (see LazyTorchTensor.stack),
+# instead of keeping all of them until they are stacked.
+class ExpertStack:
+    merged_name: str
+    datas: list[Tensor | None]
+    added: list[bool]
+    stacked: Tensor | None
+
+    def __init__(self, merged_name: str, n_experts: int):
+        self.merged_name = merged_name
+        self.datas = [None] * n_experts
+        self.added = [False] * n_experts
+        self.stacked = None
+
+    def add(self, xid: int, data_torch: Tensor):
+        import torch
+
+        if self.added[xid]:
+            raise ValueError(f"Duplicate expert {xid} for {self.merged_name!r}")
+        self.added[xid] = True
+        # (other tensor-like types, like the ones of LoRA adapters, are simply kept for torch.stack)
+        if type(data_torch) is not torch.Tensor:
+            self.datas[xid] = data_torch
+            return
+        if self.stacked is None:
+            self.stacked = torch.empty((len(self.datas), *data_torch.shape), dtype=data_torch.dtype)
+        if data_torch.shape != self.stacked.shape[1:] or data_torch.dtype != self.stacked.dtype:
+            raise ValueError(f"Expert {xid} of {self.merged_name!r} has shape {tuple(data_torch.shape)} and type {data_torch.dtype}, "
+                             f"but expected {tuple(self.stacked.shape[1:])} and {self.stacked.dtype}")
+        self.stacked[xid] = data_torch
 
-    @classmethod
-    def __torch_function__(cls, func, types, args=(), kwargs=None):
-        del types  # unused
+    def is_complete(self) -> bool:
+        return all(self.added)
 
-        if kwargs is None:
-            kwargs = {}
+    def missing_experts(self) -> str:
+        return f"{self.merged_name} (missing experts {[xid for xid, added in enumerate(self.added) if not added]})"
 
-        if func is torch.Tensor.numpy:
-            return args[0].numpy()
+    def stack(self) -> Tensor:
+        import torch
+        from gguf.lazy_torch import LazyTorchTensor
 
-        return cls._wrap_fn(func)(*args, **kwargs)
+        assert self.is_complete()
+        if self.stacked is not None:
+            return self.stacked
+        datas = [data for data in self.datas if data is not None]
+        lazy_datas = [data for data in datas if isinstance(data, LazyTorchTensor)]
+        if len(lazy_datas) == len(datas):
+            return LazyTorchTensor.stack(lazy_datas)
+        return torch.stack(datas, dim=0)
 
 
 def parse_args() -> argparse.Namespace:
@@ -4296,8 +4314,9 @@ def parse_args() -> argparse.Namespace:
         help="path to write to; default: based on input. {ftype} will be replaced by the outtype.",
     )
     parser.add_argument(
-        "--outtype", type=str, choices=["f32", "f16", "bf16", "q8_0", "tq1_0", "tq2_0", "auto"], default="f16",
-        help="output format - use f32 for float32, f16 for float16, bf16 for bfloat16, q8_0 for Q8_0, tq1_0 or tq2_0 for ternary, and auto for the highest-fidelity 16-bit float type depending on the first loaded tensor type",
+        "--outtype", type=str, default="f16",
+        choices=["f32", "f16", "bf16", "q8_0", "q2_k", "q3_k_s", "q3_k_m", "q3_k_l", "q4_k_s", "q4_k_m", "q5_k_s", "q5_k_m", "q6_k", "iq4_nl", "iq4_xs", "tq1_0", "tq2_0", "auto"],
+        help="output format - use f32 for float32, f16 for float16, bf16 for bfloat16, q8_0 for Q8_0, q2_k to q6_k for the K-quant mixes and iq4_nl or iq4_xs for the 4-bit non-linear mixes (same as llama-quantize), tq1_0 or tq2_0 for ternary, and auto for the highest-fidelity 16-bit float type depending on the first loaded tensor type",
     )
     parser.add_argument(
         "--bigendian", action="store_true",
@@ -4343,6 +4362,30 @@ def parse_args() -> argparse.Namespace:
         "--metadata", type=Path,
         help="Specify the path for an authorship metadata override file"
     )
+    parser.add_argument(
+        "--threads", type=int, default=1,
+        help="number of threads used to evaluate (read, modify, cast and quantize) the tensors in parallel while writing, the shards of a split model being written at the same time (and of processes used to find the merges of tiktoken vocabularies); the output is identical to a single-threaded conversion",
+    )
+    parser.add_argument(
+        "--max-inflight-size", type=str, default="4G",
+        help="max total size N(M|G) of converted tensors held in memory ahead of the writer when using --threads",
+    )
+    parser.add_argument(
+        "--imatrix", type=Path, default=None,
+        help="importance matrix file (from llama-imatrix) to improve the quality of the quantized tensors",
+    )
+    parser.add_argument(
+        "--load-order", action="store_true",
+        help="write the tensors in the order they are used at runtime (token embeddings, then block by block, then output), for faster cold starts with mmap",
+    )
+    parser.add_argument(
+        "--data-alignment", type=int, default=None,
+        help="alignment of the tensor data in bytes, a power of 2, e.g. 2097152 (2 MiB) for transparent huge pages (default: 32)",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true",
+        help="do not cache the hash of the pre-tokenizer (chkhsh.json in $LLAMA_CACHE, by default ~/.cache/llama.cpp), the tokenizer is then loaded at each conversion",
+    )
 
     return parser.parse_args()
 
@@ -4384,6 +4427,17 @@ def main() -> None:
         "f16": gguf.LlamaFileType.MOSTLY_F16,
         "bf16": gguf.LlamaFileType.MOSTLY_BF16,
         "q8_0": gguf.LlamaFileType.MOSTLY_Q8_0,
+        "q2_k": gguf.LlamaFileType.MOSTLY_Q2_K,
+        "q3_k_s": gguf.LlamaFileType.MOSTLY_Q3_K_S,
+        "q3_k_m": gguf.LlamaFileType.MOSTLY_Q3_K_M,
+        "q3_k_l": gguf.LlamaFileType.MOSTLY_Q3_K_L,
+        "q4_k_s": gguf.LlamaFileType.MOSTLY_Q4_K_S,
+        "q4_k_m": gguf.LlamaFileType.MOSTLY_Q4_K_M,
+        "q5_k_s": gguf.LlamaFileType.MOSTLY_Q5_K_S,
+        "q5_k_m": gguf.LlamaFileType.MOSTLY_Q5_K_M,
+        "q6_k": gguf.LlamaFileType.MOSTLY_Q6_K,
+        "iq4_nl": gguf.LlamaFileType.MOSTLY_IQ4_NL,
+        "iq4_xs": gguf.LlamaFileType.MOSTLY_IQ4_XS,
         "tq1_0": gguf.LlamaFileType.MOSTLY_TQ1_0,
         "tq2_0": gguf.LlamaFileType.MOSTLY_TQ2_0,
         "auto": gguf.LlamaFileType.GUESSED,
@@ -4394,6 +4448,10 @@ def main() -> None:
         logger.error("Error: Cannot use temp file when splitting")
         sys.exit(1)
 
+    if args.use_temp_file and args.load_order:
+        logger.error("Error: Cannot use temp file when reordering the tensors")
+        sys.exit(1)
+
     if args.outfile is not None:
         fname_out = args.outfile
     else:
@@ -4403,7 +4461,7 @@ def main() -> None:
 
     hparams = Model.load_hparams(dir_model)
 
-    with torch.inference_mode():
+    with contextlib.ExitStack() as exit_stack:
         output_type = ftype_map[args.outtype]
         model_architecture = hparams["architectures"][0]
 
@@ -4419,7 +4477,15 @@ def main() -> None:
                                      metadata_override=args.metadata, model_name=args.model_name,
                                      split_max_tensors=args.split_max_tensors,
                                      split_max_size=split_str_to_n_bytes(args.split_max_size), dry_run=args.dry_run,
-                                     small_first_shard=args.no_tensor_first_split)
+                                     small_first_shard=args.no_tensor_first_split,
+                                     thread_count=args.threads,
+                                     max_inflight_size=split_str_to_n_bytes(args.max_inflight_size),
+                                     imatrix=args.imatrix, load_order=args.load_order,
+                                     data_alignment=args.data_alignment, use_cache=not args.no_cache)
+
+        if model_instance.uses_torch():
+            import torch
+            exit_stack.enter_context(torch.inference_mode())
 
         if args.vocab_only:
             logger.info("Exporting model vocab...")
@@ -211,7 +211,7 @@ for model in models:
     src_ifs += f"            res = \"{name}\"\n"
 
 src_func = f"""
-    def get_vocab_base_pre(self, tokenizer) -> str:
+    def get_vocab_base_pre(self, tokenizer=None) -> str:
         # encoding this string and hashing the resulting tokens would (hopefully) give us a unique identifier that
         # is specific for the BPE pre-tokenizer used by the model
         # we will use this unique identifier to write a "tokenizer.ggml.pre" entry in the GGUF file which we can
@@ -219,10 +219,19 @@ src_func = f"""
 
         chktxt = {repr(CHK_TXT)}
 
-        chktok = tokenizer.encode(chktxt)
-        chkhsh = sha256(str(chktok).encode()).hexdigest()
+        # the hash only depends on the tokenizer files, so it's cached to avoid loading the tokenizer again
+        def get_chkhsh() -> str:
+            nonlocal tokenizer
+            if tokenizer is None:
+                from transformers import AutoTokenizer
+                tokenizer = AutoTokenizer.from_pretrained(self.dir_model)
+
+            chktok = tokenizer.encode(chktxt)
+            logger.debug(f"chktok: {{chktok}}")
+            return sha256(str(chktok).encode()).hexdigest()
+
+        chkhsh = gguf.cached_chkhsh(self.dir_model, chktxt, get_chkhsh, use_cache=self.use_cache)
 
-        logger.debug(f"chktok: {{chktok}}")
         logger.debug(f"chkhsh: {{chkhsh}}")
 
         res = None
@@ -1,8 +1,11 @@
 from .constants import *
 from .lazy import *
 from .gguf_reader import *
+from .safetensors_reader import *
+from .safetensors_writer import *
 from .gguf_writer import *
 from .quants import *
+from .imatrix import *
 from .tensor_mapping import *
 from .vocab import *
 from .utility import *
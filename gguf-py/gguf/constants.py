@@ -197,6 +197,12 @@ class Keys:
         TYPE       = "adapter.type"
         LORA_ALPHA = "adapter.lora.alpha"
 
+    class Quantize:
+        IMATRIX_FILE          = "quantize.imatrix.file"
+        IMATRIX_DATASET       = "quantize.imatrix.dataset"
+        IMATRIX_ENTRIES_COUNT = "quantize.imatrix.entries_count"
+        IMATRIX_CHUNKS_COUNT  = "quantize.imatrix.chunks_count"
+
 #
 # recommended mapping of model tensor names for storage in gguf
 #
@@ -1531,7 +1537,7 @@ GGML_QUANT_SIZES: dict[GGMLQuantizationType, tuple[int, int]] = {
     GGMLQuantizationType.Q5_0:    (32, 2 + 4 + 16),
     GGMLQuantizationType.Q5_1:    (32, 2 + 2 + 4 + 16),
     GGMLQuantizationType.Q8_0:    (32, 2 + 32),
-    GGMLQuantizationType.Q8_1:    (32, 4 + 4 + 32),
+    GGMLQuantizationType.Q8_1:    (32, 2 + 2 + 32),
     GGMLQuantizationType.Q2_K:    (256, 2 + 2 + QK_K // 16 + QK_K // 4),
     GGMLQuantizationType.Q3_K:    (256, 2 + QK_K // 4 + QK_K // 8 + 12),
     GGMLQuantizationType.Q4_K:    (256, 2 + 2 + QK_K // 2 + 12),
@@ -6,18 +6,21 @@ from __future__ import annotations
 
 import logging
 import os
+import re
+import struct
+import sys
+from bisect import bisect_right
 from collections import OrderedDict
-from typing import Any, Literal, NamedTuple, TypeVar, Union
+from pathlib import Path
+from typing import IO, Any, Iterator, Literal, NamedTuple, Sequence, TypeVar, Union, overload
 
 import numpy as np
 import numpy.typing as npt
 
+from .gguf_writer import SHARD_NAME_FORMAT
 from .quants import quant_shape_to_byte_shape
 
 if __name__ == "__main__":
-    import sys
-    from pathlib import Path
-
     # Allow running file in package as a script.
     sys.path.insert(0, str(Path(__file__).parent.parent))
 
@@ -28,6 +31,7 @@ from gguf.constants import (
     GGUF_VERSION,
     GGMLQuantizationType,
     GGUFValueType,
+    Keys,
 )
 
 logger = logging.getLogger(__name__)
@@ -35,6 +39,13 @@ logger = logging.getLogger(__name__)
 READER_SUPPORTED_VERSIONS = [2, GGUF_VERSION]
 
 
+class _DataTooShort(ValueError):
+    # Raised when parsing needs data past the end of what was read (up to the offset end).
+    def __init__(self, end: int):
+        super().__init__(f'Unexpected end of file, {end} bytes are needed')
+        self.end = end
+
+
 class ReaderField(NamedTuple):
     # Offset to start of this field.
     offset: int
@@ -53,6 +64,170 @@ class ReaderField(NamedTuple):
 
     types: list[GGUFValueType] = []
 
+    # Decode the value of the field, or the selected elements for arrays.
+    def contents(self, index_or_slice: int | slice = slice(None)) -> Any:
+        if self.types:
+            def to_string(x: npt.NDArray[Any]) -> str:
+                return str(x.tobytes(), encoding = 'utf-8')
+
+            main_type = self.types[0]
+            if main_type == GGUFValueType.ARRAY:
+                sub_type = self.types[-1]
+                if sub_type == GGUFValueType.STRING:
+                    indices = self.data[index_or_slice]
+                    if isinstance(index_or_slice, int):
+                        return to_string(self.parts[indices]) # type: ignore
+                    else:
+                        return [to_string(self.parts[idx]) for idx in indices] # type: ignore
+                else:
+                    if isinstance(index_or_slice, int):
+                        return self.parts[self.data[index_or_slice]].tolist()[0]
+                    else:
+                        return [pv for idx in self.data[index_or_slice] for pv in self.parts[idx].tolist()]
+            if main_type == GGUFValueType.STRING:
+                return to_string(self.parts[-1])
+            else:
+                return self.parts[-1].tolist()[0]
+        return None
+
+
+class ReaderStringArray(Sequence[str]):
+    # Compact representation of an array of strings: the bytes of the array as they are
+    # in the file (each string is preceded by its length), and an index of the offsets
+    # of the elements in these bytes, followed by the end of the array.
+    # The str objects are only made when the elements are accessed.
+
+    def __init__(self, data: npt.NDArray[np.uint8], offsets: npt.NDArray[np.int64]):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    @overload
+    def __getitem__(self, index: int) -> str: ...
+    @overload
+    def __getitem__(self, index: slice) -> list[str]: ...
+
+    def __getitem__(self, index: int | slice) -> str | list[str]:
+        if isinstance(index, slice):
+            return [str(b, encoding = 'utf-8') for b in self._get_bytes(range(len(self))[index])]
+        return str(self.get_bytes(index), encoding = 'utf-8')
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.tolist())
+
+    # The raw (undecoded) bytes of the selected strings
+    @overload
+    def get_bytes(self, index: int) -> bytes: ...
+    @overload
+    def get_bytes(self, index: slice) -> list[bytes]: ...
+
+    def get_bytes(self, index: int | slice) -> bytes | list[bytes]:
+        if isinstance(index, slice):
+            return self._get_bytes(range(len(self))[index])
+        index = range(len(self))[index]
+        return self._get_bytes(range(index, index + 1))[0]
+
+    def _get_bytes(self, indices: range) -> list[bytes]:
+        if len(indices) == 0:
+            return []
+        # copy all the selected strings at once, and split them afterwards
+        first = min(indices[0], indices[-1])
+        offsets = (self.offsets[first:max(indices[0], indices[-1]) + 2] - self.offsets[first]).tolist()
+        start = int(self.offsets[first])
+        buf = self.data[start:start + offsets[-1]].tobytes()
+        return [buf[offsets[i - first] + 8:offsets[i - first + 1]] for i in indices]
+
+    def tolist(self) -> list[str]:
+        return self[:]
+
+
+class LazyReaderField:
+    # Same interface as ReaderField, but the value is only parsed when it is accessed.
+    # Arrays of fixed-size types are read as a single view of the file,
+    # and arrays of strings as a ReaderStringArray,
+    # which avoids making one view per element when only some fields are needed.
+
+    def __init__(
+        self, reader: GGUFReader, offset: int, name: str, value_offset: int, types: list[GGUFValueType],
+        count: int = 1, strings: ReaderStringArray | None = None,
+    ):
+        self.offset = offset
+        self.name = name
+        self.types = types
+        # Number of elements, for arrays
+        self.count = count
+        self._reader = reader
+        self._value_offset = value_offset
+        self._strings = strings
+        self._parsed: tuple[list[npt.NDArray[Any]], list[int]] | None = None
+        self._array: npt.NDArray[Any] | None = None
+
+    def _parse(self) -> tuple[list[npt.NDArray[Any]], list[int]]:
+        if self._parsed is None:
+            kv_klen, kv_kdata = self._reader._get_str(self.offset)
+            raw_kv_type = self._reader._get(self._value_offset - 4, np.uint32)
+            parts: list[npt.NDArray[Any]] = [kv_klen, kv_kdata, raw_kv_type]
+            idxs_offs = len(parts)
+            _, field_parts, field_idxs, _ = self._reader._get_field_parts(self._value_offset, raw_kv_type[0])
+            self._parsed = (parts + field_parts, [idx + idxs_offs for idx in field_idxs])
+        return self._parsed
+
+    @property
+    def parts(self) -> list[npt.NDArray[Any]]:
+        return self._parse()[0]
+
+    @property
+    def data(self) -> list[int]:
+        if self._parsed is not None:
+            return self._parsed[1]
+        # The indexes into parts can be known without parsing them,
+        # they come after the key length, the key and the value type
+        if self.types[0] == GGUFValueType.STRING:
+            return [4]
+        if self.types[0] != GGUFValueType.ARRAY:
+            return [3]
+        # arrays also have the item type and the length
+        if self.types[-1] == GGUFValueType.STRING:
+            return list(range(6, 6 + 2 * self.count, 2))
+        return list(range(5, 5 + self.count))
+
+    # The elements of an array of a fixed-size type, as a single view of the file.
+    def array(self) -> npt.NDArray[Any]:
+        if self._array is None:
+            if self.types[0] != GGUFValueType.ARRAY:
+                raise ValueError(f'Field {self.name} is not an array')
+            if len(self.types) < 2:
+                return np.empty(0)
+            nptype = self._reader.gguf_scalar_to_np.get(self.types[1])
+            if nptype is None:
+                raise ValueError(f'Field {self.name} is not an array of a fixed-size type')
+            self._array = self._reader._get(self._value_offset + 12, nptype, self.count)
+        return self._array
+
+    # The elements of an array of strings.
+    def strings(self) -> ReaderStringArray:
+        if self._strings is None:
+            if self.types[0] != GGUFValueType.ARRAY or len(self.types) > 1:
+                raise ValueError(f'Field {self.name} is not an array of strings')
+            # empty array
+            self._strings = ReaderStringArray(np.empty(0, dtype = np.uint8), np.zeros(1, dtype = np.int64))
+        return self._strings
+
+    def contents(self, index_or_slice: int | slice = slice(None)) -> Any:
+        main_type = self.types[0]
+        if main_type == GGUFValueType.ARRAY:
+            if len(self.types) < 2:
+                return [][index_or_slice]
+            if self.types[1] == GGUFValueType.STRING:
+                return self.strings()[index_or_slice]
+            return self.array()[index_or_slice].tolist()
+        if main_type == GGUFValueType.STRING:
+            slen = self._reader._get(self._value_offset, np.uint64)[0]
+            return str(self._reader.data[self._value_offset + 8:self._value_offset + 8 + int(slen)].tobytes(), encoding = 'utf-8')
+        return self._reader._get(self._value_offset, self._reader.gguf_scalar_to_np[main_type]).tolist()[0]
+
 
 class ReaderTensor(NamedTuple):
     name: str
@@ -86,8 +261,18 @@ class GGUFReader:
         GGUFValueType.BOOL:    np.bool_,
     }
 
-    def __init__(self, path: os.PathLike[str] | str, mode: Literal['r', 'r+', 'c'] = 'r'):
+    # With lazy = True, the values of the key/value fields are only parsed when accessed
+    # (see LazyReaderField), which is much faster when only a few of them are needed.
+    # Arrays of strings are always read that way.
+    def __init__(self, path: os.PathLike[str] | str, mode: Literal['r', 'r+', 'c'] = 'r', lazy: bool = False):
         self.data = np.memmap(path, mode = mode)
+        self.lazy = lazy
+        tensors_fields = self._build_header()
+        self._build_tensors(self.data_offset, tensors_fields)
+
+    # Parse the key/value fields and the tensor infos, up to the start of the tensor data.
+    # Returns the tensor info fields.
+    def _build_header(self) -> list[ReaderField]:
         offs = 0
 
         # Check for GGUF magic
@@ -105,8 +290,8 @@ class GGUFReader:
         version = temp_version[0]
         if version not in READER_SUPPORTED_VERSIONS:
             raise ValueError(f'Sorry, file appears to be version {version} which we cannot handle')
-        self.fields: OrderedDict[str, ReaderField] = OrderedDict()
-        self.tensors: list[ReaderTensor] = []
+        self.fields: OrderedDict[str, ReaderField | LazyReaderField] = OrderedDict()
+        self._tensors: list[ReaderTensor] = []
         offs += self._push_field(ReaderField(offs, 'GGUF.version', [temp_version], [0], [GGUFValueType.UINT32]))
 
         # Check tensor count and kv count
@@ -122,17 +307,21 @@ class GGUFReader:
         if new_align is not None:
             if new_align.types != [GGUFValueType.UINT32]:
                 raise ValueError('Bad type for general.alignment field')
-            self.alignment = new_align.parts[-1][0]
+            self.alignment = new_align.contents()
         padding = offs % self.alignment
         if padding != 0:
             offs += self.alignment - padding
         self.data_offset = offs
-        self._build_tensors(offs, tensors_fields)
+        return tensors_fields
 
     _DT = TypeVar('_DT', bound = npt.DTypeLike)
 
+    @property
+    def tensors(self) -> list[ReaderTensor]:
+        return self._tensors
+
     # Fetch a key/value metadata field by key.
-    def get_field(self, key: str) -> Union[ReaderField, None]:
+    def get_field(self, key: str) -> Union[ReaderField, LazyReaderField, None]:
         return self.fields.get(key, None)
 
     # Fetch a tensor from the list by index.
@@ -145,13 +334,15 @@ class GGUFReader:
         count = int(count)
         itemsize = int(np.empty([], dtype = dtype).itemsize)
         end_offs = offset + itemsize * count
+        if end_offs > len(self.data):
+            raise _DataTooShort(end_offs)
         return (
             self.data[offset:end_offs]
             .view(dtype = dtype)[:count]
             .newbyteorder(override_order or self.byte_order)
         )
 
-    def _push_field(self, field: ReaderField, skip_sum: bool = False) -> int:
+    def _push_field(self, field: ReaderField | LazyReaderField, skip_sum: bool = False) -> int:
         if field.name in self.fields:
             # TODO: add option to generate error on duplicate keys
             # raise KeyError(f'Duplicate {field.name} already in list at offset {field.offset}')
@@ -191,6 +382,15 @@ class GGUFReader:
             offs += int(alen.nbytes)
             aparts: list[npt.NDArray[Any]] = [raw_itype, alen]
             data_idxs: list[int] = []
+            if raw_itype[0] == GGUFValueType.STRING:
+                # Arrays of strings (like the vocab) are big, avoid parsing the elements one by one
+                str_offsets = self._get_str_offsets(offs, int(alen[0])).tolist()
+                len_dtype = np.dtype(np.uint64).newbyteorder(self.byte_order)
+                for start, end in zip(str_offsets[:-1], str_offsets[1:]):
+                    aparts += (self.data[start:start + 8].view(len_dtype), self.data[start + 8:end])
+                if alen[0] > 0:
+                    types.append(GGUFValueType.STRING)
+                return str_offsets[-1] - orig_offs, aparts, list(range(3, len(aparts), 2)), types
             for idx in range(alen[0]):
                 curr_size, curr_parts, curr_idxs, curr_types = self._get_field_parts(offs, raw_itype[0])
                 if idx == 0:
@@ -203,6 +403,51 @@ class GGUFReader:
         # We can't deal with this one.
         raise ValueError('Unknown/unhandled field type {gtype}')
 
+    # Offsets of the strings of an array (starting with their length), followed by the end of the array.
+    def _get_str_offsets(self, offs: int, count: int) -> npt.NDArray[np.int64]:
+        unpack_len = struct.Struct(('<' if (sys.byteorder == 'little') == (self.byte_order == 'I') else '>') + 'Q').unpack_from
+        data = self.data.data
+        offsets = np.empty(count + 1, dtype = np.int64)
+        try:
+            for idx in range(count):
+                offsets[idx] = offs
+                offs += 8 + unpack_len(data, offs)[0]
+        except struct.error:
+            raise _DataTooShort(offs + 8)
+        if offs > len(data):
+            raise _DataTooShort(offs)
+        offsets[count] = offs
+        return offsets
+
+    def _get_str_array(self, offs: int, count: int) -> ReaderStringArray:
+        offsets = self._get_str_offsets(offs, count)
+        return ReaderStringArray(self.data[offs:offsets[-1]], offsets - offs)
+
+    def _is_str_array(self, offs: int, raw_type: int) -> bool:
+        return raw_type == GGUFValueType.ARRAY and self._get(offs, np.uint32)[0] == GGUFValueType.STRING
+
+    # Record the type and the location of a field without parsing its value.
+    # Returns the size of the value, and None for types which are not handled lazily (nested arrays).
+    def _get_lazy_field(self, orig_offs: int, name: str, offs: int, raw_type: int) -> tuple[int, LazyReaderField | None]:
+        gtype = GGUFValueType(raw_type)
+        if gtype == GGUFValueType.STRING:
+            return 8 + int(self._get(offs, np.uint64)[0]), LazyReaderField(self, orig_offs, name, offs, [gtype])
+        nptype = self.gguf_scalar_to_np.get(gtype)
+        if nptype is not None:
+            return np.dtype(nptype).itemsize, LazyReaderField(self, orig_offs, name, offs, [gtype])
+        if gtype == GGUFValueType.ARRAY:
+            itype = GGUFValueType(self._get(offs, np.uint32)[0])
+            alen = int(self._get(offs + 4, np.uint64)[0])
+            types = [gtype, itype] if alen > 0 else [gtype]
+            if itype == GGUFValueType.STRING:
+                strings = self._get_str_array(offs + 12, alen)
+                return 12 + len(strings.data), LazyReaderField(self, orig_offs, name, offs, types, alen, strings)
+            nptype = self.gguf_scalar_to_np.get(itype)
+            if nptype is not None:
+                return 12 + alen * np.dtype(nptype).itemsize, LazyReaderField(self, orig_offs, name, offs, types, alen)
+            return 0, None
+        raise ValueError(f'Unknown/unhandled field type {gtype}')
+
     def _get_tensor_info_field(self, orig_offs: int) -> ReaderField:
         offs = orig_offs
 
@@ -240,6 +485,14 @@ class GGUFReader:
             offs += int(kv_klen.nbytes + kv_kdata.nbytes)
             raw_kv_type = self._get(offs, np.uint32)
             offs += int(raw_kv_type.nbytes)
+            # Arrays of strings (like the vocab) are always read as a ReaderStringArray,
+            # their parts are only made if they are accessed
+            if self.lazy or self._is_str_array(offs, raw_kv_type[0]):
+                field_size, lazy_field = self._get_lazy_field(orig_offs, str(bytes(kv_kdata), encoding = 'utf-8'), offs, raw_kv_type[0])
+                if lazy_field is not None:
+                    self._push_field(lazy_field, skip_sum = True)
+                    offs += field_size
+                    continue
             parts: list[npt.NDArray[Any]] = [kv_klen, kv_kdata, raw_kv_type]
             idxs_offs = len(parts)
             field_size, field_parts, field_idxs, field_types = self._get_field_parts(offs, raw_kv_type[0])
@@ -266,52 +519,285 @@ class GGUFReader:
         tensors = []
         tensor_names = set() # keep track of name to prevent duplicated tensors
         for field in fields:
-            _name_len, name_data, _n_dims, dims, raw_dtype, offset_tensor = field.parts
             # check if there's any tensor having same name already in the list
-            tensor_name = str(bytes(name_data), encoding = 'utf-8')
+            tensor_name = field.name
             if tensor_name in tensor_names:
                 raise ValueError(f'Found duplicated tensor with name {tensor_name}')
             tensor_names.add(tensor_name)
-            ggml_type = GGMLQuantizationType(raw_dtype[0])
-            n_elems = int(np.prod(dims))
-            np_dims = tuple(reversed(dims.tolist()))
-            block_size, type_size = GGML_QUANT_SIZES[ggml_type]
-            n_bytes = n_elems * type_size // block_size
-            data_offs = int(start_offs + offset_tensor[0])
-            item_type: npt.DTypeLike
-            if ggml_type == GGMLQuantizationType.F16:
-                item_count = n_elems
-                item_type = np.float16
-            elif ggml_type == GGMLQuantizationType.F32:
-                item_count = n_elems
-                item_type = np.float32
-            elif ggml_type == GGMLQuantizationType.F64:
-                item_count = n_elems
-                item_type = np.float64
-            elif ggml_type == GGMLQuantizationType.I8:
-                item_count = n_elems
-                item_type = np.int8
-            elif ggml_type == GGMLQuantizationType.I16:
-                item_count = n_elems
-                item_type = np.int16
-            elif ggml_type == GGMLQuantizationType.I32:
-                item_count = n_elems
-                item_type = np.int32
-            elif ggml_type == GGMLQuantizationType.I64:
-                item_count = n_elems
-                item_type = np.int64
-            else:
-                item_count = n_bytes
-                item_type = np.uint8
-                np_dims = quant_shape_to_byte_shape(np_dims, ggml_type)
-            tensors.append(ReaderTensor(
-                name = tensor_name,
-                tensor_type = ggml_type,
-                shape = dims,
-                n_elements = n_elems,
-                n_bytes = n_bytes,
-                data_offset = data_offs,
-                data = self._get(data_offs, item_type, item_count).reshape(np_dims),
-                field = field,
-            ))
-        self.tensors = tensors
+            tensors.append(self._build_tensor(start_offs, field))
+        self._tensors = tensors
+
+    def _build_tensor(self, start_offs: int, field: ReaderField) -> ReaderTensor:
+        _name_len, name_data, _n_dims, dims, raw_dtype, offset_tensor = field.parts
+        tensor_name = str(bytes(name_data), encoding = 'utf-8')
+        ggml_type = GGMLQuantizationType(raw_dtype[0])
+        n_elems = int(np.prod(dims))
+        np_dims = tuple(reversed(dims.tolist()))
+        block_size, type_size = GGML_QUANT_SIZES[ggml_type]
+        n_bytes = n_elems * type_size // block_size
+        data_offs = int(start_offs + offset_tensor[0])
+        item_type: npt.DTypeLike
+        if ggml_type == GGMLQuantizationType.F16:
+            item_count = n_elems
+            item_type = np.float16
+        elif ggml_type == GGMLQuantizationType.F32:
+            item_count = n_elems
+            item_type = np.float32
+        elif ggml_type == GGMLQuantizationType.F64:
+            item_count = n_elems
+            item_type = np.float64
+        elif ggml_type == GGMLQuantizationType.I8:
+            item_count = n_elems
+            item_type = np.int8
+        elif ggml_type == GGMLQuantizationType.I16:
+            item_count = n_elems
+            item_type = np.int16
+        elif ggml_type == GGMLQuantizationType.I32:
+            item_count = n_elems
+            item_type = np.int32
+        elif ggml_type == GGMLQuantizationType.I64:
+            item_count = n_elems
+            item_type = np.int64
+        else:
+            item_count = n_bytes
+            item_type = np.uint8
+            np_dims = quant_shape_to_byte_shape(np_dims, ggml_type)
+        return ReaderTensor(
+            name = tensor_name,
+            tensor_type = ggml_type,
+            shape = dims,
+            n_elements = n_elems,
+            n_bytes = n_bytes,
+            data_offset = data_offs,
+            data = self._get_tensor_data(data_offs, item_type, item_count).reshape(np_dims),
+            field = field,
+        )
+
+    def _get_tensor_data(self, offset: int, dtype: npt.DTypeLike, count: int) -> npt.NDArray[Any]:
+        return self._get(offset, dtype, count)
+
+
+# Reads only the header of a GGUF file (the key/value fields and the tensor infos) with a few ranged reads,
+# instead of mapping the whole file, which on network filesystems can cause the readahead of big parts of it.
+# The first read is of read_size bytes, and the buffer is then doubled until the header fits in it, so a part of
+# the tensor data can be read with the header (up to read_size, or to the size of the header), but not the rest of it.
+# Reading only what the parsing needs would take a read per string of the vocab.
+# The tensor data is only mapped (or read, for files which can't be mapped) when the tensors are accessed.
+class GGUFHeaderReader(GGUFReader):
+    # Size of the first read, which is doubled until the header fits
+    DEFAULT_READ_SIZE = 1024 * 1024
+
+    # Infos of the tensors, available without accessing their data
+    tensor_fields: list[ReaderField]
+
+    # file is a path, or a binary file-like object which supports seek() and read();
+    # os.pread() is used instead when it has a file descriptor.
+    def __init__(self, file: os.PathLike[str] | str | IO[bytes], lazy: bool = False, read_size: int = DEFAULT_READ_SIZE):
+        self.lazy = lazy
+        self._file = file
+        self._tensor_data: npt.NDArray[np.uint8] | None = None
+        self._tensors_built = False
+        if isinstance(file, (str, os.PathLike)):
+            with open(file, 'rb') as f:
+                self._read_header(f, read_size)
+        else:
+            self._read_header(file, read_size)
+
+    # Maps the file on first access, or reads all the tensors when it can't be mapped.
+    @property
+    def tensors(self) -> list[ReaderTensor]:
+        if not self._tensors_built:
+            if isinstance(self._file, (str, os.PathLike)) or self._get_fd(self._file) is not None:
+                self._tensor_data = np.memmap(self._file, mode = 'r')
+            self._build_tensors(self.data_offset, self.tensor_fields)
+            self._tensors_built = True
+        return self._tensors
+
+    # Reads the data of a single tensor (unless the file is already mapped).
+    def read_tensor(self, idx: int) -> ReaderTensor:
+        if self._tensors_built:
+            return self._tensors[idx]
+        return self._build_tensor(self.data_offset, self.tensor_fields[idx])
+
+    def _read_header(self, f: IO[bytes], read_size: int) -> None:
+        fd = self._get_fd(f)
+        buf = b''
+        size = max(read_size, 64)
+        while True:
+            buf += self._read(f, fd, len(buf), size - len(buf))
+            self.data = np.frombuffer(buf, dtype = np.uint8)
+            try:
+                self.tensor_fields = self._build_header()
+                return
+            except _DataTooShort as e:
+                if len(buf) < size:
+                    # the whole file was read
+                    raise ValueError(f'Unexpected end of file, the header needs at least {e.end} bytes but the file has {len(buf)}')
+                size = max(2 * size, e.end)
+
+    def _get_tensor_data(self, offset: int, dtype: npt.DTypeLike, count: int) -> npt.NDArray[Any]:
+        n_bytes = int(np.empty([], dtype = dtype).itemsize) * count
+        if self._tensor_data is not None:
+            raw = self._tensor_data[offset:offset + n_bytes]
+        elif isinstance(self._file, (str, os.PathLike)):
+            with open(self._file, 'rb') as f:
+                raw = np.frombuffer(self._read(f, self._get_fd(f), offset, n_bytes), dtype = np.uint8)
+        else:
+            raw = np.frombuffer(self._read(self._file, self._get_fd(self._file), offset, n_bytes), dtype = np.uint8)
+        if len(raw) < n_bytes:
+            raise _DataTooShort(offset + n_bytes)
+        return raw.view(dtype = dtype).newbyteorder(self.byte_order)
+
+    @staticmethod
+    def _get_fd(f: IO[bytes]) -> int | None:
+        if not hasattr(os, 'pread'):
+            return None
+        try:
+            return f.fileno()
+        except OSError:
+            # e.g. io.BytesIO
+            return None
+
+    # Read size bytes at offset, or less at the end of the file
+    @staticmethod
+    def _read(f: IO[bytes], fd: int | None, offset: int, size: int) -> bytes:
+        if fd is None:
+            f.seek(offset)
+            return f.read(size)
+        chunks: list[bytes] = []
+        while size > 0:
+            chunk = os.pread(fd, size, offset)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            offset += len(chunk)
+            size -= len(chunk)
+        return b''.join(chunks)
+
+
+# Reads the shards of a split model (see the --split-max-* options of convert_hf_to_gguf.py) as a single model.
+# The other shards are found from the name of the first one, and are only mapped when one of their tensors is used:
+# until then, only the tensor count in the fixed part of their header is read.
+# The key/value fields are the ones of the first shard, which has the metadata of the model.
+class GGUFSplitReader:
+    shards: list[Path]
+    readers: list[GGUFReader | None]
+
+    gguf_scalar_to_np = GGUFReader.gguf_scalar_to_np
+
+    def __init__(self, path: os.PathLike[str] | str, mode: Literal['r', 'r+', 'c'] = 'r', lazy: bool = False):
+        self.mode: Literal['r', 'r+', 'c'] = mode
+        self.lazy = lazy
+        first = GGUFReader(path, mode, lazy)
+
+        split_count_field = first.get_field(Keys.Split.LLM_KV_SPLIT_COUNT)
+        split_count = int(split_count_field.contents()) if split_count_field is not None else 1
+        if split_count <= 1:
+            self.shards = [Path(path)]
+        else:
+            split_no_field = first.get_field(Keys.Split.LLM_KV_SPLIT_NO)
+            if split_no_field is not None and int(split_no_field.contents()) != 0:
+                raise ValueError(f"{path!r} is not the first shard of the model")
+            path = Path(path)
+            m = re.fullmatch(r"(.*)-[0-9]{5}-of-([0-9]{5})\.gguf", path.name)
+            if m is None or int(m.group(2)) != split_count:
+                raise ValueError(f"Can't find the other {split_count - 1} shards of {str(path)!r} from its name")
+            self.shards = [path.with_name(SHARD_NAME_FORMAT.format(m.group(1), i + 1, split_count)) for i in range(split_count)]
+            for shard in self.shards:
+                if not shard.is_file():
+                    raise FileNotFoundError(f"Missing shard {str(shard)!r}")
+
+        self.readers = [first] + [None] * (len(self.shards) - 1)
+        # index of the first tensor of each shard, and past the last one
+        self._tensor_starts = [0, len(first.tensors)]
+        for shard in self.shards[1:]:
+            self._tensor_starts.append(self._tensor_starts[-1] + self._read_tensor_count(shard))
+
+        tensors_count_field = first.get_field(Keys.Split.LLM_KV_SPLIT_TENSORS_COUNT)
+        if tensors_count_field is not None and int(tensors_count_field.contents()) != self._tensor_starts[-1]:
+            raise ValueError(f"The shards have {self._tensor_starts[-1]} tensors instead of the expected {tensors_count_field.contents()}")
+        self.tensors = SplitReaderTensors(self, self._tensor_starts[-1])
+
+    # Same as for the first shard
+    @property
+    def fields(self) -> OrderedDict[str, ReaderField | LazyReaderField]:
+        return self.first.fields
+
+    @property
+    def first(self) -> GGUFReader:
+        first = self.readers[0]
+        assert first is not None
+        return first
+
+    @property
+    def byte_order(self) -> Literal['I', 'S']:
+        return self.first.byte_order
+
+    @property
+    def alignment(self) -> int:
+        return self.first.alignment
+
+    @property
+    def data_offset(self) -> int:
+        return self.first.data_offset
+
+    def get_field(self, key: str) -> Union[ReaderField, LazyReaderField, None]:
+        return self.first.get_field(key)
+
+    def get_tensor(self, idx: int) -> ReaderTensor:
+        return self.tensors[idx]
+
+    def get_shard(self, shard: int) -> GGUFReader:
+        reader = self.readers[shard]
+        if reader is None:
+            reader = GGUFReader(self.shards[shard], self.mode, self.lazy)
+            split_no_field = reader.get_field(Keys.Split.LLM_KV_SPLIT_NO)
+            if split_no_field is None or int(split_no_field.contents()) != shard:
+                raise ValueError(f"{str(self.shards[shard])!r} is not the shard {shard} of the model")
+            assert len(reader.tensors) == self._tensor_starts[shard + 1] - self._tensor_starts[shard]
+            self.readers[shard] = reader
+        return reader
+
+    # Index of the shard of a tensor, and index of the tensor in that shard
+    def locate_tensor(self, idx: int) -> tuple[int, int]:
+        if not 0 <= idx < len(self.tensors):
+            raise IndexError(f"Tensor index {idx} out of range")
+        shard = bisect_right(self._tensor_starts, idx) - 1
+        return shard, idx - self._tensor_starts[shard]
+
+    @staticmethod
+    def _read_tensor_count(path: Path) -> int:
+        # magic, version, tensor count and kv count
+        with open(path, "rb") as f:
+            header = f.read(24)
+        if len(header) < 24 or struct.unpack_from("<I", header)[0] != GGUF_MAGIC:
+            raise ValueError(f"{str(path)!r} is not a GGUF file")
+        # see the check of the version in GGUFReader
+        byte_order = "<" if struct.unpack_from("<I", header, 4)[0] & 65535 != 0 else ">"
+        return struct.unpack_from(byte_order + "Q", header, 8)[0]
+
+
+class SplitReaderTensors(Sequence[ReaderTensor]):
+    def __init__(self, reader: GGUFSplitReader, count: int):
+        self._reader = reader
+        self._count = count
+
+    def __len__(self) -> int:
+        return self._count
+
+    @overload
+    def __getitem__(self, index: int) -> ReaderTensor: ...
+    @overload
+    def __getitem__(self, index: slice) -> list[ReaderTensor]: ...
+
+    def __getitem__(self, index: int | slice) -> ReaderTensor | list[ReaderTensor]:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        shard, idx = self._reader.locate_tensor(index)
+        return self._reader.get_shard(shard).tensors[idx]
+
+    def __iter__(self) -> Iterator[ReaderTensor]:
+        for i in range(self._count):
+            yield self[i]
@@ -1,16 +1,24 @@
 from __future__ import annotations
 
+import contextlib
+import errno
+import itertools
 import logging
 import os
+import re
 import shutil
 import struct
+import sys
 import tempfile
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
 from dataclasses import dataclass
 from enum import Enum, auto
 from math import prod
 from pathlib import Path
 from io import BufferedWriter
-from typing import IO, Any, Sequence, Mapping
+from typing import IO, Any, Iterable, Iterator, Sequence, Mapping
 from string import ascii_letters, digits
 
 import numpy as np
@@ -28,6 +36,7 @@ from .constants import (
     TokenType,
 )
 
+from .lazy import LazyBase
 from .quants import quant_shape_from_byte_shape
 
 logger = logging.getLogger(__name__)
@@ -35,6 +44,91 @@ logger = logging.getLogger(__name__)
 
 SHARD_NAME_FORMAT = "{:s}-{:05d}-of-{:05d}.gguf"
 
+# some platforms can't write more than 2 GiB at once
+_MAX_WRITE_SIZE = 1 << 30
+
+_pwrite_lock = threading.Lock()
+
+
+def _pwrite(fd: int, data: bytes | memoryview, offset: int) -> int:
+    if hasattr(os, "pwrite"):
+        return os.pwrite(fd, data, offset)
+    # Windows doesn't have os.pwrite
+    with _pwrite_lock:
+        os.lseek(fd, offset, os.SEEK_SET)
+        return os.write(fd, data)
+
+
+def _pread(fd: int, n: int, offset: int) -> bytes:
+    if hasattr(os, "pread"):
+        return os.pread(fd, n, offset)
+    # Windows doesn't have os.pread
+    with _pwrite_lock:
+        os.lseek(fd, offset, os.SEEK_SET)
+        return os.read(fd, n)
+
+
+# errors of copy_file_range and sendfile meaning that they can't be used for these files
+_COPY_UNSUPPORTED_ERRNOS = (errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.EINVAL, errno.EBADF)
+
+
+def _copy_file_range(src_fd: int, dst_fd: int, src_offset: int, dst_offset: int, count: int) -> None:
+    # Copy a range of bytes between files, in the kernel when possible
+    # (with reflinks on file systems which support them), without moving the file positions.
+    if hasattr(os, "copy_file_range"):
+        try:
+            while count > 0:
+                n = os.copy_file_range(src_fd, dst_fd, min(count, _MAX_WRITE_SIZE), src_offset, dst_offset)
+                if n == 0:
+                    raise EOFError(f"Unexpected end of file when copying {count} bytes at offset {src_offset}")
+                src_offset += n
+                dst_offset += n
+                count -= n
+            return
+        except OSError as e:
+            # not supported for these files (e.g. across file systems on older kernels)
+            if e.errno not in _COPY_UNSUPPORTED_ERRNOS:
+                raise
+    if count > 0 and sys.platform.startswith("linux"):
+        # sendfile can't write at an offset, but nothing else uses the output file position
+        try:
+            with _pwrite_lock:
+                os.lseek(dst_fd, dst_offset, os.SEEK_SET)
+                while count > 0:
+                    n = os.sendfile(dst_fd, src_fd, src_offset, min(count, _MAX_WRITE_SIZE))
+                    if n == 0:
+                        raise EOFError(f"Unexpected end of file when copying {count} bytes at offset {src_offset}")
+                    src_offset += n
+                    dst_offset += n
+                    count -= n
+        except OSError as e:
+            if e.errno not in _COPY_UNSUPPORTED_ERRNOS:
+                raise
+    while count > 0:
+        data = _pread(src_fd, min(count, _MAX_WRITE_SIZE), src_offset)
+        if len(data) == 0:
+            raise EOFError(f"Unexpected end of file when copying {count} bytes at offset {src_offset}")
+        n = _pwrite(dst_fd, data, dst_offset)
+        src_offset += n
+        dst_offset += n
+        count -= n
+
+
+# the tensors of the blocks, with the prefix of the encoder or decoder of encoder-decoder models
+_BLOCK_TENSOR_NAME = re.compile(r"(?:(enc|dec)\.)?blk\.(\d+)\.")
+
+
+def _load_order_key(name: str) -> tuple[int, int]:
+    # The order in which the runtime uses the tensors: first the ones before the blocks (e.g. the token embeddings),
+    # then the blocks one by one (of the encoder, then of the decoder), then the ones after them (e.g. the output).
+    if (match := _BLOCK_TENSOR_NAME.match(name)) is not None:
+        return (3 if match.group(1) == "dec" else 1, int(match.group(2)))
+    if name.startswith("enc."):
+        return (2, 0)
+    if name.startswith(("output", "cls", "dec.")):
+        return (4, 0)
+    return (0, 0)
+
 
 @dataclass
 class TensorInfo:
@@ -42,6 +136,8 @@ class TensorInfo:
     dtype: GGMLQuantizationType
     nbytes: int
     tensor: np.ndarray[Any, Any] | None = None
+    # absolute offset of the tensor data in its shard, known once the tensor info has been written
+    offset: int | None = None
 
 
 @dataclass
@@ -82,8 +178,12 @@ class GGUFWriter:
 
     def __init__(
         self, path: os.PathLike[str] | str | None, arch: str, use_temp_file: bool = False, endianess: GGUFEndian = GGUFEndian.LITTLE,
-        split_max_tensors: int = 0, split_max_size: int = 0, dry_run: bool = False, small_first_shard: bool = False
+        split_max_tensors: int = 0, split_max_size: int = 0, dry_run: bool = False, small_first_shard: bool = False,
+        thread_count: int = 1, max_inflight_size: int = 0, load_order: bool = False,
     ):
+        if use_temp_file and load_order:
+            raise ValueError("Tensors written to a temporary file can't be reordered")
+
         self.fout = None
         self.path = Path(path) if path else None
         self.arch = arch
@@ -97,6 +197,9 @@ class GGUFWriter:
         self.split_max_size = split_max_size
         self.dry_run = dry_run
         self.small_first_shard = small_first_shard
+        self.thread_count = thread_count
+        self.max_inflight_size = max_inflight_size
+        self.load_order = load_order
         logger.info("gguf: This GGUF file is for {0} Endian only".format(
             "Big" if self.endianess == GGUFEndian.BIG else "Little",
         ))
@@ -170,11 +273,25 @@ class GGUFWriter:
         if path is not None:
             self.path = path
 
+        if self.load_order:
+            self.sort_tensors_by_load_order()
+
         if self.path is not None:
             filenames = self.print_plan()
             self.fout = [open(filename, "wb") for filename in filenames]
             self.state = WriterState.EMPTY
 
+    def sort_tensors_by_load_order(self) -> None:
+        # stable, so that the tensors used at the same time keep their order
+        tensors = sorted(
+            itertools.chain.from_iterable(tensors.items() for tensors in self.tensors),
+            key=lambda item: _load_order_key(item[0]),
+        )
+        # split again with the same limits
+        self.tensors = [{}, {}] if self.small_first_shard else [{}]
+        for name, ti in tensors:
+            self._add_to_shard(name, ti)
+
     def print_plan(self) -> list[Path]:
         logger.info("Writing the following files:")
         assert self.path is not None
@@ -199,10 +316,14 @@ class GGUFWriter:
         assert self.fout is not None
         total_splits = len(self.fout)
         self.kv_data.extend({} for _ in range(len(self.kv_data), total_splits))
+        alignment = self.kv_data[0].get(Keys.General.ALIGNMENT)
         for i, kv_data in enumerate(self.kv_data):
             kv_data[Keys.Split.LLM_KV_SPLIT_NO] = GGUFValue(i, GGUFValueType.UINT16)
             kv_data[Keys.Split.LLM_KV_SPLIT_COUNT] = GGUFValue(total_splits, GGUFValueType.UINT16)
             kv_data[Keys.Split.LLM_KV_SPLIT_TENSORS_COUNT] = GGUFValue(total_tensors, GGUFValueType.INT32)
+            # each shard needs it to find its tensor data
+            if alignment is not None:
+                kv_data.setdefault(Keys.General.ALIGNMENT, alignment)
 
     def write_header_to_file(self, path: Path | None = None) -> None:
         if len(self.tensors) == 1 and (self.split_max_tensors != 0 or self.split_max_size != 0):
@@ -233,13 +354,9 @@ class GGUFWriter:
         assert self.fout is not None
 
         for fout, kv_data in zip(self.fout, self.kv_data):
-            kv_bytes = bytearray()
-
             for key, val in kv_data.items():
-                kv_bytes += self._pack_val(key, GGUFValueType.STRING, add_vtype=False)
-                kv_bytes += self._pack_val(val.value, val.type, add_vtype=True)
-
-            fout.write(kv_bytes)
+                fout.write(self._pack_val(key, GGUFValueType.STRING, add_vtype=False))
+                fout.write(self._pack_val(val.value, val.type, add_vtype=True))
 
         self.flush()
         self.state = WriterState.KV_DATA
@@ -265,6 +382,11 @@ class GGUFWriter:
 
             fout.write(ti_data)
             fout.flush()
+
+            data_start = GGUFWriter.ggml_pad(fout.tell(), self.data_alignment)
+            for ti in tensors.values():
+                ti.offset = data_start
+                data_start += GGUFWriter.ggml_pad(ti.nbytes, self.data_alignment)
         self.state = WriterState.TI_DATA
 
     def add_key_value(self, key: str, val: Any, vtype: GGUFValueType) -> None:
@@ -352,6 +474,9 @@ class GGUFWriter:
             if tensor_dtype == np.uint8:
                 tensor_shape = quant_shape_from_byte_shape(tensor_shape, raw_dtype)
 
+        self._add_to_shard(name, TensorInfo(shape=tensor_shape, dtype=dtype, nbytes=tensor_nbytes))
+
+    def _add_to_shard(self, name: str, ti: TensorInfo) -> None:
         # make sure there is at least one tensor before splitting
         if len(self.tensors[-1]) > 0:
             if (  # split when over tensor limit
@@ -359,11 +484,11 @@ class GGUFWriter:
                 and len(self.tensors[-1]) >= self.split_max_tensors
             ) or (   # split when over size limit
                 self.split_max_size != 0
-                and sum(ti.nbytes for ti in self.tensors[-1].values()) + tensor_nbytes > self.split_max_size
+                and sum(t.nbytes for t in self.tensors[-1].values()) + ti.nbytes > self.split_max_size
             ):
                 self.tensors.append({})
 
-        self.tensors[-1][name] = TensorInfo(shape=tensor_shape, dtype=dtype, nbytes=tensor_nbytes)
+        self.tensors[-1][name] = ti
 
     def add_tensor(
         self, name: str, tensor: np.ndarray[Any, Any], raw_shape: Sequence[int] | None = None,
@@ -391,7 +516,7 @@ class GGUFWriter:
         if pad != 0:
             fp.write(bytes([0] * pad))
 
-    def write_tensor_data(self, tensor: np.ndarray[Any, Any]) -> None:
+    def write_tensor_data(self, tensor: np.ndarray[Any, Any], name: str | None = None) -> None:
         if self.state is not WriterState.TI_DATA and self.state is not WriterState.WEIGHTS:
             raise ValueError(f'Expected output file to contain tensor info or weights, got {self.state}')
         assert self.fout is not None
@@ -399,6 +524,18 @@ class GGUFWriter:
         if self.endianess == GGUFEndian.BIG:
             tensor.byteswap(inplace=True)
 
+        if name is not None:
+            # write the tensor directly at its final offset, in any order
+            fout, ti = self._get_tensor_info(name)
+            assert ti.offset is not None
+            assert ti.nbytes == tensor.nbytes
+            self._write_at(fout, tensor, ti.offset)
+            self.state = WriterState.WEIGHTS
+            return
+
+        if self.load_order:
+            raise ValueError("The tensors have been reordered, their name is needed to write them")
+
         file_id = -1
         for i, tensors in enumerate(self.tensors):
             if len(tensors) > 0:
@@ -408,9 +545,7 @@ class GGUFWriter:
         fout = self.fout[file_id]
 
         # pop the first tensor info
-        # TODO: cleaner way to get the first key
-        first_tensor_name = [name for name, _ in zip(self.tensors[file_id].keys(), range(1))][0]
-        ti = self.tensors[file_id].pop(first_tensor_name)
+        ti = self.tensors[file_id].pop(next(iter(self.tensors[file_id])))
         assert ti.nbytes == tensor.nbytes
 
         self.write_padding(fout, fout.tell())
@@ -419,6 +554,43 @@ class GGUFWriter:
 
         self.state = WriterState.WEIGHTS
 
+    def copy_tensor_data(self, name: str, src_fd: int, src_offset: int) -> None:
+        # Copy the data of a tensor as is from another file (at src_offset) to its final offset,
+        # without going through Python when the OS allows it.
+        if self.state is not WriterState.TI_DATA and self.state is not WriterState.WEIGHTS:
+            raise ValueError(f'Expected output file to contain tensor info or weights, got {self.state}')
+
+        fout, ti = self._get_tensor_info(name)
+        assert ti.offset is not None
+        fd = fout.fileno()
+        _copy_file_range(src_fd, fd, src_offset, ti.offset, ti.nbytes)
+        pad = GGUFWriter.ggml_pad(ti.nbytes, self.data_alignment) - ti.nbytes
+        if pad != 0:
+            _pwrite(fd, bytes(pad), ti.offset + ti.nbytes)
+
+        self.state = WriterState.WEIGHTS
+
+    def _get_tensor_info(self, name: str) -> tuple[BufferedWriter, TensorInfo]:
+        assert self.fout is not None
+        for fout, tensors in zip(self.fout, self.tensors):
+            if (ti := tensors.get(name)) is not None:
+                return fout, ti
+        raise KeyError(f'Tensor {name!r} was not added to the writer')
+
+    def _write_at(self, fout: BufferedWriter, tensor: np.ndarray[Any, Any], offset: int) -> None:
+        # Positional writes on the underlying file descriptor don't move the file position,
+        # so they are safe to use from multiple threads at once.
+        # The output buffer must not contain pending writes (the tensor info flushes it).
+        data = np.ascontiguousarray(tensor).reshape(-1).view(np.uint8).data
+        pad = GGUFWriter.ggml_pad(len(data), self.data_alignment) - len(data)
+        fd = fout.fileno()
+        while len(data) > 0:
+            n = _pwrite(fd, data[:_MAX_WRITE_SIZE], offset)
+            data = data[n:]
+            offset += n
+        if pad != 0:
+            _pwrite(fd, bytes(pad), offset)
+
     def write_tensors_to_file(self, *, progress: bool = False) -> None:
         self.write_ti_data_to_file()
 
@@ -436,27 +608,38 @@ class GGUFWriter:
 
                 total_bytes = sum(ti.nbytes for t in self.tensors for ti in t.values())
 
-                if len(self.fout) > 1:
+                if len(self.fout) > 1 and self.thread_count > 1:
+                    # the shards are written at the same time, so this counts the finished ones
+                    shard_bar = tqdm(desc="Shards", total=len(self.fout), unit="shard")
+                    shard_bar.update(sum(1 for tensors in self.tensors if len(tensors) == 0))
+                elif len(self.fout) > 1:
                     shard_bar = tqdm(desc=f"Shard (0/{len(self.fout)})", total=None, unit="byte", unit_scale=True)
                 bar = tqdm(desc="Writing", total=total_bytes, unit="byte", unit_scale=True)
 
-            for i, (fout, tensors) in enumerate(zip(self.fout, self.tensors)):
-                if shard_bar is not None:
-                    shard_bar.set_description(f"Shard ({i + 1}/{len(self.fout)})")
-                    total = sum(ti.nbytes for ti in tensors.values())
-                    shard_bar.reset(total=(total if total > 0 else None))
-
-                # relying on the fact that Python dicts preserve insertion order (since 3.7)
-                for ti in tensors.values():
-                    assert ti.tensor is not None  # can only iterate once over the tensors
-                    assert ti.tensor.nbytes == ti.nbytes
-                    ti.tensor.tofile(fout)
-                    if shard_bar is not None:
-                        shard_bar.update(ti.nbytes)
+            for fout in self.fout:
+                fout.flush()
+
+            executor_ctx = ThreadPoolExecutor(max_workers=self.thread_count) if self.thread_count > 1 else contextlib.nullcontext()
+
+            with executor_ctx as executor:
+                shards = [(fout, tensors.values()) for fout, tensors in zip(self.fout, self.tensors)]
+                shard_n_tensors = [len(tensors) for tensors in self.tensors]
+                current_shard = -1
+
+                for i, nbytes in self._write_tensors_at_offsets(shards, executor):
+                    if shard_bar is not None and executor is not None:
+                        shard_n_tensors[i] -= 1
+                        if shard_n_tensors[i] == 0:
+                            shard_bar.update(1)
+                    elif shard_bar is not None:
+                        if i != current_shard:
+                            current_shard = i
+                            shard_bar.set_description(f"Shard ({i + 1}/{len(self.fout)})")
+                            total = sum(ti.nbytes for ti in self.tensors[i].values())
+                            shard_bar.reset(total=(total if total > 0 else None))
+                        shard_bar.update(nbytes)
                     if bar is not None:
-                        bar.update(ti.nbytes)
-                    self.write_padding(fout, ti.nbytes)
-                    ti.tensor = None
+                        bar.update(nbytes)
         else:
             self.temp_file.seek(0)
 
@@ -466,6 +649,58 @@ class GGUFWriter:
 
         self.state = WriterState.WEIGHTS
 
+    def _write_tensor_at_offset(self, fout: BufferedWriter, ti: TensorInfo) -> int:
+        assert ti.tensor is not None  # can only iterate once over the tensors
+        assert ti.offset is not None
+        # evaluates lazy tensors
+        tensor = LazyBase.to_eager(ti.tensor)
+        ti.tensor = None
+        assert tensor.nbytes == ti.nbytes
+        self._write_at(fout, tensor, ti.offset)
+        return ti.nbytes
+
+    def _write_tensors_at_offsets(
+        self, shards: Sequence[tuple[BufferedWriter, Iterable[TensorInfo]]], executor: ThreadPoolExecutor | None,
+    ) -> Iterator[tuple[int, int]]:
+        # Each tensor is materialized and written straight to its final offset,
+        # so only the tensors currently being converted are kept in memory.
+        # Yields the index of the shard and the size of each written tensor.
+        # With a thread pool, tensors are written as soon as they are ready (in any order);
+        # at most one tensor per thread and max_inflight_size bytes of output are in flight,
+        # but at least one tensor always is, even when it's bigger than the budget.
+        if executor is None:
+            for i, (fout, tensor_infos) in enumerate(shards):
+                for ti in tensor_infos:
+                    yield i, self._write_tensor_at_offset(fout, ti)
+            return
+
+        # The shards are written at the same time (they may be on different disks):
+        # the next tensor is taken from the shard with the least bytes in flight.
+        remaining = [deque(tensor_infos) for _, tensor_infos in shards]
+        shard_inflight_size = [0] * len(shards)
+        pending: dict[Future[int], int] = {}
+        inflight_size = 0
+        while any(remaining):
+            i = min((j for j in range(len(shards)) if remaining[j]), key=lambda j: shard_inflight_size[j])
+            ti = remaining[i][0]
+            if len(pending) > 0 and (len(pending) >= self.thread_count or (
+                self.max_inflight_size > 0 and inflight_size + ti.nbytes > self.max_inflight_size
+            )):
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    j = pending.pop(future)
+                    nbytes = future.result()
+                    inflight_size -= nbytes
+                    shard_inflight_size[j] -= nbytes
+                    yield j, nbytes
+                continue
+            remaining[i].popleft()
+            pending[executor.submit(self._write_tensor_at_offset, shards[i][0], ti)] = i
+            inflight_size += ti.nbytes
+            shard_inflight_size[i] += ti.nbytes
+        for future in as_completed(pending):
+            yield pending[future], future.result()
+
     def flush(self) -> None:
         assert self.fout is not None
         for fout in self.fout:
@@ -487,6 +722,9 @@ class GGUFWriter:
         self.add_uint32(Keys.General.QUANTIZATION_VERSION, quantization_version)
 
     def add_custom_alignment(self, alignment: int) -> None:
+        # ggml pads with a bit mask
+        if alignment <= 0 or alignment & (alignment - 1) != 0:
+            raise ValueError(f"Invalid alignment {alignment}, must be a power of 2")
         self.data_alignment = alignment
         self.add_uint32(Keys.General.ALIGNMENT, alignment)
 
@@ -879,6 +1117,18 @@ class GGUFWriter:
     def add_eom_token_id(self, id: int) -> None:
         self.add_uint32(Keys.Tokenizer.EOM_ID, id)
 
+    def add_quantize_imatrix_file(self, file: str) -> None:
+        self.add_string(Keys.Quantize.IMATRIX_FILE, file)
+
+    def add_quantize_imatrix_dataset(self, dataset: str) -> None:
+        self.add_string(Keys.Quantize.IMATRIX_DATASET, dataset)
+
+    def add_quantize_imatrix_entries_count(self, count: int) -> None:
+        self.add_int32(Keys.Quantize.IMATRIX_ENTRIES_COUNT, count)
+
+    def add_quantize_imatrix_chunks_count(self, count: int) -> None:
+        self.add_int32(Keys.Quantize.IMATRIX_CHUNKS_COUNT, count)
+
     def _pack(self, fmt: str, value: Any, skip_pack_prefix: bool = False) -> bytes:
         pack_prefix = ''
         if not skip_pack_prefix:
@@ -910,17 +1160,52 @@ class GGUFWriter:
                 ltype = GGUFValueType.UINT8
             else:
                 ltype = GGUFValueType.get_type(val[0])
-                if not all(GGUFValueType.get_type(i) is ltype for i in val[1:]):
+                # (checked once per type of the items)
+                item_types = set(map(type, val))
+                if not all(GGUFValueType.get_type(next(i for i in val if type(i) is t)) is ltype for t in item_types):
                     raise ValueError("All items in a GGUF array should be of the same type")
             kv_data += self._pack("I", ltype)
             kv_data += self._pack("Q", len(val))
-            for item in val:
-                kv_data += self._pack_val(item, ltype, add_vtype=False)
+            kv_data += self._pack_array_items(val, ltype)
         else:
             raise ValueError("Invalid GGUF metadata value type or value")
 
         return kv_data
 
+    # The items of an array packed at once, instead of one by one (which is slow for the big arrays of the vocab)
+    def _pack_array_items(self, val: Sequence[Any], ltype: GGUFValueType) -> bytes:
+        pack_prefix = '<' if self.endianess == GGUFEndian.LITTLE else '>'
+        if isinstance(val, bytes):
+            return val
+        elif ltype == GGUFValueType.STRING:
+            encoded_vals = [item.encode("utf-8") if isinstance(item, str) else item for item in val]
+            # each string is prefixed by its length
+            pack_len = struct.Struct(f"{pack_prefix}Q").pack
+            return b"".join(itertools.chain.from_iterable(zip(map(pack_len, map(len, encoded_vals)), encoded_vals)))
+
+        pack_fmt = self._simple_value_packing.get(ltype)
+        if pack_fmt is not None and (packed := self._pack_array_np(val, np.dtype(f"{pack_prefix}{pack_fmt}"))) is not None:
+            return packed
+
+        return b"".join(self._pack_val(item, ltype, add_vtype=False) for item in val)
+
+    # The items packed with numpy, or None when some of them don't fit in dtype (for struct.pack to raise the error)
+    @staticmethod
+    def _pack_array_np(val: Sequence[Any], dtype: np.dtype) -> bytes | None:
+        items = np.asarray(val)
+        # (ints are packed as ints, floats as floats and bools as bools, like with struct.pack)
+        if items.dtype.kind not in ("iu" if dtype.kind in "iu" else dtype.kind):
+            return None
+        with np.errstate(over="ignore"):
+            packed = items.astype(dtype)
+        if dtype.kind in "iu":
+            fits = np.array_equal(packed, items)
+        elif dtype.kind == "f":
+            fits = np.array_equal(np.isinf(packed), np.isinf(items))
+        else:
+            fits = True
+        return packed.tobytes() if fits else None
+
     @staticmethod
     def format_n_bytes_to_str(num: int) -> str:
         if num == 0:
@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import logging
+import os
+from dataclasses import dataclass, field
+from math import prod
+from typing import Sequence
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+
+# Importance matrix, as computed by llama-imatrix (the legacy binary .dat format)
+#
+# Layout (all integers are little-endian int32):
+#   n_entries
+#   n_entries times: name_len, name, ncall, nval, float32[nval]
+#   (optional) chunks_count, dataset_len, dataset
+#
+# The values are divided by ncall when loading, like in llama-quantize.
+@dataclass
+class ImportanceMatrix:
+    data: dict[str, np.ndarray] = field(default_factory=dict)
+    dataset: str | None = None
+    chunks_count: int = 0
+
+    @classmethod
+    def load(cls, path: os.PathLike[str] | str) -> ImportanceMatrix:
+        with open(path, "rb") as f:
+            buf = f.read()
+
+        offset = 0
+
+        def read_i32() -> int:
+            nonlocal offset
+            if offset + 4 > len(buf):
+                raise ValueError(f"Unexpected end of importance matrix file {path!r}")
+            value = int.from_bytes(buf[offset:offset + 4], "little", signed=True)
+            offset += 4
+            return value
+
+        def read_bytes(n: int) -> bytes:
+            nonlocal offset
+            if n < 0 or offset + n > len(buf):
+                raise ValueError(f"Unexpected end of importance matrix file {path!r}")
+            value = buf[offset:offset + n]
+            offset += n
+            return value
+
+        n_entries = read_i32()
+        if n_entries < 1:
+            raise ValueError(f"No data in importance matrix file {path!r}")
+
+        imatrix = cls()
+        for _ in range(n_entries):
+            name = read_bytes(read_i32()).decode("utf-8")
+            ncall = read_i32()
+            nval = read_i32()
+            if nval < 1:
+                raise ValueError(f"Invalid number of values ({nval}) for {name!r} in importance matrix file {path!r}")
+            values = np.frombuffer(read_bytes(nval * 4), dtype="<f4").astype(np.float32)
+            if ncall > 0:
+                values /= np.float32(ncall)
+            imatrix.data[name] = values
+
+        # more recent versions also store the number of chunks and the dataset name
+        if offset < len(buf):
+            imatrix.chunks_count = read_i32()
+            imatrix.dataset = read_bytes(read_i32()).decode("utf-8", errors="replace")
+
+        logger.info(f"Loaded {len(imatrix.data)} importance matrix entries from {path} computed on {imatrix.chunks_count} chunks")
+
+        return imatrix
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.data
+
+    # Get the importance of the columns of the tensor with the given GGUF name,
+    # in a shape which can be broadcast to the shape of the tensor (as expected by gguf.quants.quantize)
+    def get(self, name: str, shape: Sequence[int]) -> np.ndarray | None:
+        values = self.data.get(name)
+        if values is None:
+            return None
+        n_per_row = shape[-1]
+        if values.size == n_per_row:
+            return values
+        # stacked experts have one row of importance per expert
+        n_mat = prod(shape[:-2])
+        if len(shape) > 2 and values.size == n_mat * n_per_row:
+            return values.reshape((*shape[:-2], 1, n_per_row))
+        raise ValueError(f"Importance matrix size mismatch for {name!r}: got {values.size} values for a tensor of shape {tuple(shape)}")
@@ -1,7 +1,9 @@
 from __future__ import annotations
 from abc import ABC, ABCMeta, abstractmethod
+from dataclasses import dataclass
 
 import logging
+import threading
 from typing import Any, Callable
 
 import numpy as np
@@ -10,6 +12,10 @@ from numpy.typing import DTypeLike
 
 logger = logging.getLogger(__name__)
 
+# Guards the reference counts and the release of the intermediate results,
+# which are shared by the threads evaluating tensors with common arguments
+_refcount_lock = threading.Lock()
+
 
 class LazyMeta(ABCMeta):
 
@@ -68,23 +74,55 @@ class LazyMeta(ABCMeta):
         return super().__new__(cls, name, bases, namespace, **kwargs)
 
 
+# Statistics about the evaluation of lazy tensors, filled by LazyBase.to_eager
+@dataclass
+class LazyEvalStats:
+    # number of evaluated nodes
+    n_evaluated: int = 0
+    # highest total size of the intermediate and resulting tensors held at once
+    peak_nbytes: int = 0
+
+
 # Tree of lazy tensors
+#
+# The intermediate results are released as soon as all of their consumers have been evaluated,
+# so that a chain of operations doesn't keep a copy of the tensor per step.
+# Only the tensors explicitly passed to to_eager keep their data.
+# Tensors can be evaluated from multiple threads: each node is evaluated once, by one of them.
 class LazyBase(ABC, metaclass=LazyMeta):
     _tensor_type: type
     _meta: Any
     _data: Any | None
     _args: tuple
     _kwargs: dict[str, Any]
-    _func: Callable[[Any], Any] | None
-
-    def __init__(self, *, meta: Any, data: Any | None = None, args: tuple = (), kwargs: dict[str, Any] | None = None, func: Callable[[Any], Any] | None = None):
+    _func: Callable[..., Any] | None
+    # number of lazy tensors using this one which have not been evaluated yet
+    _n_consumers: int
+    # whether the data is kept after evaluation
+    _pinned: bool
+    # held while the node is evaluated
+    _eval_lock: threading.Lock
+
+    def __init__(self, *, meta: Any, data: Any | None = None, args: tuple = (), kwargs: dict[str, Any] | None = None, func: Callable[..., Any] | None = None):
         super().__init__()
         self._meta = meta
         self._data = data
         self._args = args
         self._kwargs = kwargs if kwargs is not None else {}
         self._func = func
+        self._n_consumers = 0
+        self._pinned = False
+        self._eval_lock = threading.Lock()
         assert self._func is not None or self._data is not None
+        with _refcount_lock:
+            for arg in self._lazy_args():
+                arg._n_consumers += 1
+
+    def _lazy_args(self) -> list[LazyBase]:
+        # TODO: maybe handle tensors in kwargs too
+        args: list[LazyBase] = []
+        LazyBase._recurse_apply(self._args, args.append)
+        return args
 
     def __init_subclass__(cls) -> None:
         if "_tensor_type" not in cls.__dict__:
@@ -107,7 +145,7 @@ class LazyBase(ABC, metaclass=LazyMeta):
             return o
 
     @classmethod
-    def _wrap_fn(cls, fn: Callable, *, use_self: LazyBase | None = None, meta_noop: bool | DTypeLike | tuple[DTypeLike, Callable[[tuple[int, ...]], tuple[int, ...]]] = False) -> Callable[[Any], Any]:
+    def _wrap_fn(cls, fn: Callable, *, use_self: LazyBase | None = None, meta_noop: bool | DTypeLike | tuple[DTypeLike, Callable[[tuple[int, ...]], tuple[int, ...]]] = False) -> Callable[..., Any]:
         def wrapped_fn(*args, **kwargs):
             if kwargs is None:
                 kwargs = {}
@@ -148,25 +186,96 @@ class LazyBase(ABC, metaclass=LazyMeta):
         return wrapped_fn
 
     @classmethod
-    def to_eager(cls, t: Any) -> Any:
-        def simple_to_eager(_t: LazyBase) -> Any:
-            if _t._data is not None:
-                return _t._data
+    def to_eager(cls, t: Any, *, stats: LazyEvalStats | None = None, keep: bool = True) -> Any:
+        # with keep=False, the evaluated tensors are only kept by the caller (unless still needed by other lazy tensors)
+        roots: list[LazyBase] = []
+        cls._recurse_apply(t, roots.append)
+        if keep:
+            for root in roots:
+                root._pinned = True
+
+        # ids of the nodes evaluated here which still hold their data
+        evaluated: set[int] = set()
+        n_evaluated = 0
+        nbytes = 0
+        peak_nbytes = 0
+
+        # Depth-first evaluation with an explicit stack, because deep graphs would hit the recursion limit.
+        # The second item tells whether the arguments of the node have already been pushed,
+        # and the third is the node which needs it (not needed anymore once evaluated by another thread).
+        stack: list[tuple[LazyBase, bool, LazyBase | None]] = [(root, False, None) for root in reversed(roots)]
+        while stack:
+            node, ready, consumer = stack.pop()
+            if node._data is not None or (consumer is not None and consumer._data is not None):
+                continue
+            args = node._lazy_args()
+            if not ready:
+                stack.append((node, True, consumer))
+                stack.extend((arg, False, node) for arg in reversed(args) if arg._data is None)
+                continue
+
+            assert node._func is not None
+            with node._eval_lock:
+                # evaluated by another thread in the meantime
+                if node._data is not None or (consumer is not None and consumer._data is not None):
+                    continue
+                with _refcount_lock:
+                    eager_args = cls._recurse_apply(node._args, lambda a: a._data)
+                    released = any(arg._data is None for arg in args)
+                if released:
+                    # by the evaluation of another tensor using them, evaluate them again
+                    stack.append((node, False, consumer))
+                    continue
+                data = node._func(*eager_args, **node._kwargs)
+                # sanity check
+                assert data is not None
+                assert data.dtype == node._meta.dtype
+                assert data.shape == node._meta.shape
+                del eager_args
+                node._data = data
+
+            evaluated.add(id(node))
+            n_evaluated += 1
+            nbytes += cls._nbytes(data)
+            peak_nbytes = max(peak_nbytes, nbytes)
+            del data
+
+            # release the arguments which are not needed anymore
+            with _refcount_lock:
+                for arg in args:
+                    arg._n_consumers -= 1
+                    if arg._n_consumers <= 0 and not arg._pinned and arg._func is not None and arg._data is not None:
+                        if id(arg) in evaluated:
+                            evaluated.discard(id(arg))
+                            nbytes -= cls._nbytes(arg._data)
+                        arg._data = None
+
+        if stats is not None:
+            with _refcount_lock:
+                stats.n_evaluated += n_evaluated
+                stats.peak_nbytes = max(stats.peak_nbytes, peak_nbytes)
+
+        res = None
+        with _refcount_lock:
+            complete = all(root._data is not None for root in roots)
+            if complete:
+                # recurse into lists and/or tuples, keeping their structure
+                res = cls._recurse_apply(t, lambda _t: _t._data)
+
+                if not keep:
+                    for root in roots:
+                        if root._n_consumers <= 0 and not root._pinned and root._func is not None:
+                            root._data = None
+
+        if not complete:
+            # released in the meantime by another thread, after evaluating the last tensor using them
+            return cls.to_eager(t, stats=stats, keep=keep)
+
+        return res
 
-            # NOTE: there's a recursion limit in Python (usually 1000)
-
-            assert _t._func is not None
-            _t._args = cls._recurse_apply(_t._args, simple_to_eager)
-            _t._data = _t._func(*_t._args, **_t._kwargs)
-            # sanity check
-            assert _t._data is not None
-            assert _t._data.dtype == _t._meta.dtype
-            assert _t._data.shape == _t._meta.shape
-
-            return _t._data
-
-        # recurse into lists and/or tuples, keeping their structure
-        return cls._recurse_apply(t, simple_to_eager)
+    @staticmethod
+    def _nbytes(t: Any) -> int:
+        return getattr(t, "nbytes", 0)
 
     @classmethod
     def eager_to_meta(cls, t: Any) -> Any:
@@ -0,0 +1,98 @@
+#
+# Lazy PyTorch tensors, used by convert_hf_to_gguf.py for the models which modify their tensors.
+# Not imported by the gguf package, because it needs torch.
+#
+from __future__ import annotations
+
+from typing import Sequence, cast
+
+import numpy as np
+import torch
+from torch import Tensor
+
+from .lazy import LazyBase, LazyNumpyTensor
+from .safetensors_reader import SafetensorsTensor
+
+
+# tree of lazy tensors
+class LazyTorchTensor(LazyBase):
+    _tensor_type = torch.Tensor
+    # to keep the type-checker happy
+    dtype: torch.dtype
+    shape: torch.Size
+
+    # only used when converting a torch.Tensor to a np.ndarray
+    _dtype_map: dict[torch.dtype, type] = {
+        torch.float16: np.float16,
+        torch.float32: np.float32,
+    }
+
+    # used for safetensors tensors
+    # ref: https://github.com/huggingface/safetensors/blob/079781fd0dc455ba0fe851e2b4507c33d0c0d407/bindings/python/src/lib.rs#L1046
+    # TODO: uncomment U64, U32, and U16, ref: https://github.com/pytorch/pytorch/issues/58734
+    _dtype_str_map: dict[str, torch.dtype] = {
+        "F64": torch.float64,
+        "F32": torch.float32,
+        "BF16": torch.bfloat16,
+        "F16": torch.float16,
+        # "U64": torch.uint64,
+        "I64": torch.int64,
+        # "U32": torch.uint32,
+        "I32": torch.int32,
+        # "U16": torch.uint16,
+        "I16": torch.int16,
+        "U8": torch.uint8,
+        "I8": torch.int8,
+        "BOOL": torch.bool,
+        "F8_E4M3": torch.float8_e4m3fn,
+        "F8_E5M2": torch.float8_e5m2,
+    }
+
+    def numpy(self) -> LazyNumpyTensor:
+        dtype = self._dtype_map[self.dtype]
+        return LazyNumpyTensor(
+            meta=LazyNumpyTensor.meta_with_dtype_and_shape(dtype, self.shape),
+            args=(self,),
+            func=(lambda s: s.numpy())
+        )
+
+    @classmethod
+    def meta_with_dtype_and_shape(cls, dtype: torch.dtype, shape: tuple[int, ...]) -> Tensor:
+        return torch.empty(size=shape, dtype=dtype, device="meta")
+
+    @classmethod
+    def from_safetensors_tensor(cls, t: SafetensorsTensor) -> Tensor:
+        dtype = cls._dtype_str_map[t.dtype]
+        data = t.data
+        # torch.from_numpy only supports uint16, uint32 and uint64 since torch 2.3
+        if data.dtype.kind == "u" and data.dtype.itemsize > 1:
+            data = data.view(data.dtype.str.replace("u", "i"))
+        # zero-copy, the data stays in the memory-mapped file
+        # NOTE: the NumPy arrays of BF16 and F8 tensors hold their bits, which are reinterpreted here
+        lazy = cls(meta=cls.meta_with_dtype_and_shape(dtype, t.shape), args=(data,), func=lambda data: torch.from_numpy(data).view(dtype))
+        return cast(torch.Tensor, lazy)
+
+    # Same as torch.stack(tensors, dim=0), but the tensors are evaluated one at a time, directly into the result
+    @classmethod
+    def stack(cls, tensors: Sequence[LazyTorchTensor]) -> Tensor:
+        meta = torch.stack([t._meta for t in tensors], dim=0)
+
+        def stack_tensors() -> Tensor:
+            res = torch.empty(meta.shape, dtype=meta.dtype)
+            for i, t in enumerate(tensors):
+                res[i] = cls.to_eager(t, keep=False)
+            return res
+
+        return cast(torch.Tensor, cls(meta=meta, func=stack_tensors))
+
+    @classmethod
+    def __torch_function__(cls, func, types, args=(), kwargs=None):
+        del types  # unused
+
+        if kwargs is None:
+            kwargs = {}
+
+        if func is torch.Tensor.numpy:
+            return args[0].numpy()
+
+        return cls._wrap_fn(func)(*args, **kwargs)
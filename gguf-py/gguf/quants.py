@@ -1,8 +1,12 @@
 from __future__ import annotations
 from abc import ABC, abstractmethod
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from multiprocessing import shared_memory
 from typing import Any, Callable, Sequence
 from math import log2, ceil
 
+import os
+
 from numpy.typing import DTypeLike
 
 from .constants import GGML_QUANT_SIZES, GGMLQuantizationType, QK_K
@@ -25,17 +29,225 @@ def quant_shape_from_byte_shape(shape: Sequence[int], quant_type: GGMLQuantizati
     return (*shape[:-1], shape[-1] // type_size * block_size)
 
 
+# Layout of the blocks of each type, as (size in bytes, count) of the items of each of their fields.
+# Multi-byte fields are stored in the byte order of the file, so they are the ones to swap to change it.
+# Like in ggml-common.h, except for some byte arrays which ggml reads and writes as bigger integers.
+# For the interleaved Q4_0_N_M types, this is the layout of a group of blocks.
+_BLOCK_LAYOUTS: dict[GGMLQuantizationType, tuple[tuple[int, int], ...]] = {
+    GGMLQuantizationType.F32:      ((4, 1),),
+    GGMLQuantizationType.F16:      ((2, 1),),
+    GGMLQuantizationType.BF16:     ((2, 1),),
+    GGMLQuantizationType.F64:      ((8, 1),),
+    GGMLQuantizationType.I8:       ((1, 1),),
+    GGMLQuantizationType.I16:      ((2, 1),),
+    GGMLQuantizationType.I32:      ((4, 1),),
+    GGMLQuantizationType.I64:      ((8, 1),),
+    GGMLQuantizationType.Q4_0:     ((2, 1), (1, 16)),
+    GGMLQuantizationType.Q4_1:     ((2, 2), (1, 16)),
+    GGMLQuantizationType.Q5_0:     ((2, 1), (4, 1), (1, 16)),  # qh is an uint32
+    GGMLQuantizationType.Q5_1:     ((2, 2), (4, 1), (1, 16)),  # qh is an uint32
+    GGMLQuantizationType.Q8_0:     ((2, 1), (1, 32)),
+    GGMLQuantizationType.Q8_1:     ((2, 2), (1, 32)),
+    GGMLQuantizationType.Q2_K:     ((1, QK_K // 16), (1, QK_K // 4), (2, 2)),
+    GGMLQuantizationType.Q3_K:     ((1, QK_K // 8), (1, QK_K // 4), (1, 12), (2, 1)),
+    GGMLQuantizationType.Q4_K:     ((2, 2), (1, 12), (1, QK_K // 2)),
+    GGMLQuantizationType.Q5_K:     ((2, 2), (1, 12), (1, QK_K // 8), (1, QK_K // 2)),
+    GGMLQuantizationType.Q6_K:     ((1, QK_K // 2), (1, QK_K // 4), (1, QK_K // 16), (2, 1)),
+    GGMLQuantizationType.Q8_K:     ((4, 1), (1, QK_K), (2, QK_K // 16)),
+    GGMLQuantizationType.IQ2_XXS:  ((2, 1), (4, QK_K // 16)),  # qs is used as pairs of uint32
+    GGMLQuantizationType.IQ2_XS:   ((2, 1), (2, QK_K // 8), (1, QK_K // 32)),
+    GGMLQuantizationType.IQ2_S:    ((2, 1), (1, QK_K // 4), (1, QK_K // 32), (1, QK_K // 32)),
+    GGMLQuantizationType.IQ3_XXS:  ((2, 1), (1, QK_K // 4), (4, QK_K // 32)),  # the scales and signs are uint32
+    GGMLQuantizationType.IQ3_S:    ((2, 1), (1, QK_K // 4), (1, QK_K // 32), (1, QK_K // 8), (1, 4)),
+    GGMLQuantizationType.IQ1_S:    ((2, 1), (1, QK_K // 8), (2, QK_K // 32)),
+    GGMLQuantizationType.IQ1_M:    ((1, QK_K // 8), (1, QK_K // 16), (2, QK_K // 64)),  # the scales are uint16
+    GGMLQuantizationType.IQ4_NL:   ((2, 1), (1, 16)),
+    GGMLQuantizationType.IQ4_XS:   ((2, 1), (2, 1), (1, QK_K // 64), (1, QK_K // 2)),
+    GGMLQuantizationType.Q4_0_4_4: ((2, 4), (1, 64)),
+    GGMLQuantizationType.Q4_0_4_8: ((2, 4), (1, 64)),
+    GGMLQuantizationType.Q4_0_8_8: ((2, 8), (1, 128)),
+    GGMLQuantizationType.TQ1_0:    ((1, (QK_K - 4 * QK_K // 64) // 5), (1, QK_K // 64), (2, 1)),
+    GGMLQuantizationType.TQ2_0:    ((1, QK_K // 4), (2, 1)),
+}
+
+
+# Structured dtype of the (groups of) blocks of the given type, with one field per field of the blocks.
+# The tensor data to byteswap must be made of a whole number of these.
+def block_layout_dtype(qtype: GGMLQuantizationType) -> np.dtype:
+    layout = _BLOCK_LAYOUTS.get(qtype)
+    if layout is None:
+        raise NotImplementedError(f"Byte order conversion for {qtype.name} is not implemented")
+    return np.dtype([(f"f{i}", np.dtype(f"u{size}"), (count,)) for i, (size, count) in enumerate(layout)])
+
+
+# Swap the byte order of tensor data of the given type (in its file representation),
+# all at once with one strided view per multi-byte field of the blocks.
+def byteswap(data: np.ndarray, qtype: GGMLQuantizationType, *, inplace: bool = False) -> np.ndarray:
+    dtype = block_layout_dtype(qtype)
+    if not inplace:
+        data = data.copy()
+    raw = data.reshape(-1).view(np.uint8)
+    if raw.size % dtype.itemsize != 0:
+        raise ValueError(f"Tensor data size ({raw.size}) is not a multiple of the {qtype.name} block layout size ({dtype.itemsize})")
+    blocks = raw.view(dtype)
+    assert dtype.names is not None
+    for name in dtype.names:
+        field = blocks[name]
+        if field.dtype.itemsize > 1:
+            field.byteswap(inplace=True)
+    return data
+
+
 # This is faster than np.vectorize and np.apply_along_axis because it works on more than one row at a time
-def _apply_over_grouped_rows(func: Callable[[np.ndarray], np.ndarray], arr: np.ndarray, otype: DTypeLike, oshape: tuple[int, ...]) -> np.ndarray:
+# When given, the rows of aux (broadcast to the shape of arr) are passed along with their corresponding rows of arr.
+# Number of values (de)quantized at once, by groups of whole rows.
+# This is big enough to amortize the overhead of numpy, but small enough to keep the temporary arrays in the cache.
+_CHUNK_SIZE = 64 * 1024
+
+
+def _rows_per_chunk(n_per_row: int) -> int:
+    return max(1, _CHUNK_SIZE // max(1, n_per_row))
+
+
+# Rows [start, stop) of np.broadcast_to(aux, shape).reshape((-1, shape[-1])), without materializing the other rows
+def _broadcast_rows(aux: np.ndarray, shape: tuple[int, ...], start: int, stop: int) -> np.ndarray:
+    aux = np.broadcast_to(aux, shape)
+    if len(shape) <= 2:
+        return aux.reshape((-1, aux.shape[-1]))[start:stop]
+    return aux[np.unravel_index(np.arange(start, stop), shape[:-1])]
+
+
+# Apply func over the rows [start, stop), writing its results directly in the same rows of out
+def _apply_to_rows(
+    func: Callable[..., np.ndarray], rows: np.ndarray, out: np.ndarray, aux: np.ndarray | None, shape: tuple[int, ...], start: int, stop: int,
+) -> None:
+    chunk = _rows_per_chunk(rows.shape[-1])
+    for i in range(start, stop, chunk):
+        j = min(i + chunk, stop)
+        if aux is None:
+            res = func(rows[i:j])
+        else:
+            res = func(rows[i:j], _broadcast_rows(aux, shape, i, j))
+        out[i:j] = res.reshape((j - i, -1))
+
+
+# Same as _apply_to_rows, but in another process, with the rows and the output in shared memory
+def _apply_to_shared_rows(
+    func: Callable[..., np.ndarray], rows_name: str, rows_dtype: np.dtype, out_name: str, out_dtype: np.dtype,
+    aux: np.ndarray | None, shape: tuple[int, ...], start: int, stop: int,
+) -> None:
+    rows_shm = shared_memory.SharedMemory(name=rows_name)
+    out_shm = shared_memory.SharedMemory(name=out_name)
+    try:
+        n_rows = shape[0] if len(shape) == 2 else int(np.prod(shape[:-1]))
+        rows = np.ndarray((n_rows, shape[-1]), dtype=rows_dtype, buffer=rows_shm.buf)
+        out = np.ndarray((n_rows, out_shm.size // (n_rows * out_dtype.itemsize)), dtype=out_dtype, buffer=out_shm.buf)
+        _apply_to_rows(func, rows, out, aux, shape, start, stop)
+        # the buffers can't be closed while they are still used
+        del rows, out
+    finally:
+        rows_shm.close()
+        out_shm.close()
+
+
+# Opt-in parallel execution of quantize() and dequantize(), over a pool of threads or of processes.
+# The rows are split in ranges (a few per worker, to balance the load), and each worker writes
+# its results directly in the output. With processes, the rows and the output are passed through shared memory.
+# The output is identical to the one of a serial execution.
+class QuantPool:
+    n_workers: int
+    use_processes: bool
+
+    def __init__(self, n_workers: int | None = None, *, use_processes: bool = False, mp_context: Any = None):
+        self.n_workers = n_workers if n_workers is not None and n_workers > 0 else (os.cpu_count() or 1)
+        self.use_processes = use_processes
+        self._mp_context = mp_context
+        self._executor: Executor | None = None
+
+    def __enter__(self) -> QuantPool:
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _get_executor(self) -> Executor:
+        # NOTE: for processes, this is only called once some shared memory exists, so that the workers
+        #       share the resource tracker of this process (otherwise they could unlink the shared memory on exit)
+        if self._executor is None:
+            if self.use_processes:
+                self._executor = ProcessPoolExecutor(max_workers=self.n_workers, mp_context=self._mp_context)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.n_workers)
+        return self._executor
+
+    def apply_to_rows(self, func: Callable[..., np.ndarray], rows: np.ndarray, out: np.ndarray, aux: np.ndarray | None, shape: tuple[int, ...]) -> None:
+        n_rows = rows.shape[0]
+        chunk = _rows_per_chunk(rows.shape[-1])
+        n_tasks = min(-(-n_rows // chunk), 4 * self.n_workers)
+        if n_tasks <= 1 or self.n_workers <= 1:
+            _apply_to_rows(func, rows, out, aux, shape, 0, n_rows)
+            return
+        rows_per_task = -(-n_rows // (n_tasks * chunk)) * chunk
+        ranges = [(i, min(i + rows_per_task, n_rows)) for i in range(0, n_rows, rows_per_task)]
+
+        futures: list[Future[None]]
+        if not self.use_processes:
+            executor = self._get_executor()
+            futures = [executor.submit(_apply_to_rows, func, rows, out, aux, shape, start, stop) for start, stop in ranges]
+            wait(futures)
+            for future in futures:
+                future.result()
+            return
+
+        rows_shm = shared_memory.SharedMemory(create=True, size=max(rows.nbytes, 1))
+        out_shm = shared_memory.SharedMemory(create=True, size=max(out.nbytes, 1))
+        try:
+            shared_rows = np.ndarray(rows.shape, dtype=rows.dtype, buffer=rows_shm.buf)
+            shared_rows[...] = rows
+            del shared_rows
+            executor = self._get_executor()
+            futures = [
+                executor.submit(_apply_to_shared_rows, func, rows_shm.name, rows.dtype, out_shm.name, out.dtype, aux, shape, start, stop)
+                for start, stop in ranges
+            ]
+            # all the workers must be done with the shared memory before it's freed
+            wait(futures)
+            for future in futures:
+                future.result()
+            shared_out = np.ndarray(out.shape, dtype=out.dtype, buffer=out_shm.buf)
+            out[...] = shared_out
+            del shared_out
+        finally:
+            rows_shm.close()
+            rows_shm.unlink()
+            out_shm.close()
+            out_shm.unlink()
+
+    def quantize(self, data: np.ndarray, qtype: GGMLQuantizationType, imatrix: np.ndarray | None = None) -> np.ndarray:
+        return quantize(data, qtype, imatrix, pool=self)
+
+    def dequantize(self, data: np.ndarray, qtype: GGMLQuantizationType) -> np.ndarray:
+        return dequantize(data, qtype, pool=self)
+
+
+def _apply_over_grouped_rows(
+    func: Callable[..., np.ndarray], arr: np.ndarray, otype: DTypeLike, oshape: tuple[int, ...], aux: np.ndarray | None = None, pool: QuantPool | None = None,
+) -> np.ndarray:
     rows = arr.reshape((-1, arr.shape[-1]))
-    osize = 1
-    for dim in oshape:
-        osize *= dim
-    out = np.empty(shape=osize, dtype=otype)
-    # compute over groups of 16 rows (arbitrary, but seems good for performance)
-    n_groups = (rows.shape[0] // 16) or 1
-    np.concatenate([func(group).ravel() for group in np.array_split(rows, n_groups)], axis=0, out=out)
-    return out.reshape(oshape)
+    # the results are written in place, so that there is no other full-size copy of the output
+    out = np.empty(shape=oshape, dtype=otype)
+    out_rows = out.reshape((rows.shape[0], oshape[-1] if len(oshape) > 0 else 1))
+    shape = tuple(arr.shape)
+    if pool is None:
+        _apply_to_rows(func, rows, out_rows, aux, shape, 0, rows.shape[0])
+    else:
+        pool.apply_to_rows(func, rows, out_rows, aux, shape)
+    return out
 
 
 # round away from zero
@@ -47,30 +259,273 @@ def np_roundf(n: np.ndarray) -> np.ndarray:
     return np.sign(n) * b
 
 
+# Helpers for the K-quants, ported from ggml-quants.c
+# NOTE: to stay bit-exact with the reference implementation, sums are accumulated
+#       sequentially (in the same order as in C) instead of with np.sum,
+#       but they are still vectorized over all the (sub-)blocks at once.
+
+_GROUP_MAX_EPS = np.float32(1e-15)
+
+
+# same as nearest_int in ggml-quants.c (round half to even), but still as float
+def _nearest_int(x: np.ndarray) -> np.ndarray:
+    return np.rint(x)
+
+
+# sum over the last axis, in order, like `float sum = 0; for (...) sum += a[i];`
+# NOTE: unlike np.sum (which uses pairwise summation), np.add.accumulate is sequential,
+#       and adding zero at the end gives the same sign for zero sums as starting from zero.
+def _sum_sequential(a: np.ndarray) -> np.ndarray:
+    return np.add.accumulate(a, axis=-1, dtype=np.float32)[..., -1] + np.float32(0)
+
+
+# (n_groups, n) -> scale: (n_groups, 1), L: (n_groups, n) in [0, 2*nmax)
+def _make_qx_quants(x: np.ndarray, nmax: int, rmse_type: int, qw: np.ndarray | None = None) -> tuple[np.ndarray, np.ndarray]:
+    imax = abs(x).argmax(axis=-1, keepdims=True)
+    max = np.take_along_axis(x, imax, axis=-1)
+    is_zero = abs(max) < _GROUP_MAX_EPS
+    max = np.where(is_zero, np.float32(1), max)
+
+    iscale = np.float32(-nmax) / max
+
+    def quantize(iscale: np.ndarray) -> np.ndarray:
+        return np.clip(_nearest_int(iscale * x), -nmax, nmax - 1)
+
+    L = quantize(iscale)
+
+    if rmse_type == 0:
+        scale = np.float32(1) / iscale
+    else:
+        return_early = rmse_type < 0
+        rmse_type = abs(rmse_type)
+        if qw is not None:
+            w = np.broadcast_to(qw, x.shape)
+        elif rmse_type == 1:
+            w = x * x
+        elif rmse_type == 2:
+            w = np.ones_like(x)
+        elif rmse_type == 3:
+            w = abs(x)
+        else:
+            w = np.sqrt(abs(x))
+        wx = w * x
+
+        def sums(L: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+            return _sum_sequential(wx * L), _sum_sequential(w * L * L)
+
+        sumlx, suml2 = sums(L)
+        sumlx, suml2 = sumlx[..., None], suml2[..., None]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scale = np.where(suml2 != 0, sumlx / suml2, np.float32(0))
+        if return_early:
+            scale = np.where(suml2 > 0, np.float32(0.5) * (scale + np.float32(1) / iscale), np.float32(1) / iscale)
+        else:
+            best = scale * sumlx
+            for i in range(-9, 10):
+                if i == 0:
+                    continue
+                iscale = -(np.float32(nmax) + np.float32(0.1) * np.float32(i)) / max
+                this_L = quantize(iscale)
+                sumlx, suml2 = sums(this_L)
+                sumlx, suml2 = sumlx[..., None], suml2[..., None]
+                replace = (suml2 > 0) & (sumlx * sumlx > best * suml2)
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    scale = np.where(replace, sumlx / suml2, scale)
+                best = np.where(replace, scale * sumlx, best)
+                L = np.where(replace, this_L, L)
+
+    L = np.where(is_zero, 0, L + nmax).astype(np.uint8)
+    scale = np.where(is_zero, np.float32(0), scale)
+    return scale, L
+
+
+# (n_groups, n) -> scale: (n_groups, 1), L: (n_groups, n) in [0, 2*nmax)
+def _make_q3_quants(x: np.ndarray, nmax: int, do_rmse: bool) -> tuple[np.ndarray, np.ndarray]:
+    imax = abs(x).argmax(axis=-1, keepdims=True)
+    max = np.take_along_axis(x, imax, axis=-1)
+    is_zero = abs(max) < _GROUP_MAX_EPS
+    max = np.where(is_zero, np.float32(1), max)
+
+    iscale = np.float32(-nmax) / max
+    L = np.clip(_nearest_int(iscale * x), -nmax, nmax - 1)
+
+    if do_rmse:
+        w = x * x
+        wx = w * x
+        sumlx = _sum_sequential(wx * L)
+        suml2 = _sum_sequential(w * L * L)
+        for _ in range(5):
+            changed = np.zeros(sumlx.shape, dtype=bool)
+            for i in range(x.shape[-1]):
+                w_i, wx_i, x_i, L_i = w[..., i], wx[..., i], x[..., i], L[..., i]
+                slx = sumlx - wx_i * L_i
+                sl2 = suml2 - w_i * L_i * L_i
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    new_l = np.clip(_nearest_int(x_i * sl2 / slx), -nmax, nmax - 1)
+                slx = slx + wx_i * new_l
+                sl2 = sl2 + w_i * new_l * new_l
+                # NOTE: slx is checked before being updated
+                replace = ((sumlx - wx_i * L_i) > 0) & (new_l != L_i) & (sl2 > 0) & (slx * slx * suml2 > sumlx * sumlx * sl2)
+                L[..., i] = np.where(replace, new_l, L_i)
+                sumlx = np.where(replace, slx, sumlx)
+                suml2 = np.where(replace, sl2, suml2)
+                changed |= replace
+            if not changed.any():
+                break
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scale = (sumlx / suml2)[..., None]
+    else:
+        scale = np.float32(1) / iscale
+
+    L = np.where(is_zero, 0, L + nmax).astype(np.uint8)
+    scale = np.where(is_zero, np.float32(0), scale)
+    return scale, L
+
+
+# (n_groups, n) -> scale: (n_groups, 1), the_min: (n_groups, 1), L: (n_groups, n) in [0, nmax]
+def _make_qkx2_quants(
+    x: np.ndarray, nmax: int, weights: np.ndarray, rmin: float, rdelta: float, nstep: int, use_mad: bool,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    min = np.minimum(x.min(axis=-1, keepdims=True), np.float32(0))
+    max = x.max(axis=-1, keepdims=True)
+    sum_w = weights[..., :1].copy()
+    sum_x = sum_w * x[..., :1]
+    for i in range(1, x.shape[-1]):
+        sum_w += weights[..., i:i + 1]
+        sum_x += weights[..., i:i + 1] * x[..., i:i + 1]
+
+    is_flat = max == min
+    max = np.where(is_flat, min + np.float32(1), max)
+
+    def quantize(iscale: np.ndarray, min: np.ndarray) -> np.ndarray:
+        return np.clip(_nearest_int(iscale * (x - min)), 0, nmax)
+
+    def error(scale: np.ndarray, min: np.ndarray, L: np.ndarray) -> np.ndarray:
+        diff = scale * L + min - x
+        diff = abs(diff) if use_mad else diff * diff
+        return _sum_sequential(weights * diff)[..., None]
+
+    iscale = np.float32(nmax) / (max - min)
+    scale = np.float32(1) / iscale
+    L = quantize(iscale, min)
+
+    if nstep >= 1:
+        best_mad = error(scale, min, L)
+        for i in range(nstep + 1):
+            # NOTE: like in C, this uses the min from the best iteration so far
+            iscale = (np.float32(rmin) + np.float32(rdelta) * np.float32(i) + np.float32(nmax)) / (max - min)
+            Laux = quantize(iscale, min)
+            wl = weights * Laux
+            sum_l = _sum_sequential(wl)[..., None]
+            sum_l2 = _sum_sequential(wl * Laux)[..., None]
+            sum_xl = _sum_sequential(wl * x)[..., None]
+            D = sum_w * sum_l2 - sum_l * sum_l
+            with np.errstate(divide="ignore", invalid="ignore"):
+                this_scale = (sum_w * sum_xl - sum_x * sum_l) / D
+                this_min = (sum_l2 * sum_x - sum_l * sum_xl) / D
+                this_scale = np.where(this_min > 0, sum_xl / sum_l2, this_scale)
+            this_min = np.where(this_min > 0, np.float32(0), this_min)
+            with np.errstate(invalid="ignore"):
+                mad = error(this_scale, this_min, Laux)
+            replace = (D > 0) & (mad < best_mad)
+            L = np.where(replace, Laux, L)
+            best_mad = np.where(replace, mad, best_mad)
+            scale = np.where(replace, this_scale, scale)
+            min = np.where(replace, this_min, min)
+
+    L = np.where(is_flat, 0, L).astype(np.uint8)
+    scale = np.where(is_flat, np.float32(0), scale)
+    return scale, -min, L
+
+
+# (n_groups, n) -> scale: (n_groups, 1), L: (n_groups, n) in [0, nmax]
+def _make_qp_quants(x: np.ndarray, nmax: int, qw: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    max = np.maximum(x.max(axis=-1, keepdims=True), np.float32(0))
+    is_zero = max == 0
+    max = np.where(is_zero, np.float32(1), max)
+
+    def mse(scale: np.ndarray, L: np.ndarray) -> np.ndarray:
+        diff = x - scale * L
+        return _sum_sequential(qw * diff * diff)[..., None]
+
+    iscale = np.float32(nmax) / max
+    # NOTE: in C, L is an array of uint8_t, so negative values wrap around
+    best_mse = mse(np.float32(1) / iscale, _nearest_int(iscale * x).astype(np.int32).astype(np.uint8))
+    for i in range(-4, 5):
+        if i == 0:
+            continue
+        iscale_is = (np.float32(0.1) * np.float32(i) + np.float32(nmax)) / max
+        this_mse = mse(np.float32(1) / iscale_is, np.minimum(_nearest_int(iscale_is * x), nmax))
+        replace = this_mse < best_mse
+        best_mse = np.where(replace, this_mse, best_mse)
+        iscale = np.where(replace, iscale_is, iscale)
+
+    L = np.minimum(_nearest_int(iscale * x), nmax)
+    wx = qw * x
+    sumlx = _sum_sequential(wx * L)
+    suml2 = _sum_sequential(qw * L * L)
+    L = L.astype(np.int32).astype(np.uint8).astype(np.float32)
+    for _ in range(5):
+        changed = np.zeros(sumlx.shape, dtype=bool)
+        for i in range(x.shape[-1]):
+            w_i, wx_i, x_i, L_i = qw[..., i], wx[..., i], x[..., i], L[..., i]
+            slx = sumlx - wx_i * L_i
+            sl2 = suml2 - w_i * L_i * L_i
+            valid = (slx > 0) & (sl2 > 0)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                new_l = np.where(valid, np.minimum(_nearest_int(x_i * sl2 / slx), nmax), L_i)
+            slx = slx + wx_i * new_l
+            sl2 = sl2 + w_i * new_l * new_l
+            replace = valid & (new_l != L_i) & (slx * slx * suml2 > sumlx * sumlx * sl2)
+            L[..., i] = np.where(replace, new_l.astype(np.int32).astype(np.uint8), L_i)
+            sumlx = np.where(replace, slx, sumlx)
+            suml2 = np.where(replace, sl2, suml2)
+            changed |= replace
+        if not changed.any():
+            break
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scale = (sumlx / suml2)[..., None]
+    L = np.where(is_zero, 0, L).astype(np.uint8)
+    scale = np.where(is_zero, np.float32(0), scale)
+    return scale, L
+
+
+# weights used with an importance matrix, qw * sqrt(sigma2 + x*x), where sigma2 is the mean of x*x over groups of n values
+def _importance_weights(rows: np.ndarray, qw: np.ndarray, n: int, sigma_scale: float = 1.0) -> np.ndarray:
+    x = rows.reshape((-1, n))
+    sigma2 = np.float32(sigma_scale) * _sum_sequential(x * x)[..., None] / np.float32(n)
+    return (qw.reshape(x.shape) * np.sqrt(sigma2 + x * x)).reshape(rows.shape)
+
+
 class QuantError(Exception): ...
 
 
 _type_traits: dict[GGMLQuantizationType, type[__Quant]] = {}
 
 
-def quantize(data: np.ndarray, qtype: GGMLQuantizationType) -> np.ndarray:
+# The optional imatrix contains the importance of each column (the last dimension),
+# and must be broadcastable to the shape of the data (e.g. (n_expert, 1, n_per_row) for stacked experts).
+# It's ignored by the types which don't use it (like in ggml_quantize_chunk).
+# The optional pool runs the (de)quantization in parallel (see QuantPool).
+def quantize(data: np.ndarray, qtype: GGMLQuantizationType, imatrix: np.ndarray | None = None, *, pool: QuantPool | None = None) -> np.ndarray:
     if qtype == GGMLQuantizationType.F32:
         return data.astype(np.float32, copy=False)
     elif qtype == GGMLQuantizationType.F16:
         return data.astype(np.float16, copy=False)
     elif (q := _type_traits.get(qtype)) is not None:
-        return q.quantize(data)
+        return q.quantize(data, imatrix, pool=pool)
     else:
         raise NotImplementedError(f"Quantization for {qtype.name} is not yet implemented")
 
 
-def dequantize(data: np.ndarray, qtype: GGMLQuantizationType) -> np.ndarray:
+def dequantize(data: np.ndarray, qtype: GGMLQuantizationType, *, pool: QuantPool | None = None) -> np.ndarray:
     if qtype == GGMLQuantizationType.F32:
         return data.view(np.float32)
     elif qtype == GGMLQuantizationType.F16:
         return data.view(np.float16).astype(np.float32)
     elif (q := _type_traits.get(qtype)) is not None:
-        return q.dequantize(data)
+        return q.dequantize(data, pool=pool)
     else:
         raise NotImplementedError(f"Dequantization for {qtype.name} is not yet implemented")
 
@@ -133,19 +588,39 @@ class __Quant(ABC):
     def dequantize_blocks(cls, blocks: np.ndarray) -> np.ndarray:
         raise NotImplementedError
 
+    # Types which make use of an importance matrix should override this
+    # to return the weights to pass to quantize_blocks_weighted
+    @classmethod
+    def importance_weights(cls, rows: np.ndarray, qw: np.ndarray) -> np.ndarray | None:
+        del rows, qw  # unused
+        return None
+
+    @classmethod
+    def quantize_blocks_weighted(cls, blocks: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
     @classmethod
-    def quantize_rows(cls, rows: np.ndarray) -> np.ndarray:
+    def quantize_rows(cls, rows: np.ndarray, qw: np.ndarray | None = None) -> np.ndarray:
         rows = rows.astype(np.float32, copy=False)
         shape = rows.shape
         n_blocks = rows.size // cls.block_size
+        weights = None
+        if qw is not None:
+            qw = np.broadcast_to(qw.astype(np.float32, copy=False), shape)
+            weights = cls.importance_weights(rows, qw)
         blocks = rows.reshape((n_blocks, cls.block_size))
-        blocks = cls.quantize_blocks(blocks)
+        if weights is None:
+            blocks = cls.quantize_blocks(blocks)
+        else:
+            blocks = cls.quantize_blocks_weighted(blocks, weights.reshape((n_blocks, cls.block_size)))
         assert blocks.dtype == np.uint8
         assert blocks.shape[-1] == cls.type_size
         return blocks.reshape(cls.__shape_to_bytes(shape))
 
     @classmethod
     def dequantize_rows(cls, rows: np.ndarray) -> np.ndarray:
+        # (this can run in another process)
+        cls.init_grid()
         rows = rows.view(np.uint8)
         shape = rows.shape
         n_blocks = rows.size // cls.type_size
@@ -164,20 +639,20 @@ class __Quant(ABC):
         return quant_shape_from_byte_shape(shape, cls.qtype)
 
     @classmethod
-    def __quantize_array(cls, array: np.ndarray) -> np.ndarray:
-        return _apply_over_grouped_rows(cls.quantize_rows, arr=array, otype=np.uint8, oshape=cls.__shape_to_bytes(array.shape))
+    def __quantize_array(cls, array: np.ndarray, imatrix: np.ndarray | None = None, *, pool: QuantPool | None = None) -> np.ndarray:
+        return _apply_over_grouped_rows(cls.quantize_rows, arr=array, otype=np.uint8, oshape=cls.__shape_to_bytes(array.shape), aux=imatrix, pool=pool)
 
     @classmethod
-    def __dequantize_array(cls, array: np.ndarray) -> np.ndarray:
+    def __dequantize_array(cls, array: np.ndarray, *, pool: QuantPool | None = None) -> np.ndarray:
         cls.init_grid()
-        return _apply_over_grouped_rows(cls.dequantize_rows, arr=array, otype=np.float32, oshape=cls.__shape_from_bytes(array.shape))
+        return _apply_over_grouped_rows(cls.dequantize_rows, arr=array, otype=np.float32, oshape=cls.__shape_from_bytes(array.shape), pool=pool)
 
     @classmethod
-    def __quantize_lazy(cls, lazy_tensor: LazyNumpyTensor, /) -> Any:
+    def __quantize_lazy(cls, lazy_tensor: LazyNumpyTensor, imatrix: np.ndarray | None = None, /, *, pool: QuantPool | None = None) -> Any:
         pass
 
     @classmethod
-    def __dequantize_lazy(cls, lazy_tensor: LazyNumpyTensor, /) -> Any:
+    def __dequantize_lazy(cls, lazy_tensor: LazyNumpyTensor, /, *, pool: QuantPool | None = None) -> Any:
         pass
 
     @classmethod
@@ -185,20 +660,22 @@ class __Quant(ABC):
         return tensor.shape[-1] % cls.block_size == 0
 
     @classmethod
-    def quantize(cls, tensor: np.ndarray | LazyNumpyTensor) -> np.ndarray:
+    def quantize(cls, tensor: np.ndarray | LazyNumpyTensor, imatrix: np.ndarray | None = None, *, pool: QuantPool | None = None) -> np.ndarray:
         if not cls.can_quantize(tensor):
             raise QuantError(f"Can't quantize tensor with shape {tensor.shape} to {cls.qtype.name}")
+        if imatrix is not None and np.broadcast_shapes(imatrix.shape, tensor.shape) != tuple(tensor.shape):
+            raise ValueError(f"Importance matrix with shape {imatrix.shape} can't be used for a tensor with shape {tensor.shape}")
         if isinstance(tensor, LazyNumpyTensor):
-            return cls.__quantize_lazy(tensor)
+            return cls.__quantize_lazy(tensor, imatrix, pool=pool)
         else:
-            return cls.__quantize_array(tensor)
+            return cls.__quantize_array(tensor, imatrix, pool=pool)
 
     @classmethod
-    def dequantize(cls, tensor: np.ndarray | LazyNumpyTensor) -> np.ndarray:
+    def dequantize(cls, tensor: np.ndarray | LazyNumpyTensor, *, pool: QuantPool | None = None) -> np.ndarray:
         if isinstance(tensor, LazyNumpyTensor):
-            return cls.__dequantize_lazy(tensor)
+            return cls.__dequantize_lazy(tensor, pool=pool)
         else:
-            return cls.__dequantize_array(tensor)
+            return cls.__dequantize_array(tensor, pool=pool)
 
 
 class BF16(__Quant, qtype=GGMLQuantizationType.BF16):
@@ -238,6 +715,23 @@ class Q4_0(__Quant, qtype=GGMLQuantizationType.Q4_0):
 
         return np.concatenate([d, qs], axis=-1)
 
+    @classmethod
+    def importance_weights(cls, rows: np.ndarray, qw: np.ndarray) -> np.ndarray | None:
+        return _importance_weights(rows, qw, rows.shape[-1])
+
+    @classmethod
+    def quantize_blocks_weighted(cls, blocks: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        n_blocks = blocks.shape[0]
+
+        d, qs = _make_qx_quants(blocks, 8, 1, weights)
+
+        qs = qs.reshape((n_blocks, 2, cls.block_size // 2))
+        qs = qs[..., 0, :] | (qs[..., 1, :] << np.uint8(4))
+
+        d = d.astype(np.float16).view(np.uint8)
+
+        return np.concatenate([d, qs], axis=-1)
+
     @classmethod
     def dequantize_blocks(cls, blocks: np.ndarray) -> np.ndarray:
         n_blocks = blocks.shape[0]
@@ -273,6 +767,24 @@ class Q4_1(__Quant, qtype=GGMLQuantizationType.Q4_1):
 
         return np.concatenate([d, m, qs], axis=-1)
 
+    @classmethod
+    def importance_weights(cls, rows: np.ndarray, qw: np.ndarray) -> np.ndarray | None:
+        return _importance_weights(rows, qw, rows.shape[-1])
+
+    @classmethod
+    def quantize_blocks_weighted(cls, blocks: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        n_blocks = blocks.shape[0]
+
+        d, min, qs = _make_qkx2_quants(blocks, 15, weights, -0.9, 0.05, 36, False)
+
+        qs = qs.reshape((n_blocks, 2, cls.block_size // 2))
+        qs = qs[..., 0, :] | (qs[..., 1, :] << np.uint8(4))
+
+        d = d.astype(np.float16).view(np.uint8)
+        m = (-min).astype(np.float16).view(np.uint8)
+
+        return np.concatenate([d, m, qs], axis=-1)
+
     @classmethod
     def dequantize_blocks(cls, blocks: np.ndarray) -> np.ndarray:
         n_blocks = blocks.shape[0]
@@ -312,6 +824,25 @@ class Q5_0(__Quant, qtype=GGMLQuantizationType.Q5_0):
 
         return np.concatenate([d, qh, qs], axis=-1)
 
+    @classmethod
+    def importance_weights(cls, rows: np.ndarray, qw: np.ndarray) -> np.ndarray | None:
+        return _importance_weights(rows, qw, rows.shape[-1])
+
+    @classmethod
+    def quantize_blocks_weighted(cls, blocks: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        n_blocks = blocks.shape[0]
+
+        d, q = _make_qx_quants(blocks, 16, 1, weights)
+
+        qs = q.reshape((n_blocks, 2, cls.block_size // 2))
+        qs = (qs[..., 0, :] & np.uint8(0x0F)) | (qs[..., 1, :] << np.uint8(4))
+
+        qh = np.packbits(q.reshape((n_blocks, 1, 32)) >> np.uint8(4), axis=-1, bitorder="little").reshape(n_blocks, 4)
+
+        d = d.astype(np.float16).view(np.uint8)
+
+        return np.concatenate([d, qh, qs], axis=-1)
+
     @classmethod
     def dequantize_blocks(cls, blocks: np.ndarray) -> np.ndarray:
         n_blocks = blocks.shape[0]
@@ -355,6 +886,26 @@ class Q5_1(__Quant, qtype=GGMLQuantizationType.Q5_1):
 
         return np.concatenate([d, m, qh, qs], axis=-1)
 
+    @classmethod
+    def importance_weights(cls, rows: np.ndarray, qw: np.ndarray) -> np.ndarray | None:
+        return _importance_weights(rows, qw, rows.shape[-1])
+
+    @classmethod
+    def quantize_blocks_weighted(cls, blocks: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        n_blocks = blocks.shape[0]
+
+        d, min, q = _make_qkx2_quants(blocks, 31, weights, -0.9, 0.05, 36, False)
+
+        qs = q.reshape((n_blocks, 2, cls.block_size // 2))
+        qs = (qs[..., 0, :] & np.uint8(0x0F)) | (qs[..., 1, :] << np.uint8(4))
+
+        qh = np.packbits(q.reshape((n_blocks, 1, 32)) >> np.uint8(4), axis=-1, bitorder="little").reshape(n_blocks, 4)
+
+        d = d.astype(np.float16).view(np.uint8)
+        m = (-min).astype(np.float16).view(np.uint8)
+
+        return np.concatenate([d, m, qh, qs], axis=-1)
+
     @classmethod
     def dequantize_blocks(cls, blocks: np.ndarray) -> np.ndarray:
         n_blocks = blocks.shape[0]
@@ -404,6 +955,66 @@ class Q8_0(__Quant, qtype=GGMLQuantizationType.Q8_0):
 
 
 class Q2_K(__Quant, qtype=GGMLQuantizationType.Q2_K):
+    @classmethod
+    def quantize_blocks(cls, blocks: np.ndarray) -> np.ndarray:
+        n_blocks = blocks.shape[0]
+
+        x = blocks.reshape((n_blocks * QK_K // 16, 16))
+        scales, mins, L = _make_qkx2_quants(x, 3, abs(x), -0.5, 0.1, 15, True)
+        scales = scales.reshape((n_blocks, QK_K // 16))
+        mins = mins.reshape((n_blocks, QK_K // 16))
+
+        q4scale = np.float32(15)
+        # as we are deducting the min, scales are always positive
+        max_scale = scales.max(axis=-1, keepdims=True)
+        max_min = mins.max(axis=-1, keepdims=True)
+        has_scale = max_scale > 0
+        has_min = max_min > 0
+        max_scale = np.where(has_scale, max_scale, np.float32(1))
+        max_min = np.where(has_min, max_min, np.float32(1))
+
+        ls = np.where(has_scale, _nearest_int((q4scale / max_scale) * scales), 0).astype(np.int32)
+        lm = np.where(has_min, _nearest_int((q4scale / max_min) * mins), 0).astype(np.int32)
+        sc = ((ls & 0xFF) | ((lm << 4) & 0xFF)).astype(np.uint8)
+        d = np.where(has_scale, max_scale / q4scale, np.float32(0)).astype(np.float16)
+        dmin = np.where(has_min, max_min / q4scale, np.float32(0)).astype(np.float16)
+
+        return cls.requantize_and_pack(x, sc, d, dmin, L)
+
+    @classmethod
+    def importance_weights(cls, rows: np.ndarray, qw: np.ndarray) -> np.ndarray | None:
+        return _importance_weights(rows, qw, QK_K)
+
+    @classmethod
+    def quantize_blocks_weighted(cls, blocks: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        n_blocks = blocks.shape[0]
+
+        x = blocks.reshape((n_blocks * QK_K // 16, 16))
+        weights = weights.reshape(x.shape)
+        scales, mins, L = _make_qkx2_quants(x, 3, weights, -0.9, 0.05, 36, False)
+        sw = _sum_sequential(weights).reshape((n_blocks, QK_K // 16))
+
+        dm, ls = _make_qp_quants(scales.reshape((n_blocks, QK_K // 16)), 15, sw)
+        mm, lm = _make_qp_quants(mins.reshape((n_blocks, QK_K // 16)), 15, sw)
+        sc = ls | (lm << np.uint8(4))
+
+        return cls.requantize_and_pack(x, sc, dm.astype(np.float16), mm.astype(np.float16), L)
+
+    @classmethod
+    def requantize_and_pack(cls, x: np.ndarray, sc: np.ndarray, d: np.ndarray, dmin: np.ndarray, L: np.ndarray) -> np.ndarray:
+        n_blocks = sc.shape[0]
+
+        dl = (d.astype(np.float32) * (sc & 0xF).astype(np.float32)).reshape((-1, 1))
+        ml = (dmin.astype(np.float32) * (sc >> 4).astype(np.float32)).reshape((-1, 1))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            new_L = np.clip(_nearest_int((x + ml) / dl), 0, 3)
+        L = np.where(dl != 0, new_L, L).astype(np.uint8)
+
+        L = L.reshape((n_blocks, QK_K // 128, 4, 32)) << np.array([0, 2, 4, 6], dtype=np.uint8).reshape((1, 1, 4, 1))
+        qs = (L[..., 0, :] | L[..., 1, :] | L[..., 2, :] | L[..., 3, :]).reshape((n_blocks, QK_K // 4))
+
+        return np.concatenate([sc, qs, d.view(np.uint8), dmin.view(np.uint8)], axis=-1)
+
     @classmethod
     def dequantize_blocks(cls, blocks: np.ndarray) -> np.ndarray:
         n_blocks = blocks.shape[0]
@@ -431,6 +1042,68 @@ class Q2_K(__Quant, qtype=GGMLQuantizationType.Q2_K):
 
 
 class Q3_K(__Quant, qtype=GGMLQuantizationType.Q3_K):
+    @classmethod
+    def quantize_blocks(cls, blocks: np.ndarray) -> np.ndarray:
+        n_blocks = blocks.shape[0]
+
+        x = blocks.reshape((n_blocks * QK_K // 16, 16))
+        scales, L = _make_q3_quants(x, 4, True)
+        scales = scales.reshape((n_blocks, QK_K // 16))
+
+        imax = abs(scales).argmax(axis=-1, keepdims=True)
+        max_scale = np.take_along_axis(scales, imax, axis=-1)
+        has_scale = max_scale != 0
+        iscale = np.float32(-32) / np.where(has_scale, max_scale, np.float32(1))
+
+        ls = np.clip(_nearest_int(iscale * scales), -32, 31).astype(np.int8) + np.int8(32)
+        ls = np.where(has_scale, ls, 0).astype(np.uint8)
+        d = np.where(has_scale, np.float32(1) / iscale, np.float32(0)).astype(np.float16)
+
+        return cls.requantize_and_pack(x, ls, d, L)
+
+    @classmethod
+    def importance_weights(cls, rows: np.ndarray, qw: np.ndarray) -> np.ndarray | None:
+        return _importance_weights(rows, qw, QK_K, sigma_scale=2)
+
+    @classmethod
+    def quantize_blocks_weighted(cls, blocks: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        n_blocks = blocks.shape[0]
+
+        x = blocks.reshape((n_blocks * QK_K // 16, 16))
+        weights = weights.reshape(x.shape)
+        scales, L = _make_qx_quants(x, 4, 1, weights)
+        sw = _sum_sequential(weights).reshape((n_blocks, QK_K // 16))
+
+        d, ls = _make_qx_quants(scales.reshape((n_blocks, QK_K // 16)), 32, 1, sw)
+
+        return cls.requantize_and_pack(x, ls, d.astype(np.float16), L)
+
+    # ls are the 6-bit scales, offset by 32
+    @classmethod
+    def requantize_and_pack(cls, x: np.ndarray, ls: np.ndarray, d: np.ndarray, L: np.ndarray) -> np.ndarray:
+        n_blocks = ls.shape[0]
+
+        # pack the 6-bit scales (see the comment in dequantize_blocks)
+        lscales = (ls & 0x0F).reshape((n_blocks, 2, 8))
+        lscales = lscales[:, 0, :] | (lscales[:, 1, :] << np.uint8(4))
+        hscales = (ls >> np.uint8(4)).reshape((n_blocks, 4, 4)) << np.array([0, 2, 4, 6], dtype=np.uint8).reshape((1, 4, 1))
+        hscales = hscales[:, 0, :] | hscales[:, 1, :] | hscales[:, 2, :] | hscales[:, 3, :]
+
+        dl = (d.astype(np.float32) * (ls.astype(np.int8) - np.int8(32)).astype(np.float32)).reshape((-1, 1))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            new_L = np.clip(_nearest_int(x / dl), -4, 3) + 4
+        L = np.where(dl != 0, new_L, L).astype(np.uint8).reshape((n_blocks, QK_K))
+
+        # the high bit of the first 32 quants goes into bit 0 of hmask, the next 32 into bit 1, etc.
+        hmask = (L > 3).reshape((n_blocks, 8, 32)).astype(np.uint8) << np.arange(8, dtype=np.uint8).reshape((1, 8, 1))
+        hmask = np.bitwise_or.reduce(hmask, axis=1)
+        L = L & np.uint8(3)
+
+        L = L.reshape((n_blocks, QK_K // 128, 4, 32)) << np.array([0, 2, 4, 6], dtype=np.uint8).reshape((1, 1, 4, 1))
+        qs = (L[..., 0, :] | L[..., 1, :] | L[..., 2, :] | L[..., 3, :]).reshape((n_blocks, QK_K // 4))
+
+        return np.concatenate([hmask, qs, lscales, hscales, d.view(np.uint8)], axis=-1)
+
     @classmethod
     def dequantize_blocks(cls, blocks: np.ndarray) -> np.ndarray:
         n_blocks = blocks.shape[0]
@@ -502,6 +1175,87 @@ class Q4_K(__Quant, qtype=GGMLQuantizationType.Q4_K):
 
         return (sc.reshape((n_blocks, 8)), min.reshape((n_blocks, 8)))
 
+    @staticmethod
+    def pack_scale_min(ls: np.ndarray, lm: np.ndarray) -> np.ndarray:
+        # inverse of get_scale_min, for (n_blocks, 8) 6-bit scales and mins
+        n_blocks = ls.shape[0]
+        ls = ls.reshape((n_blocks, 2, 4))
+        lm = lm.reshape((n_blocks, 2, 4))
+        d = ls[:, 0] | ((ls[:, 1] >> np.uint8(4)) << np.uint8(6))
+        m = lm[:, 0] | ((lm[:, 1] >> np.uint8(4)) << np.uint8(6))
+        m_d = (ls[:, 1] & np.uint8(0x0F)) | ((lm[:, 1] & np.uint8(0x0F)) << np.uint8(4))
+        return np.concatenate([d, m, m_d], axis=-1)
+
+    @staticmethod
+    def quantize_scale_min(
+        blocks: np.ndarray, nmax: int, rmin: float, nstep: int, weights: np.ndarray | None = None, clamp: bool = False,
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        # shared by Q4_K and Q5_K, returns (d, dmin, scales, L) with L in [0, nmax]
+        n_blocks = blocks.shape[0]
+
+        x = blocks.reshape((n_blocks * QK_K // 32, 32))
+        if weights is None:
+            sum_x2 = _sum_sequential(x * x)[..., None]
+            av_x = np.sqrt(sum_x2 / np.float32(32))
+            scales, mins, L = _make_qkx2_quants(x, nmax, av_x + abs(x), rmin, 0.1, nstep, False)
+            scales = scales.reshape((n_blocks, QK_K // 32))
+            mins = mins.reshape((n_blocks, QK_K // 32))
+
+            # as we are deducting the min, scales are always positive
+            max_scale = np.maximum(scales.max(axis=-1, keepdims=True), np.float32(0))
+            max_min = np.maximum(mins.max(axis=-1, keepdims=True), np.float32(0))
+            with np.errstate(divide="ignore"):
+                inv_scale = np.where(max_scale > 0, np.float32(63) / max_scale, np.float32(0))
+                inv_min = np.where(max_min > 0, np.float32(63) / max_min, np.float32(0))
+            ls = np.minimum(_nearest_int(inv_scale * scales).astype(np.int32) & 0xFF, 63).astype(np.uint8)
+            lm = np.minimum(_nearest_int(inv_min * mins).astype(np.int32) & 0xFF, 63).astype(np.uint8)
+            d = (max_scale / np.float32(63)).astype(np.float16)
+            dmin = (max_min / np.float32(63)).astype(np.float16)
+        else:
+            weights = weights.reshape(x.shape)
+            scales, mins, L = _make_qkx2_quants(x, nmax, weights, -0.9, 0.05, 36, False)
+            sw = _sum_sequential(weights).reshape((n_blocks, QK_K // 32))
+
+            d, ls = _make_qp_quants(scales.reshape((n_blocks, QK_K // 32)), 63, sw)
+            dmin, lm = _make_qp_quants(mins.reshape((n_blocks, QK_K // 32)), 63, sw)
+            if clamp:
+                ls = np.minimum(ls, np.uint8(63))
+                lm = np.minimum(lm, np.uint8(63))
+            d = d.astype(np.float16)
+            dmin = dmin.astype(np.float16)
+
+        scales = Q4_K.pack_scale_min(ls, lm)
+        sc, m = Q4_K.get_scale_min(scales)
+
+        dl = (d.astype(np.float32) * sc.astype(np.float32)).reshape((-1, 1))
+        ml = (dmin.astype(np.float32) * m.astype(np.float32)).reshape((-1, 1))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            new_L = np.clip(_nearest_int((x + ml) / dl), 0, nmax)
+        L = np.where(dl != 0, new_L, L).astype(np.uint8).reshape((n_blocks, QK_K))
+
+        return d, dmin, scales, L
+
+    @classmethod
+    def quantize_blocks(cls, blocks: np.ndarray) -> np.ndarray:
+        return cls.pack(*cls.quantize_scale_min(blocks, 15, -1.0, 20))
+
+    @classmethod
+    def importance_weights(cls, rows: np.ndarray, qw: np.ndarray) -> np.ndarray | None:
+        return _importance_weights(rows, qw, QK_K, sigma_scale=2)
+
+    @classmethod
+    def quantize_blocks_weighted(cls, blocks: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        return cls.pack(*cls.quantize_scale_min(blocks, 15, -1.0, 20, weights))
+
+    @classmethod
+    def pack(cls, d: np.ndarray, dmin: np.ndarray, scales: np.ndarray, L: np.ndarray) -> np.ndarray:
+        n_blocks = L.shape[0]
+
+        L = L.reshape((n_blocks, QK_K // 64, 2, 32))
+        qs = (L[..., 0, :] | (L[..., 1, :] << np.uint8(4))).reshape((n_blocks, QK_K // 2))
+
+        return np.concatenate([d.view(np.uint8), dmin.view(np.uint8), scales, qs], axis=-1)
+
     @classmethod
     def dequantize_blocks(cls, blocks: np.ndarray) -> np.ndarray:
         n_blocks = blocks.shape[0]
@@ -525,6 +1279,29 @@ class Q4_K(__Quant, qtype=GGMLQuantizationType.Q4_K):
 
 
 class Q5_K(__Quant, qtype=GGMLQuantizationType.Q5_K):
+    @classmethod
+    def quantize_blocks(cls, blocks: np.ndarray) -> np.ndarray:
+        return cls.pack(*Q4_K.quantize_scale_min(blocks, 31, -0.5, 15))
+
+    @classmethod
+    def importance_weights(cls, rows: np.ndarray, qw: np.ndarray) -> np.ndarray | None:
+        return _importance_weights(rows, qw, QK_K, sigma_scale=2)
+
+    @classmethod
+    def quantize_blocks_weighted(cls, blocks: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        return cls.pack(*Q4_K.quantize_scale_min(blocks, 31, -0.5, 15, weights, clamp=True))
+
+    @classmethod
+    def pack(cls, d: np.ndarray, dmin: np.ndarray, scales: np.ndarray, L: np.ndarray) -> np.ndarray:
+        n_blocks = L.shape[0]
+
+        qh = (L >> np.uint8(4)).reshape((n_blocks, 8, 32)) << np.arange(8, dtype=np.uint8).reshape((1, 8, 1))
+        qh = np.bitwise_or.reduce(qh, axis=1)
+        L = (L & np.uint8(0x0F)).reshape((n_blocks, QK_K // 64, 2, 32))
+        qs = (L[..., 0, :] | (L[..., 1, :] << np.uint8(4))).reshape((n_blocks, QK_K // 2))
+
+        return np.concatenate([d.view(np.uint8), dmin.view(np.uint8), scales, qh, qs], axis=-1)
+
     @classmethod
     def dequantize_blocks(cls, blocks: np.ndarray) -> np.ndarray:
         n_blocks = blocks.shape[0]
@@ -552,6 +1329,45 @@ class Q5_K(__Quant, qtype=GGMLQuantizationType.Q5_K):
 
 
 class Q6_K(__Quant, qtype=GGMLQuantizationType.Q6_K):
+    @classmethod
+    def quantize_blocks(cls, blocks: np.ndarray) -> np.ndarray:
+        return cls.quantize_blocks_weighted(blocks, None)
+
+    # NOTE: the importance matrix is used as-is for Q6_K
+    @classmethod
+    def importance_weights(cls, rows: np.ndarray, qw: np.ndarray) -> np.ndarray | None:
+        return qw
+
+    @classmethod
+    def quantize_blocks_weighted(cls, blocks: np.ndarray, weights: np.ndarray | None) -> np.ndarray:
+        n_blocks = blocks.shape[0]
+
+        x = blocks.reshape((n_blocks * QK_K // 16, 16))
+        scales, L = _make_qx_quants(x, 32, 1, weights.reshape(x.shape) if weights is not None else None)
+        scales = scales.reshape((n_blocks, QK_K // 16))
+
+        imax = abs(scales).argmax(axis=-1, keepdims=True)
+        max_scale = np.take_along_axis(scales, imax, axis=-1)
+        is_zero = abs(max_scale) < _GROUP_MAX_EPS
+        iscale = np.float32(-128) / np.where(is_zero, np.float32(1), max_scale)
+
+        d = np.where(is_zero, np.float32(0), np.float32(1) / iscale).astype(np.float16)
+        sc = np.where(is_zero, 0, np.minimum(_nearest_int(iscale * scales), 127)).astype(np.int8)
+
+        dl = (d.astype(np.float32) * sc.astype(np.float32)).reshape((-1, 1))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            new_L = np.clip(_nearest_int(x / dl), -32, 31) + 32
+        L = np.where(dl != 0, new_L, L).astype(np.uint8).reshape((n_blocks, QK_K))
+        L = np.where(is_zero, 0, L).astype(np.uint8)
+
+        L = L.reshape((n_blocks, QK_K // 128, 4, 32))
+        ql = (L[..., :2, :] & np.uint8(0x0F)) | ((L[..., 2:, :] & np.uint8(0x0F)) << np.uint8(4))
+        ql = ql.reshape((n_blocks, QK_K // 2))
+        qh = (L >> np.uint8(4)) << np.array([0, 2, 4, 6], dtype=np.uint8).reshape((1, 1, 4, 1))
+        qh = (qh[..., 0, :] | qh[..., 1, :] | qh[..., 2, :] | qh[..., 3, :]).reshape((n_blocks, QK_K // 4))
+
+        return np.concatenate([ql, qh, sc.view(np.uint8), d.view(np.uint8)], axis=-1)
+
     @classmethod
     def dequantize_blocks(cls, blocks: np.ndarray) -> np.ndarray:
         n_blocks = blocks.shape[0]
@@ -1222,6 +2038,68 @@ class IQ1_M(__Quant, qtype=GGMLQuantizationType.IQ1_M):
 class IQ4_NL(__Quant, qtype=GGMLQuantizationType.IQ4_NL):
     kvalues = (-127, -104, -83, -65, -49, -35, -22, -10, 1, 13, 25, 38, 53, 69, 89, 113)
 
+    # same as best_index_int8 in ggml-quants.c (the index of the nearest value, the upper one on ties)
+    @classmethod
+    def best_index(cls, x: np.ndarray) -> np.ndarray:
+        values = np.array(cls.kvalues, dtype=np.float32)
+        mu = np.clip(np.searchsorted(values, x, side="right"), 1, len(values) - 1)
+        return np.where(x - values[mu - 1] < values[mu] - x, mu - 1, mu).astype(np.uint8)
+
+    # Port of quantize_row_iq4_nl_impl, for the scales of all the sub-blocks at once
+    # (n_blocks, n_sub_blocks, 32) -> scales: (n_blocks, n_sub_blocks, 1)
+    @classmethod
+    def quantize_sub_blocks(cls, xb: np.ndarray, weights: np.ndarray | None = None, ntry: int = 7) -> np.ndarray:
+        values = np.array(cls.kvalues, dtype=np.float32)
+        w = xb * xb if weights is None else weights.reshape(xb.shape)
+
+        imax = abs(xb).argmax(axis=-1)[..., None]
+        max = np.take_along_axis(xb, imax, axis=-1)
+        is_zero = abs(max) < _GROUP_MAX_EPS
+        max = np.where(is_zero, np.float32(1), max)
+
+        def sums(id: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+            q = values[cls.best_index(id * xb)]
+            wq = w * q
+            return _sum_sequential(wq * xb)[..., None], _sum_sequential(wq * q)[..., None]
+
+        d = -max / values[0] if ntry > 0 else max / values[0]
+        sumqx, sumq2 = sums(np.float32(1) / d)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            d = sumqx / sumq2
+            best = d * sumqx
+            for itry in range(-ntry, ntry + 1):
+                sumqx, sumq2 = sums((np.float32(itry) + values[0]) / max)
+                replace = (sumq2 > 0) & (sumqx * sumqx > best * sumq2)
+                d = np.where(replace, sumqx / sumq2, d)
+                best = np.where(replace, d * sumqx, best)
+
+        return np.where(is_zero, np.float32(0), d)
+
+    @staticmethod
+    def pack_qs(L: np.ndarray) -> np.ndarray:
+        n_blocks = L.shape[0]
+        L = L.reshape((n_blocks, -1, 2, 16))
+        return (L[..., 0, :] | (L[..., 1, :] << np.uint8(4))).reshape((n_blocks, -1))
+
+    @classmethod
+    def quantize_blocks(cls, blocks: np.ndarray) -> np.ndarray:
+        return cls.quantize_blocks_weighted(blocks, None)
+
+    @classmethod
+    def importance_weights(cls, rows: np.ndarray, qw: np.ndarray) -> np.ndarray | None:
+        return _importance_weights(rows, qw, cls.block_size, sigma_scale=2)
+
+    @classmethod
+    def quantize_blocks_weighted(cls, blocks: np.ndarray, weights: np.ndarray | None) -> np.ndarray:
+        scales = cls.quantize_sub_blocks(blocks[:, None, :], weights)[:, 0]
+
+        with np.errstate(divide="ignore"):
+            id = np.where(scales != 0, np.float32(1) / scales, np.float32(0))
+        L = cls.best_index(id * blocks)
+
+        d = scales.astype(np.float16).view(np.uint8)
+        return np.concatenate([d, cls.pack_qs(L)], axis=-1)
+
     @classmethod
     def dequantize_blocks(cls, blocks: np.ndarray) -> np.ndarray:
         n_blocks = blocks.shape[0]
@@ -1241,6 +2119,46 @@ class IQ4_NL(__Quant, qtype=GGMLQuantizationType.IQ4_NL):
 
 
 class IQ4_XS(__Quant, qtype=GGMLQuantizationType.IQ4_XS):
+    @classmethod
+    def quantize_blocks(cls, blocks: np.ndarray) -> np.ndarray:
+        return cls.quantize_blocks_weighted(blocks, None)
+
+    @classmethod
+    def importance_weights(cls, rows: np.ndarray, qw: np.ndarray) -> np.ndarray | None:
+        return _importance_weights(rows, qw, QK_K, sigma_scale=2)
+
+    @classmethod
+    def quantize_blocks_weighted(cls, blocks: np.ndarray, weights: np.ndarray | None) -> np.ndarray:
+        n_blocks = blocks.shape[0]
+        xb = blocks.reshape((n_blocks, QK_K // 32, 32))
+
+        scales = IQ4_NL.quantize_sub_blocks(xb, weights).reshape((n_blocks, QK_K // 32))
+
+        # the scale with the biggest magnitude (the first one on ties, NaN is never picked)
+        abs_scales = np.nan_to_num(abs(scales), nan=0)
+        imax = abs_scales.argmax(axis=-1)[..., None]
+        is_zero = np.take_along_axis(abs_scales, imax, axis=-1) == 0
+        max_scale = np.where(is_zero, np.float32(0), np.take_along_axis(scales, imax, axis=-1))
+
+        d = -max_scale / np.float32(32)
+        with np.errstate(divide="ignore"):
+            id = np.where(d != 0, np.float32(1) / d, np.float32(0))
+        # NOTE: nearest_int in C gives 0 for NaN (from sub-blocks with only zero weights)
+        ls = np.clip(np.nan_to_num(_nearest_int(id * scales), nan=0), -32, 31)
+        dl = (d * ls)[..., None]
+        with np.errstate(divide="ignore"):
+            idl = np.where(dl != 0, np.float32(1) / dl, np.float32(0))
+        L = IQ4_NL.best_index(idl * xb)
+
+        ls = (ls + 32).astype(np.uint8)
+        scales_l = (ls.reshape((n_blocks, -1, 2)) & np.uint8(0x0F)) << np.array([0, 4], dtype=np.uint8)
+        scales_l = scales_l[..., 0] | scales_l[..., 1]
+        scales_h = (ls >> np.uint8(4)).astype(np.uint16) << np.array([2 * i for i in range(QK_K // 32)], dtype=np.uint16)
+        scales_h = np.bitwise_or.reduce(scales_h, axis=-1, keepdims=True)
+
+        d = d.astype(np.float16).view(np.uint8)
+        return np.concatenate([d, scales_h.view(np.uint8), scales_l, IQ4_NL.pack_qs(L)], axis=-1)
+
     @classmethod
     def dequantize_blocks(cls, blocks: np.ndarray) -> np.ndarray:
         n_blocks = blocks.shape[0]
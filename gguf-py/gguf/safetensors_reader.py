@@ -0,0 +1,112 @@
+#
+# Zero-copy reading of safetensors files, without PyTorch.
+# ref: https://github.com/huggingface/safetensors#format
+#
+from __future__ import annotations
+
+import json
+import os
+from typing import Any, Literal, NamedTuple
+
+import numpy as np
+
+from .lazy import LazyNumpyTensor
+
+
+# NOTE: NumPy doesn't have these types, so the raw bits are used instead:
+#   - BF16 tensors are read as np.uint16 (the upper half of the equivalent np.float32)
+#   - F8_E4M3 and F8_E5M2 tensors are read as np.uint8
+SAFETENSORS_DTYPES: dict[str, np.dtype[Any]] = {
+    "F64":     np.dtype(np.float64),
+    "F32":     np.dtype(np.float32),
+    "F16":     np.dtype(np.float16),
+    "BF16":    np.dtype(np.uint16),
+    "I64":     np.dtype(np.int64),
+    "I32":     np.dtype(np.int32),
+    "I16":     np.dtype(np.int16),
+    "I8":      np.dtype(np.int8),
+    "U64":     np.dtype(np.uint64),
+    "U32":     np.dtype(np.uint32),
+    "U16":     np.dtype(np.uint16),
+    "U8":      np.dtype(np.uint8),
+    "BOOL":    np.dtype(np.bool_),
+    "F8_E4M3": np.dtype(np.uint8),
+    "F8_E5M2": np.dtype(np.uint8),
+}
+
+# Sanity limit for the size of the JSON header
+SAFETENSORS_MAX_HEADER_SIZE = 100 * 1024 * 1024
+
+
+class SafetensorsTensor(NamedTuple):
+    name: str
+    # dtype as written in the file, e.g. "BF16"
+    dtype: str
+    shape: tuple[int, ...]
+    # offset of the data from the start of the file
+    data_offset: int
+    n_bytes: int
+    # view of the memory-mapped file, with the dtype from SAFETENSORS_DTYPES
+    data: np.ndarray[Any, Any]
+
+
+class SafetensorsReader:
+    metadata: dict[str, str]
+    tensors: dict[str, SafetensorsTensor]
+
+    def __init__(self, path: os.PathLike[str] | str, mode: Literal['r', 'r+', 'c'] = 'r'):
+        self.path = path
+        self.data = np.memmap(path, mode=mode)
+        if len(self.data) < 8:
+            raise ValueError(f"{path!r} is too small to be a safetensors file")
+        header_size = int(self.data[:8].view("<u8")[0])
+        if header_size > min(SAFETENSORS_MAX_HEADER_SIZE, len(self.data) - 8):
+            raise ValueError(f"Invalid header size {header_size} in {path!r}")
+        header: dict[str, Any] = json.loads(self.data[8:8 + header_size].tobytes())
+        if not isinstance(header, dict):
+            raise ValueError(f"Invalid header in {path!r}")
+
+        self.metadata = header.pop("__metadata__", None) or {}
+        self.tensors = {}
+        data_start = 8 + header_size
+        for name, info in header.items():
+            dtype_name: str = info["dtype"]
+            if (dtype := SAFETENSORS_DTYPES.get(dtype_name)) is None:
+                raise ValueError(f"Unsupported dtype {dtype_name!r} for tensor {name!r} in {path!r}")
+            # safetensors files are always little-endian
+            dtype = dtype.newbyteorder("<")
+            shape = tuple(int(n) for n in info["shape"])
+            begin, end = (int(n) for n in info["data_offsets"])
+            n_bytes = int(np.prod(shape)) * dtype.itemsize
+            if not (0 <= begin <= end <= len(self.data) - data_start) or end - begin != n_bytes:
+                raise ValueError(f"Invalid data offsets {(begin, end)} for tensor {name!r} of shape {shape} and dtype {dtype_name} in {path!r}")
+            self.tensors[name] = SafetensorsTensor(
+                name=name,
+                dtype=dtype_name,
+                shape=shape,
+                data_offset=data_start + begin,
+                n_bytes=n_bytes,
+                data=self.data[data_start + begin:data_start + end].view(dtype).reshape(shape),
+            )
+
+    def __len__(self) -> int:
+        return len(self.tensors)
+
+    def keys(self) -> list[str]:
+        return list(self.tensors.keys())
+
+    def get_tensor(self, name: str) -> np.ndarray[Any, Any]:
+        return self.tensors[name].data
+
+    # Can be used as the source of lazy computations; the pages of the file are only read when needed
+    def get_lazy_tensor(self, name: str) -> LazyNumpyTensor:
+        data = self.tensors[name].data
+        return LazyNumpyTensor(
+            meta=LazyNumpyTensor.meta_with_dtype_and_shape(data.dtype, data.shape),
+            args=(data,),
+            func=np.asarray,
+        )
+
+
+def bf16_to_f32(data: np.ndarray[Any, Any]) -> np.ndarray[Any, Any]:
+    return (data.astype(np.uint32) << 16).view(np.float32)
@@ -0,0 +1,97 @@
+#
+# Writing of safetensors files, with the data of each tensor written (or copied) at its final offset.
+# ref: https://github.com/huggingface/safetensors#format
+#
+from __future__ import annotations
+
+import json
+import os
+from io import BufferedWriter
+from typing import Any, NamedTuple, Sequence
+
+import numpy as np
+
+from .gguf_writer import _copy_file_range, _pwrite, _MAX_WRITE_SIZE
+from .safetensors_reader import SAFETENSORS_DTYPES
+
+
+class SafetensorsTensorInfo(NamedTuple):
+    dtype: str
+    shape: tuple[int, ...]
+    # offset of the data from the start of the file
+    offset: int
+    n_bytes: int
+
+
+# The tensor infos are added first, then the header is written, and the data of the tensors can then be
+# written in any order (and from multiple threads), in one or more parts, without seeking the file.
+class SafetensorsWriter:
+    fout: BufferedWriter | None
+    tensors: dict[str, SafetensorsTensorInfo]
+
+    def __init__(self, path: os.PathLike[str] | str, metadata: dict[str, str] | None = None):
+        self.path = path
+        self.metadata = {"format": "pt"} if metadata is None else metadata
+        self.fout = None
+        self.tensors = {}
+        self.data_size = 0
+
+    def add_tensor_info(self, name: str, dtype: str, shape: Sequence[int]) -> None:
+        if self.fout is not None:
+            raise ValueError("The header has already been written")
+        if name in self.tensors or name == "__metadata__":
+            raise ValueError(f"Duplicated tensor name {name!r}")
+        if (np_dtype := SAFETENSORS_DTYPES.get(dtype)) is None:
+            raise ValueError(f"Unsupported dtype {dtype!r} for tensor {name!r}")
+        shape = tuple(int(n) for n in shape)
+        n_bytes = int(np.prod(shape)) * np_dtype.itemsize
+        # (the offsets are made relative to the file once the size of the header is known)
+        self.tensors[name] = SafetensorsTensorInfo(dtype, shape, self.data_size, n_bytes)
+        self.data_size += n_bytes
+
+    def write_header_to_file(self) -> None:
+        header: dict[str, Any] = {"__metadata__": self.metadata} if self.metadata else {}
+        for name, ti in self.tensors.items():
+            header[name] = {"dtype": ti.dtype, "shape": list(ti.shape), "data_offsets": [ti.offset, ti.offset + ti.n_bytes]}
+        header_bytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+        # the data is aligned to 8 bytes by padding the header with spaces
+        header_bytes += b" " * (-len(header_bytes) % 8)
+        data_start = 8 + len(header_bytes)
+
+        self.fout = open(self.path, "wb")
+        self.fout.write(np.uint64(len(header_bytes)).astype("<u8").tobytes())
+        self.fout.write(header_bytes)
+        self.fout.flush()
+        self.fout.truncate(data_start + self.data_size)
+        self.tensors = {name: ti._replace(offset=data_start + ti.offset) for name, ti in self.tensors.items()}
+
+    # Write (part of) the data of a tensor, starting at offset bytes from the start of its data.
+    # The data must be in little-endian byte order.
+    def write_tensor_data(self, name: str, data: np.ndarray, offset: int = 0) -> None:
+        ti = self._get_tensor_info(name)
+        buf = np.ascontiguousarray(data).reshape(-1).view(np.uint8).data
+        if offset < 0 or offset + len(buf) > ti.n_bytes:
+            raise ValueError(f"Writing {len(buf)} bytes at offset {offset} is out of the {ti.n_bytes} bytes of tensor {name!r}")
+        assert self.fout is not None
+        fd = self.fout.fileno()
+        pos = ti.offset + offset
+        while len(buf) > 0:
+            n = _pwrite(fd, buf[:_MAX_WRITE_SIZE], pos)
+            buf = buf[n:]
+            pos += n
+
+    # Copy the data of a tensor as is from another file, without going through Python when the OS allows it.
+    def copy_tensor_data(self, name: str, src_fd: int, src_offset: int) -> None:
+        ti = self._get_tensor_info(name)
+        assert self.fout is not None
+        _copy_file_range(src_fd, self.fout.fileno(), src_offset, ti.offset, ti.n_bytes)
+
+    def close(self) -> None:
+        if self.fout is not None:
+            self.fout.close()
+            self.fout = None
+
+    def _get_tensor_info(self, name: str) -> SafetensorsTensorInfo:
+        if self.fout is None:
+            raise ValueError("The header must be written before the tensor data")
+        return self.tensors[name]
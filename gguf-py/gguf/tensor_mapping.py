@@ -1,5 +1,6 @@
 from __future__ import annotations
 
+from functools import lru_cache
 from typing import Sequence
 
 from .constants import MODEL_ARCH, MODEL_TENSOR, MODEL_TENSORS, TENSOR_NAMES
@@ -705,37 +706,84 @@ class TensorNameMap:
         },
     }
 
-    mapping: dict[str, tuple[MODEL_TENSOR, str]]
+    arch: MODEL_ARCH
+    n_blocks: int
+
+    # Compiled mappings, per architecture.
+    # The names of the block tensors are split around their block id into (prefix, suffix) templates,
+    # so that the names don't have to be expanded for every block.
+    _compiled: dict[MODEL_ARCH, _CompiledTensorNames] = {}
 
     def __init__(self, arch: MODEL_ARCH, n_blocks: int):
-        self.mapping = {}
-        for tensor, keys in self.mappings_cfg.items():
-            if tensor not in MODEL_TENSORS[arch]:
-                continue
-            tensor_name = TENSOR_NAMES[tensor]
-            self.mapping[tensor_name] = (tensor, tensor_name)
-            for key in keys:
-                self.mapping[key] = (tensor, tensor_name)
-        if arch in self.arch_block_mappings_cfg:
-            self.block_mappings_cfg.update(self.arch_block_mappings_cfg[arch])
-        for bid in range(n_blocks):
-            for tensor, keys in self.block_mappings_cfg.items():
-                if tensor not in MODEL_TENSORS[arch]:
+        self.arch = arch
+        self.n_blocks = n_blocks
+        if (compiled := self._compiled.get(arch)) is None:
+            compiled = self._compiled[arch] = _CompiledTensorNames(self, arch)
+        self._names = compiled
+        self._static = compiled.static if n_blocks == 0 else compiled.static_with_blocks
+        self._mapping: dict[str, tuple[MODEL_TENSOR, str]] | None = None
+
+    def _block_mappings_cfg(self) -> dict[MODEL_TENSOR, tuple[str, ...]]:
+        return {**self.block_mappings_cfg, **self.arch_block_mappings_cfg.get(self.arch, {})}
+
+    # All the mapped names, expanded for every block
+    @property
+    def mapping(self) -> dict[str, tuple[MODEL_TENSOR, str]]:
+        if self._mapping is None:
+            mapping: dict[str, tuple[MODEL_TENSOR, str]] = {}
+            for tensor, keys in self.mappings_cfg.items():
+                if tensor not in MODEL_TENSORS[self.arch]:
                     continue
-
-                tensor_name = TENSOR_NAMES[tensor].format(bid = bid)
-                self.mapping[tensor_name] = (tensor, tensor_name)
+                tensor_name = TENSOR_NAMES[tensor]
+                mapping[tensor_name] = (tensor, tensor_name)
                 for key in keys:
-                    key = key.format(bid = bid)
-                    self.mapping[key] = (tensor, tensor_name)
+                    mapping[key] = (tensor, tensor_name)
+            block_mappings_cfg = self._block_mappings_cfg()
+            for bid in range(self.n_blocks):
+                for tensor, keys in block_mappings_cfg.items():
+                    if tensor not in MODEL_TENSORS[self.arch]:
+                        continue
+
+                    tensor_name = TENSOR_NAMES[tensor].format(bid = bid)
+                    mapping[tensor_name] = (tensor, tensor_name)
+                    for key in keys:
+                        key = key.format(bid = bid)
+                        mapping[key] = (tensor, tensor_name)
+            self._mapping = mapping
+        return self._mapping
+
+    def _get(self, key: str) -> tuple[MODEL_TENSOR, str] | None:
+        # try each number in the name as the block id
+        if self.n_blocks > 0:
+            start = 0
+            for part in key.split("."):
+                end = start + len(part)
+                if part.isdecimal() and part.isascii():
+                    result = self._names.blocks.get((key[:start], key[end:]))
+                    # (the block ids are formatted without leading zeros)
+                    if result is not None and int(part) < self.n_blocks and (part == "0" or part[0] != "0"):
+                        tensor, name_prefix, name_suffix = result
+                        return tensor, (name_prefix + part + name_suffix) if name_suffix is not None else name_prefix
+                start = end + 1
+        return self._static.get(key)
+
+    def max_name_length(self) -> int:
+        name_lengths = [len(name) for _, name in self._static.values()]
+        if self.n_blocks > 0:
+            bid_length = len(str(self.n_blocks - 1))
+            name_lengths.extend(
+                len(name_prefix) + (bid_length + len(name_suffix) if name_suffix is not None else 0)
+                for _, name_prefix, name_suffix in self._names.blocks.values()
+            )
+        return max(name_lengths, default=0)
 
     def get_type_and_name(self, key: str, try_suffixes: Sequence[str] = ()) -> tuple[MODEL_TENSOR, str] | None:
-        result = self.mapping.get(key)
+        result = self._get(key)
         if result is not None:
             return result
         for suffix in try_suffixes:
             if key.endswith(suffix):
-                result = self.mapping.get(key[:-len(suffix)])
+                result = self._get(key[:-len(suffix)])
                 if result is not None:
                     return result[0], result[1] + suffix
         return None
@@ -753,17 +801,57 @@ class TensorNameMap:
         return result[0]
 
     def __getitem__(self, key: str) -> str:
-        try:
-            return self.mapping[key][1]
-        except KeyError:
+        result = self._get(key)
+        if result is None:
             raise KeyError(key)
+        return result[1]
 
     def __contains__(self, key: str) -> bool:
-        return key in self.mapping
+        return self._get(key) is not None
 
     def __repr__(self) -> str:
         return repr(self.mapping)
 
 
+class _CompiledTensorNames:
+    # names without a block id
+    static: dict[str, tuple[MODEL_TENSOR, str]]
+    # same, including the names from the block mappings without a block id (only used when there are blocks)
+    static_with_blocks: dict[str, tuple[MODEL_TENSOR, str]]
+    # (prefix, suffix) of the names with a block id -> (tensor, prefix of the mapped name, suffix of the mapped name)
+    # (the suffix is None when the mapped name doesn't have a block id)
+    blocks: dict[tuple[str, str], tuple[MODEL_TENSOR, str, str | None]]
+
+    def __init__(self, tmap: TensorNameMap, arch: MODEL_ARCH):
+        self.static = {}
+        for tensor, keys in tmap.mappings_cfg.items():
+            if tensor not in MODEL_TENSORS[arch]:
+                continue
+            tensor_name = TENSOR_NAMES[tensor]
+            self.static[tensor_name] = (tensor, tensor_name)
+            for key in keys:
+                self.static[key] = (tensor, tensor_name)
+
+        self.static_with_blocks = dict(self.static)
+        self.blocks = {}
+        for tensor, keys in tmap._block_mappings_cfg().items():
+            if tensor not in MODEL_TENSORS[arch]:
+                continue
+            tensor_name = TENSOR_NAMES[tensor]
+            for key in (tensor_name, *keys):
+                if "{bid}" not in key:
+                    self.static_with_blocks[key] = (tensor, tensor_name)
+                    continue
+                prefix, _, suffix = key.partition("{bid}")
+                # the block ids are looked up as whole dot-separated parts of the names
+                assert prefix[-1:] in ("", ".") and suffix[:1] in ("", ".") and "{bid}" not in suffix
+                if "{bid}" in tensor_name:
+                    name_prefix, _, name_suffix = tensor_name.partition("{bid}")
+                    self.blocks[(prefix, suffix)] = (tensor, name_prefix, name_suffix)
+                else:
+                    self.blocks[(prefix, suffix)] = (tensor, tensor_name, None)
+
+
+@lru_cache(maxsize=None)
 def get_tensor_name_map(arch: MODEL_ARCH, n_blocks: int) -> TensorNameMap:
     return TensorNameMap(arch, n_blocks)
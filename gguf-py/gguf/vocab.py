@@ -1,9 +1,16 @@
 from __future__ import annotations
 
+import contextlib
+import hashlib
+import heapq
+import importlib.metadata
 import re
 import logging
 import json
 import os
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from typing import Any, Callable, Sequence, Mapping, Iterable, Protocol, ClassVar, runtime_checkable
 
@@ -292,6 +299,182 @@ class BpeVocab(Vocab):
         return f"<BpeVocab with {self.vocab_size_base} base tokens and {len(self.added_tokens_list)} added tokens>"
 
 
+# The vocab of a fast tokenizer of transformers, read from its tokenizer.json without loading transformers.
+# Like with AutoTokenizer, the special tokens named in tokenizer_config.json and special_tokens_map.json
+# (or the defaults of the tokenizer class) are added tokens too.
+# FileNotFoundError is raised when the vocab could differ from the one of AutoTokenizer,
+# e.g. for a tokenizer with custom code or a special token which isn't in the vocab.
+class TokenizerJsonVocab:
+    special_token_attributes: ClassVar[tuple[str, ...]] = (
+        'bos_token', 'eos_token', 'unk_token', 'sep_token', 'pad_token', 'cls_token', 'mask_token',
+    )
+    # The special tokens of the tokenizer classes for which they aren't named in the config
+    default_special_tokens: ClassVar[dict[str, dict[str, str]]] = {
+        'PreTrainedTokenizer': {},
+        'GPT2Tokenizer':       {'unk_token': '<|endoftext|>', 'bos_token': '<|endoftext|>', 'eos_token': '<|endoftext|>'},
+        'GPTNeoXTokenizer':    {'unk_token': '<|endoftext|>', 'bos_token': '<|endoftext|>', 'eos_token': '<|endoftext|>'},
+        'CodeGenTokenizer':    {'unk_token': '<|endoftext|>', 'bos_token': '<|endoftext|>', 'eos_token': '<|endoftext|>'},
+        'Qwen2Tokenizer':      {'unk_token': '<|endoftext|>', 'eos_token': '<|endoftext|>', 'pad_token': '<|endoftext|>'},
+        'LlamaTokenizer':      {'unk_token': '<unk>', 'bos_token': '<s>', 'eos_token': '</s>'},
+        'BloomTokenizer':      {'unk_token': '<unk>', 'bos_token': '<s>', 'eos_token': '</s>', 'pad_token': '<pad>'},
+        'GemmaTokenizer':      {'unk_token': '<unk>', 'bos_token': '<bos>', 'eos_token': '<eos>', 'pad_token': '<pad>'},
+        'BertTokenizer':       {'unk_token': '[UNK]', 'sep_token': '[SEP]', 'pad_token': '[PAD]', 'cls_token': '[CLS]', 'mask_token': '[MASK]'},
+        'RobertaTokenizer':    {'bos_token': '<s>', 'eos_token': '</s>', 'sep_token': '</s>', 'cls_token': '<s>',
+                                'unk_token': '<unk>', 'pad_token': '<pad>', 'mask_token': '<mask>'},
+    }
+
+    # all the tokens, including the added tokens
+    vocab: dict[str, int]
+    added_tokens: dict[str, int]
+    special_ids: set[int]
+
+    def __init__(self, base_path: Path):
+        fname_tokenizer = base_path / 'tokenizer.json'
+        tokenizer_config_file = base_path / 'tokenizer_config.json'
+        if not fname_tokenizer.is_file() or not tokenizer_config_file.is_file():
+            raise FileNotFoundError('Cannot find tokenizer.json and tokenizer_config.json')
+
+        with open(tokenizer_config_file, encoding='utf-8') as f:
+            tokenizer_config = json.load(f)
+        tokenizer_class = tokenizer_config.get('tokenizer_class')
+        if not isinstance(tokenizer_class, str) or 'auto_map' in tokenizer_config:
+            raise FileNotFoundError('Cannot find a known tokenizer class')
+        if tokenizer_class.endswith('Fast'):
+            tokenizer_class = tokenizer_class[:-len('Fast')]
+        if (default_special_tokens := self.default_special_tokens.get(tokenizer_class)) is None:
+            raise FileNotFoundError(f'Unknown tokenizer class {tokenizer_class!r}')
+
+        with open(fname_tokenizer, encoding='utf-8') as f:
+            tokenizer_json = json.load(f)
+        vocab = tokenizer_json['model'].get('vocab')
+        if not isinstance(vocab, dict):
+            # e.g. Unigram, where the vocab is a list of tokens and scores
+            raise FileNotFoundError('Cannot find the vocab of a BPE or WordPiece tokenizer')
+
+        self.vocab = dict(vocab)
+        self.added_tokens = {}
+        self.special_ids = set()
+        added_by_id: dict[int, str] = {}
+        for item in tokenizer_json.get('added_tokens') or ():
+            self._add_token(item['content'], item['id'], item.get('special', False))
+            added_by_id[item['id']] = item['content']
+
+        # the added tokens of tokenizer_config.json override the ones of tokenizer.json
+        for id_str, item in (tokenizer_config.get('added_tokens_decoder') or {}).items():
+            if added_by_id.get(int(id_str)) != item['content']:
+                raise FileNotFoundError(f'Added token {item["content"]!r} is not in tokenizer.json')
+            if item.get('special', False):
+                self.special_ids.add(int(id_str))
+            else:
+                self.special_ids.discard(int(id_str))
+
+        named_tokens = {k: v for k, v in tokenizer_config.items() if k in self.special_token_attributes}
+        special_tokens: list[Any] = list(tokenizer_config.get('additional_special_tokens') or ())
+        # (only read by transformers for the configs saved before added_tokens_decoder)
+        if 'added_tokens_decoder' not in tokenizer_config:
+            if (base_path / 'added_tokens.json').is_file():
+                raise FileNotFoundError('Cannot read the added tokens of added_tokens.json')
+            if (special_tokens_map_file := base_path / 'special_tokens_map.json').is_file():
+                with open(special_tokens_map_file, encoding='utf-8') as f:
+                    special_tokens_map = json.load(f)
+                special_tokens += special_tokens_map.pop('additional_special_tokens', None) or ()
+                named_tokens.update(special_tokens_map)
+        for typ in self.special_token_attributes:
+            special_tokens.append(named_tokens[typ] if typ in named_tokens else default_special_tokens.get(typ))
+        for token in special_tokens:
+            content = token.get('content') if isinstance(token, dict) else token
+            if content is None:
+                continue
+            if (tid := self.vocab.get(content)) is None:
+                # (AutoTokenizer appends it to the vocab)
+                raise FileNotFoundError(f'Special token {content!r} is not in tokenizer.json')
+            self._add_token(content, tid, True)
+
+        self.fname_tokenizer = fname_tokenizer
+
+    def _add_token(self, content: str, tid: int, special: bool) -> None:
+        self.vocab[content] = tid
+        self.added_tokens[content] = tid
+        if special:
+            self.special_ids.add(tid)
+
+    def __repr__(self) -> str:
+        return f"<TokenizerJsonVocab with {len(self.vocab)} tokens and {len(self.added_tokens)} added tokens>"
+
+
+# Same directory as the cache of llama.cpp (see fs_get_cache_directory in common/common.cpp)
+def _get_cache_dir() -> Path:
+    if (cache_dir := os.environ.get('LLAMA_CACHE')) is not None:
+        return Path(cache_dir)
+    if sys.platform == 'darwin':
+        return Path.home() / 'Library' / 'Caches' / 'llama.cpp'
+    if sys.platform == 'win32':
+        return Path(os.environ.get('LOCALAPPDATA', Path.home())) / 'llama.cpp'
+    return Path(os.environ.get('XDG_CACHE_HOME', Path.home() / '.cache')) / 'llama.cpp'
+
+
+# The files which can change how a text is tokenized by AutoTokenizer
+_TOKENIZER_FILE_PATTERNS = (
+    'tokenizer*', 'tokenization*.py', 'special_tokens_map.json', 'added_tokens.json', 'vocab.*', 'merges.txt', '*.tiktoken',
+)
+
+
+def _tokenizer_hash(base_path: Path, text: str) -> str:
+    h = hashlib.sha256()
+    try:
+        h.update(importlib.metadata.version('transformers').encode())
+    except importlib.metadata.PackageNotFoundError:
+        pass
+    h.update(b'\0' + text.encode('utf-8'))
+    files = sorted({file for pattern in _TOKENIZER_FILE_PATTERNS for file in base_path.glob(pattern) if file.is_file()})
+    for file in files:
+        h.update(b'\0' + file.name.encode('utf-8') + b'\0')
+        with open(file, 'rb') as f:
+            while chunk := f.read(1024 * 1024):
+                h.update(chunk)
+    return h.hexdigest()
+
+
+# The hash of the tokens of text (chkhsh in convert_hf_to_gguf.py), computed with compute() the first time
+# and then cached by the content of the tokenizer files, which avoids loading the tokenizer of a model again.
+# Without use_cache, or when the cache directory isn't writable, it's computed each time.
+def cached_chkhsh(base_path: Path, text: str, compute: Callable[[], str], use_cache: bool = True) -> str:
+    if not use_cache:
+        return compute()
+    key = _tokenizer_hash(base_path, text)
+    try:
+        cache_file = _get_cache_dir() / 'chkhsh.json'
+    except RuntimeError as e:
+        # (no home directory)
+        logger.warning(f'Cannot cache chkhsh: {e}')
+        return compute()
+    try:
+        with open(cache_file, encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+    if isinstance(chkhsh := cache.get(key), str):
+        logger.debug(f'chkhsh cached in {cache_file}')
+        return chkhsh
+
+    chkhsh = compute()
+    cache[key] = chkhsh
+    tmp_name = None
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        # written to another file first, for the other conversions which could be reading it
+        with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=cache_file.parent, delete=False) as f:
+            tmp_name = f.name
+            json.dump(cache, f, indent=1)
+        os.replace(tmp_name, cache_file)
+    except OSError as e:
+        logger.warning(f'Cannot cache chkhsh in {cache_file}: {e}')
+        if tmp_name is not None:
+            with contextlib.suppress(OSError):
+                os.remove(tmp_name)
+    return chkhsh
+
+
 class SentencePieceVocab(Vocab):
     tokenizer_model = "llama"
     name = "spm"
@@ -485,3 +668,96 @@ class LlamaHfVocab(Vocab):
 
     def __repr__(self) -> str:
         return f"<LlamaHfVocab with {self.vocab_size_base} base tokens and {len(self.added_tokens_list)} added tokens>"
+
+
+# Same as bytes_to_unicode() of GPT-2 (in transformers.models.gpt2.tokenization_gpt2):
+# the printable character which represents each byte in the vocabularies of byte-level BPE tokenizers.
+def _bytes_to_unicode() -> dict[int, str]:
+    bs = list(range(ord("!"), ord("~") + 1)) + list(range(ord("¡"), ord("¬") + 1)) + list(range(ord("®"), ord("ÿ") + 1))
+    cs = bs[:]
+    n = 0
+    for b in range(2**8):
+        if b not in bs:
+            bs.append(b)
+            cs.append(2**8 + n)
+            n += 1
+    return dict(zip(bs, map(chr, cs)))
+
+
+_BYTES_TO_UNICODE = _bytes_to_unicode()
+
+
+# Representation of the bytes of a token (e.g. from the mergeable_ranks of a tiktoken tokenizer) in the vocab
+def token_bytes_to_string(b: bytes) -> str:
+    # (latin-1 maps each byte to the character with the same code)
+    return b.decode("latin-1").translate(_BYTES_TO_UNICODE)
+
+
+# The parts of token which are merged last when applying the merges of a tiktoken tokenizer
+# (given by their rank) until max_rank, the lowest rank first.
+# This uses a priority queue over a linked list of parts, where the stale pairs are skipped when popped.
+def bpe_merge(mergeable_ranks: Mapping[bytes, int], token: bytes, max_rank: int | None = None) -> list[bytes]:
+    n = len(token)
+    # end[i] is the end of the part starting at i (-1 when it's not the start of a part), prev[i] the start of the previous part
+    end = list(range(1, n + 1))
+    prev = list(range(-1, n - 1))
+    heap: list[tuple[int, int, int, int]] = []
+
+    def push(start: int, mid: int, stop: int) -> None:
+        rank = mergeable_ranks.get(token[start:stop])
+        if rank is not None:
+            # (for the same rank, the leftmost pair is merged first)
+            heapq.heappush(heap, (rank, start, mid, stop))
+
+    for i in range(n - 1):
+        push(i, i + 1, i + 2)
+
+    while heap:
+        rank, start, mid, stop = heapq.heappop(heap)
+        if end[start] != mid or end[mid] != stop:
+            # one of the parts was merged since
+            continue
+        if max_rank is not None and rank >= max_rank:
+            break
+        end[start] = stop
+        end[mid] = -1
+        if stop < n:
+            prev[stop] = start
+            push(start, stop, end[stop])
+        if start > 0:
+            push(prev[start], start, stop)
+
+    parts: list[bytes] = []
+    i = 0
+    while i < n:
+        parts.append(token[i:end[i]])
+        i = end[i]
+    return parts
+
+
+_worker_mergeable_ranks: Mapping[bytes, int] = {}
+
+
+def _init_merge_worker(mergeable_ranks: Mapping[bytes, int]) -> None:
+    global _worker_mergeable_ranks
+    _worker_mergeable_ranks = mergeable_ranks
+
+
+def _merge_chunk(tokens: list[tuple[bytes, int]]) -> list[list[bytes]]:
+    return [bpe_merge(_worker_mergeable_ranks, token, max_rank=rank) for token, rank in tokens]
+
+
+# The merges of a tiktoken tokenizer aren't stored, but can be found from the ranks of the tokens:
+# each multi-byte token is made of the parts which are merged last to make it.
+# Returns these parts for each multi-byte token, in the order of mergeable_ranks.
+# With n_workers > 1, the tokens are split in chunks which are processed in parallel by a pool of processes.
+def tiktoken_merges(mergeable_ranks: Mapping[bytes, int], n_workers: int = 1) -> list[list[bytes]]:
+    tokens = [(token, rank) for token, rank in mergeable_ranks.items() if len(token) > 1]
+    if n_workers <= 1 or len(tokens) < 1024:
+        return [bpe_merge(mergeable_ranks, token, max_rank=rank) for token, rank in tokens]
+
+    # a few chunks per worker, to balance the load
+    chunk_size = -(-len(tokens) // (4 * n_workers))
+    chunks = [tokens[i:i + chunk_size] for i in range(0, len(tokens), chunk_size)]
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_merge_worker, initargs=(dict(mergeable_ranks),)) as executor:
+        return [merged for chunk in executor.map(_merge_chunk, chunks) for merged in chunk]
@@ -4,3 +4,6 @@ from .gguf_convert_endian import main as gguf_convert_endian_entrypoint
 from .gguf_dump import main as gguf_dump_entrypoint
 from .gguf_set_metadata import main as gguf_set_metadata_entrypoint
 from .gguf_new_metadata import main as gguf_new_metadata_entrypoint
+from .gguf_diff import main as gguf_diff_entrypoint
+from .gguf_to_safetensors import main as gguf_to_safetensors_entrypoint
+from .gguf_relayout import main as gguf_relayout_entrypoint
@@ -39,15 +39,19 @@ def convert_byteorder(reader: gguf.GGUFReader, args: argparse.Namespace) -> None
         sys.exit(0)
     logger.info("* Checking tensors for conversion compatibility")
     for tensor in reader.tensors:
-        if tensor.tensor_type not in (
-            gguf.GGMLQuantizationType.F32,
-            gguf.GGMLQuantizationType.F16,
-            gguf.GGMLQuantizationType.Q8_0,
-        ):
+        try:
+            block_dtype = gguf.block_layout_dtype(tensor.tensor_type)
+        except NotImplementedError:
             raise ValueError(f"Cannot handle type {tensor.tensor_type.name} for tensor {repr(tensor.name)}")
+        if tensor.data.nbytes % block_dtype.itemsize != 0:
+            raise ValueError(f"Unexpected data size {tensor.data.nbytes} for tensor {repr(tensor.name)} of type {tensor.tensor_type.name}")
     logger.info(f"* Preparing to convert from {file_endian.upper()} to {order.upper()}")
     if args.dry_run:
         return
+    if args.output is not None:
+        convert_to_new_file(reader, args)
+        logger.info("* Completion")
+        return
     logger.warning("*** Warning *** Warning *** Warning **")
     logger.warning("* This conversion process may damage the file. Ensure you have a backup.")
     if order != host_endian:
@@ -58,11 +62,7 @@ def convert_byteorder(reader: gguf.GGUFReader, args: argparse.Namespace) -> None
     if response != "YES":
         logger.warning("You didn't enter YES. Okay then, see ya!")
         sys.exit(0)
-    logger.info(f"* Converting fields ({len(reader.fields)})")
-    for idx, field in enumerate(reader.fields.values()):
-        logger.info(f"- {idx:4}: Converting field {repr(field.name)}, part count: {len(field.parts)}")
-        for part in field.parts:
-            part.byteswap(inplace=True)
+    convert_metadata(reader)
     logger.info(f"* Converting tensors ({len(reader.tensors)})")
 
     for idx, tensor in enumerate(pbar := tqdm(reader.tensors, desc="Converting tensor")):
@@ -72,37 +72,57 @@ def convert_byteorder(reader: gguf.GGUFReader, args: argparse.Namespace) -> None
             f"elements={tensor.n_elements} "
         )
 
-        # Byte-swap each part of the tensor's field
+        # Byte-swap all the multi-byte fields of the blocks at once
+        gguf.byteswap(tensor.data, tensor.tensor_type, inplace=True)
+
+        pbar.set_description(log_message)
+
+    logger.info("* Completion")
+
+
+# Byte-swap the key/value fields and the tensor info
+def convert_metadata(reader: gguf.GGUFReader) -> None:
+    logger.info(f"* Converting fields ({len(reader.fields)})")
+    for idx, field in enumerate(reader.fields.values()):
+        logger.info(f"- {idx:4}: Converting field {repr(field.name)}, part count: {len(field.parts)}")
+        for part in field.parts:
+            part.byteswap(inplace=True)
+    logger.info(f"* Converting tensor info ({len(reader.tensors)})")
+    for tensor in reader.tensors:
         for part in tensor.field.parts:
             part.byteswap(inplace=True)
 
-        # Byte-swap tensor data if necessary
-        if tensor.tensor_type == gguf.GGMLQuantizationType.Q8_0:
-            # Handle Q8_0 tensor blocks (block_q8_0)
-            # Specific handling of block_q8_0 is required.
-            # Each block_q8_0 consists of an f16 delta (scaling factor) followed by 32 int8 quantizations.
 
-            block_size = 34 # 34 bytes = <f16 delta scaling factor> + 32 * <int8 quant>
+# Size of the chunks of tensor data which are converted at once when writing to a new file
+CONVERT_CHUNK_SIZE = 64 * 1024 * 1024
 
-            n_blocks = len(tensor.data) // block_size
-            for block_num in (inner_pbar := tqdm(range(n_blocks), desc="Byte-swapping Blocks", leave=False)):
-                block_offs = block_num * block_size
 
-                # Byte-Swap f16 sized delta field
-                delta = tensor.data[block_offs:block_offs + 2].view(dtype=np.uint16)
-                delta.byteswap(inplace=True)
+def convert_to_new_file(reader: gguf.GGUFReader, args: argparse.Namespace) -> None:
+    if os.path.exists(args.output) and os.path.samefile(args.model, args.output):
+        raise ValueError("The output file must be different from the input file, omit --output to convert in place")
 
-                # Byte-Swap Q8 weights
-                if block_num % 100000 == 0:
-                    inner_pbar.set_description(f"Byte-swapping Blocks [{(n_blocks - block_num) // n_blocks}]")
+    # The layout of the file doesn't change, so the metadata is converted in a copy
+    # of the start of the file, and the tensor data is converted at the same offsets.
+    logger.info(f"* Writing: {args.output}")
+    with open(args.model, "rb") as fin, open(args.output, "wb") as fout:
+        fout.write(fin.read(reader.data_offset))
+        fout.truncate(len(reader.data))
 
-        else:
-            # Handle other tensor types
-            tensor.data.byteswap(inplace=True)
+    convert_metadata(gguf.GGUFReader(args.output, "r+"))
 
-        pbar.set_description(log_message)
-
-    logger.info("* Completion")
+    logger.info(f"* Converting tensors ({len(reader.tensors)})")
+    total_bytes = sum(tensor.data.nbytes for tensor in reader.tensors)
+    with open(args.output, "r+b") as fout, tqdm(desc="Converting", total=total_bytes, unit="byte", unit_scale=True) as bar:
+        for tensor in reader.tensors:
+            # whole (groups of) blocks are converted together
+            block_size = gguf.block_layout_dtype(tensor.tensor_type).itemsize
+            chunk_size = max(CONVERT_CHUNK_SIZE // block_size, 1) * block_size
+            data = tensor.data.reshape(-1).view(np.uint8)
+            fout.seek(tensor.data_offset)
+            for start in range(0, data.size, chunk_size):
+                chunk = data[start:start + chunk_size]
+                fout.write(gguf.byteswap(chunk, tensor.tensor_type).data)
+                bar.update(chunk.size)
 
 
 def main() -> None:
@@ -119,6 +139,10 @@ def main() -> None:
         "--dry-run", action="store_true",
         help="Don't actually change anything",
     )
+    parser.add_argument(
+        "--output", type=str,
+        help="Write the converted model to a new file instead of modifying the input file in place",
+    )
     parser.add_argument("--verbose", action="store_true", help="increase output verbosity")
 
     args = parser.parse_args(None if len(sys.argv) > 1 else ["--help"])
@@ -126,7 +150,7 @@ def main() -> None:
     logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
 
     logger.info(f'* Loading: {args.model}')
-    reader = gguf.GGUFReader(args.model, 'r' if args.dry_run else 'r+')
+    reader = gguf.GGUFReader(args.model, 'r' if args.dry_run or args.output is not None else 'r+')
     convert_byteorder(reader, args)
 
 
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import hashlib
+import logging
+import math
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterator, NamedTuple
+
+import numpy as np
+
+# Necessary to load the local gguf package
+if "NO_LOCAL_GGUF" not in os.environ and (Path(__file__).parent.parent.parent / 'gguf-py').exists():
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import gguf  # noqa: E402
+from gguf import GGUFReader, GGMLQuantizationType, ReaderTensor  # noqa: E402
+
+
+logger = logging.getLogger("gguf-diff")
+
+# Size of the chunks of tensor data which are hashed at once
+HASH_CHUNK_SIZE = 64 * 1024 * 1024
+
+# Number of values dequantized at once (by groups of whole rows) when comparing tensors
+DIFF_CHUNK_SIZE = 1024 * 1024
+
+
+class DiffStats(NamedTuple):
+    n: int = 0
+    max_abs: float = 0.0
+    sum_sq_diff: float = 0.0
+    dot: float = 0.0
+    sum_sq_a: float = 0.0
+    sum_sq_b: float = 0.0
+
+    def merge(self, other: DiffStats) -> DiffStats:
+        return DiffStats(
+            self.n + other.n,
+            max(self.max_abs, other.max_abs),
+            self.sum_sq_diff + other.sum_sq_diff,
+            self.dot + other.dot,
+            self.sum_sq_a + other.sum_sq_a,
+            self.sum_sq_b + other.sum_sq_b,
+        )
+
+    @property
+    def rmse(self) -> float:
+        return math.sqrt(self.sum_sq_diff / self.n) if self.n > 0 else 0.0
+
+    @property
+    def cos_sim(self) -> float:
+        norm = math.sqrt(self.sum_sq_a * self.sum_sq_b)
+        # (two all-zero tensors are the same)
+        return self.dot / norm if norm > 0 else float(self.sum_sq_a == self.sum_sq_b)
+
+
+def tensor_digest(tensor: ReaderTensor) -> bytes:
+    sha256 = hashlib.sha256()
+    data = tensor.data.reshape(-1).view(np.uint8)
+    for start in range(0, data.size, HASH_CHUNK_SIZE):
+        sha256.update(data[start:start + HASH_CHUNK_SIZE].data)
+    return sha256.digest()
+
+
+class TensorRows(NamedTuple):
+    rows: np.ndarray
+    qtype: GGMLQuantizationType
+    # The quantized types are read as bytes in the byte order of the file
+    swapped: bool
+
+    @classmethod
+    def of(cls, reader: GGUFReader, tensor: ReaderTensor) -> TensorRows:
+        rows = tensor.data.reshape((-1, tensor.data.shape[-1]))
+        return cls(rows, tensor.tensor_type, reader.byte_order == 'S' and rows.dtype == np.uint8)
+
+    def dequantize(self, start: int, stop: int) -> np.ndarray:
+        rows = self.rows[start:stop]
+        if rows.dtype != np.uint8:
+            # float and integer types
+            return rows.astype(np.float64).reshape(-1)
+        if self.swapped:
+            rows = gguf.quants.byteswap(rows, self.qtype)
+        return gguf.quants.dequantize(rows, self.qtype).astype(np.float64).reshape(-1)
+
+
+def diff_rows(rows_a: TensorRows, rows_b: TensorRows, start: int, stop: int) -> DiffStats:
+    a = rows_a.dequantize(start, stop)
+    b = rows_b.dequantize(start, stop)
+    d = a - b
+    return DiffStats(
+        n=a.size,
+        max_abs=float(np.max(np.abs(d))) if d.size > 0 else 0.0,
+        sum_sq_diff=float(np.dot(d, d)),
+        dot=float(np.dot(a, b)),
+        sum_sq_a=float(np.dot(a, a)),
+        sum_sq_b=float(np.dot(b, b)),
+    )
+
+
+# Compare two tensors of the same shape, by chunks of rows, without dequantizing them whole.
+def diff_tensors(
+    executor: ThreadPoolExecutor, reader_a: GGUFReader, tensor_a: ReaderTensor, reader_b: GGUFReader, tensor_b: ReaderTensor,
+) -> Iterator[DiffStats]:
+    rows_a = TensorRows.of(reader_a, tensor_a)
+    rows_b = TensorRows.of(reader_b, tensor_b)
+    n_rows = rows_a.rows.shape[0]
+    chunk = max(1, DIFF_CHUNK_SIZE // max(1, int(tensor_a.shape[0])))
+    return executor.map(lambda i: diff_rows(rows_a, rows_b, i, min(i + chunk, n_rows)), range(0, n_rows, chunk))
+
+
+def gguf_diff(reader_a: GGUFReader, reader_b: GGUFReader, threads: int | None = None, show_all: bool = False) -> bool:
+    tensors_a = {tensor.name: tensor for tensor in reader_a.tensors}
+    tensors_b = {tensor.name: tensor for tensor in reader_b.tensors}
+    names = [name for name in tensors_a if name in tensors_b]
+    n_changed = 0
+
+    print(f"{'type A':>8} {'type B':>8} {'max abs':>12} {'rmse':>12} {'cos sim':>10}  name")  # noqa: NP100
+    for name in tensors_a:
+        if name not in tensors_b:
+            print(f"only in A: {name}")  # noqa: NP100
+            n_changed += 1
+    for name in tensors_b:
+        if name not in tensors_a:
+            print(f"only in B: {name}")  # noqa: NP100
+            n_changed += 1
+
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        # Only the tensors with different bytes are dequantized
+        # (hashlib releases the GIL for big buffers, so the tensors are hashed concurrently)
+        digests_a = executor.map(lambda name: tensor_digest(tensors_a[name]), names)
+        digests_b = executor.map(lambda name: tensor_digest(tensors_b[name]), names)
+        same_bytes = {
+            name: tensors_a[name].tensor_type == tensors_b[name].tensor_type and reader_a.byte_order == reader_b.byte_order and digest_a == digest_b
+            for name, digest_a, digest_b in zip(names, digests_a, digests_b)
+        }
+
+        for name in names:
+            tensor_a, tensor_b = tensors_a[name], tensors_b[name]
+            type_a, type_b = tensor_a.tensor_type.name, tensor_b.tensor_type.name
+            if tensor_a.shape.tolist() != tensor_b.shape.tolist():
+                print(f"{type_a:>8} {type_b:>8} shape {tensor_a.shape.tolist()} != {tensor_b.shape.tolist()}  {name}")  # noqa: NP100
+                n_changed += 1
+                continue
+            if same_bytes[name]:
+                if show_all:
+                    print(f"{type_a:>8} {type_b:>8} {'identical':>12} {'':>12} {'':>10}  {name}")  # noqa: NP100
+                continue
+            stats = DiffStats()
+            try:
+                for chunk_stats in diff_tensors(executor, reader_a, tensor_a, reader_b, tensor_b):
+                    stats = stats.merge(chunk_stats)
+            except NotImplementedError as e:
+                print(f"{type_a:>8} {type_b:>8} bytes differ ({e})  {name}")  # noqa: NP100
+                n_changed += 1
+                continue
+            if stats.sum_sq_diff != 0:
+                n_changed += 1
+            elif not show_all:
+                # Same values, in another type or byte order
+                continue
+            print(f"{type_a:>8} {type_b:>8} {stats.max_abs:>12.6g} {stats.rmse:>12.6g} {stats.cos_sim:>10.6f}  {name}")  # noqa: NP100
+
+    n_tensors = len(set(tensors_a) | set(tensors_b))
+    print(f"{n_changed} of {n_tensors} tensors differ")  # noqa: NP100
+    return n_changed == 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare the tensors of two GGUF files, and report the error of the ones which differ")
+    parser.add_argument("model_a",   type=str,            help="GGUF format model filename")
+    parser.add_argument("model_b",   type=str,            help="GGUF format model filename")
+    parser.add_argument("--all",     action="store_true", help="also list the identical tensors")
+    parser.add_argument("--threads", type=int,            help="number of threads used for hashing and comparing (default: depends on the number of CPUs)")
+    parser.add_argument("--verbose", action="store_true", help="increase output verbosity")
+    args = parser.parse_args(None if len(sys.argv) > 1 else ["--help"])
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+
+    logger.info(f"* Loading: {args.model_a}")
+    reader_a = GGUFReader(args.model_a, 'r', lazy=True)
+    logger.info(f"* Loading: {args.model_b}")
+    reader_b = GGUFReader(args.model_b, 'r', lazy=True)
+
+    # Like diff, the exit status is 1 when the tensors differ
+    sys.exit(0 if gguf_diff(reader_a, reader_b, args.threads, args.all) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -15,12 +15,12 @@ import numpy as np
 if "NO_LOCAL_GGUF" not in os.environ and (Path(__file__).parent.parent.parent / 'gguf-py').exists():
     sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from gguf import GGUFReader, GGUFValueType, ReaderTensor  # noqa: E402
+from gguf import GGUFReader, GGUFSplitReader, GGUFValueType, ReaderTensor  # noqa: E402
 
 logger = logging.getLogger("gguf-dump")
 
 
-def get_file_host_endian(reader: GGUFReader) -> tuple[str, str]:
+def get_file_host_endian(reader: GGUFReader | GGUFSplitReader) -> tuple[str, str]:
     host_endian = 'LITTLE' if np.uint32(1) == np.uint32(1).newbyteorder("<") else 'BIG'
     if reader.byte_order == 'S':
         file_endian = 'BIG' if host_endian == 'LITTLE' else 'LITTLE'
@@ -31,7 +31,7 @@ def get_file_host_endian(reader: GGUFReader) -> tuple[str, str]:
 
 # For more information about what field.parts and field.data represent,
 # please see the comments in the modify_gguf.py example.
-def dump_metadata(reader: GGUFReader, args: argparse.Namespace) -> None:
+def dump_metadata(reader: GGUFReader | GGUFSplitReader, args: argparse.Namespace) -> None:
     host_endian, file_endian = get_file_host_endian(reader)
     print(f'* File is {file_endian} endian, script is running on a {host_endian} endian host.')  # noqa: NP100
     print(f'* Dumping {len(reader.fields)} key/value pair(s)')  # noqa: NP100
@@ -48,7 +48,7 @@ def dump_metadata(reader: GGUFReader, args: argparse.Namespace) -> None:
         if len(field.types) == 1:
             curr_type = field.types[0]
             if curr_type == GGUFValueType.STRING:
-                log_message += ' = {0}'.format(repr(str(bytes(field.parts[-1]), encoding='utf-8')[:60]))
+                log_message += ' = {0}'.format(repr(field.contents()[:60]))
             elif field.types[0] in reader.gguf_scalar_to_np:
                 log_message += ' = {0}'.format(field.parts[-1][0])
         print(log_message)  # noqa: NP100
@@ -60,7 +60,7 @@ def dump_metadata(reader: GGUFReader, args: argparse.Namespace) -> None:
         print(f'  {n:5}: {tensor.n_elements:10} | {prettydims} | {tensor.tensor_type.name:7} | {tensor.name}')  # noqa: NP100
 
 
-def dump_metadata_json(reader: GGUFReader, args: argparse.Namespace) -> None:
+def dump_metadata_json(reader: GGUFReader | GGUFSplitReader, args: argparse.Namespace) -> None:
     import json
     host_endian, file_endian = get_file_host_endian(reader)
     metadata: dict[str, Any] = {}
@@ -82,15 +82,7 @@ def dump_metadata_json(reader: GGUFReader, args: argparse.Namespace) -> None:
             curr["array_types"] = [t.name for t in field.types][1:]
             if not args.json_array:
                 continue
-            itype = field.types[-1]
-            if itype == GGUFValueType.STRING:
-                curr["value"] = [str(bytes(field.parts[idx]), encoding="utf-8") for idx in field.data]
-            else:
-                curr["value"] = [pv for idx in field.data for pv in field.parts[idx].tolist()]
-        elif field.types[0] == GGUFValueType.STRING:
-            curr["value"] = str(bytes(field.parts[-1]), encoding="utf-8")
-        else:
-            curr["value"] = field.parts[-1].tolist()[0]
+        curr["value"] = field.contents()
     if not args.no_tensors:
         for idx, tensor in enumerate(reader.tensors):
             tensors[tensor.name] = {
@@ -225,7 +217,7 @@ def translate_tensor_name(name):
     return ' '.join(expanded_words)
 
 
-def dump_markdown_metadata(reader: GGUFReader, args: argparse.Namespace) -> None:
+def dump_markdown_metadata(reader: GGUFReader | GGUFSplitReader, args: argparse.Namespace) -> None:
     host_endian, file_endian = get_file_host_endian(reader)
     markdown_content = ""
     markdown_content += f'# {args.model} - GGUF Internal File Dump\n\n'
@@ -263,7 +255,7 @@ def dump_markdown_metadata(reader: GGUFReader, args: argparse.Namespace) -> None
             curr_type = field.types[0]
             if curr_type == GGUFValueType.STRING:
                 truncate_length = 60
-                value_string = str(bytes(field.parts[-1]), encoding='utf-8')
+                value_string = field.contents()
                 if len(value_string) > truncate_length:
                     head = escape_markdown_inline_code(value_string[:truncate_length // 2])
                     tail = escape_markdown_inline_code(value_string[-truncate_length // 2:])
@@ -279,9 +271,8 @@ def dump_markdown_metadata(reader: GGUFReader, args: argparse.Namespace) -> None
 
                 if curr_type == GGUFValueType.STRING:
                     render_element = min(5, total_elements)
-                    for element_pos in range(render_element):
+                    for value_string in field.contents(slice(0, render_element)):
                         truncate_length = 30
-                        value_string = str(bytes(field.parts[-1 - (total_elements - element_pos - 1) * 2]), encoding='utf-8')
                         if len(value_string) > truncate_length:
                             head = escape_markdown_inline_code(value_string[:truncate_length // 2])
                             tail = escape_markdown_inline_code(value_string[-truncate_length // 2:])
@@ -292,8 +283,10 @@ def dump_markdown_metadata(reader: GGUFReader, args: argparse.Namespace) -> None
 
                 elif curr_type in reader.gguf_scalar_to_np:
                     render_element = min(7, total_elements)
-                    for element_pos in range(render_element):
-                        array_elements.append(str(field.parts[-1 - (total_elements - element_pos - 1)][0]))
+                    # format the values like the numpy scalars they are stored as
+                    nptype = reader.gguf_scalar_to_np[curr_type]
+                    for element in field.contents(slice(0, render_element)):
+                        array_elements.append(str(nptype(element)))
 
                 value = f'[ {", ".join(array_elements).strip()}{", ..." if total_elements > len(array_elements) else ""} ]'
 
@@ -427,6 +420,7 @@ def main() -> None:
     parser.add_argument("--data-offset",    action="store_true", help="Start of data offset")
     parser.add_argument("--data-alignment", action="store_true", help="Data alignment applied globally to data field")
     parser.add_argument("--markdown",   action="store_true", help="Produce markdown output")
+    parser.add_argument("--all-shards", action="store_true", help="Read all the shards of a split model (given its first shard) as a single model")
     parser.add_argument("--verbose",    action="store_true", help="increase output verbosity")
 
     args = parser.parse_args(None if len(sys.argv) > 1 else ["--help"])
@@ -436,7 +430,7 @@ def main() -> None:
     if not args.json and not args.markdown and not args.data_offset and not args.data_alignment:
         logger.info(f'* Loading: {args.model}')
 
-    reader = GGUFReader(args.model, 'r')
+    reader = GGUFSplitReader(args.model, 'r', lazy=True) if args.all_shards else GGUFReader(args.model, 'r', lazy=True)
 
     if args.json:
         dump_metadata_json(reader, args)
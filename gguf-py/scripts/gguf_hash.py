@@ -6,17 +6,21 @@ import hashlib
 
 import logging
 import argparse
+import json
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
+from typing import Any, Iterator
 
+import numpy as np
 from tqdm import tqdm
 
 # Necessary to load the local gguf package
 if "NO_LOCAL_GGUF" not in os.environ and (Path(__file__).parent.parent.parent / 'gguf-py').exists():
     sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from gguf import GGUFReader  # noqa: E402
+from gguf import GGUFReader, GGUFSplitReader, ReaderTensor  # noqa: E402
 
 
 logger = logging.getLogger("gguf-hash")
@@ -25,65 +29,136 @@ logger = logging.getLogger("gguf-hash")
 UUID_NAMESPACE_LLAMA_CPP = uuid.UUID('ef001206-dadc-5f6d-a15f-3359e577d4e5')
 
 
-# For more information about what field.parts and field.data represent,
-# please see the comments in the modify_gguf.py example.
-def gguf_hash(reader: GGUFReader, filename: str, disable_progress_bar: bool, no_layer: bool) -> None:
-    sha1 = hashlib.sha1()
-    sha256 = hashlib.sha256()
-    uuidv5_sha1 = hashlib.sha1()
-    uuidv5_sha1.update(UUID_NAMESPACE_LLAMA_CPP.bytes)
-
-    # Total Weight Calculation For Progress Bar
-    total_weights = 0
-    for n, tensor in enumerate(reader.tensors, 1):
-
-        # We don't need these
-        if tensor.name.endswith((".attention.masked_bias", ".attention.bias", ".rotary_emb.inv_freq")):
-            continue
-
-        # Calculate Tensor Volume
-        sum_weights_in_tensor = 1
-        for dim in tensor.shape:
-            sum_weights_in_tensor *= dim
-        total_weights += sum_weights_in_tensor
+# Size of the chunks of tensor data which are fed to the digests
+HASH_CHUNK_SIZE = 64 * 1024 * 1024
 
-    # Hash Progress Bar
-    bar = tqdm(desc="Hashing", total=total_weights, unit="weights", unit_scale=True, disable=disable_progress_bar)
 
-    # Hashing Process
-    for tensor in reader.tensors:
+def load_hash_cache(filename: str, cache_path: Path) -> dict[str, Any]:
+    # The cache is only valid for the exact same file, as far as the file system can tell
+    stat = os.stat(filename)
+    cache: dict[str, Any] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "tensors": {}}
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            old_cache = json.load(f)
+    except FileNotFoundError:
+        return cache
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable hash cache {cache_path}: {e}")
+        return cache
+    if isinstance(old_cache, dict) and old_cache.get("size") == cache["size"] and old_cache.get("mtime_ns") == cache["mtime_ns"]:
+        logger.debug(f"Using hash cache {cache_path}")
+        return old_cache
+    logger.debug(f"Hash cache {cache_path} is stale, ignoring it")
+    return cache
+
+
+def save_hash_cache(cache: dict[str, Any], cache_path: Path) -> None:
+    tmp_path = cache_path.with_name(cache_path.name + ".tmp")
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(cache, f)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logger.warning(f"Could not write hash cache {cache_path}: {e}")
 
-        # We don't need these
-        if tensor.name.endswith((".attention.masked_bias", ".attention.bias", ".rotary_emb.inv_freq")):
-            continue
 
-        # Progressbar
-        sum_weights_in_tensor = 1
-        for dim in tensor.shape:
-            sum_weights_in_tensor *= dim
-        bar.update(sum_weights_in_tensor)
+def tensor_chunks(tensor: ReaderTensor) -> Iterator[memoryview]:
+    data = tensor.data.reshape(-1).view(np.uint8)
+    for start in range(0, data.size, HASH_CHUNK_SIZE):
+        yield data[start:start + HASH_CHUNK_SIZE].data
 
-        if not no_layer:
 
-            sha1_layer = hashlib.sha1()
-            sha1_layer.update(tensor.data.data)
-            print("sha1      {0}  {1}:{2}".format(sha1_layer.hexdigest(), filename, tensor.name)) # noqa: NP100
+# For more information about what field.parts and field.data represent,
+# please see the comments in the modify_gguf.py example.
+def gguf_hash(
+    reader: GGUFReader | GGUFSplitReader, filename: str, disable_progress_bar: bool, no_layer: bool,
+    threads: int | None = None, cache_path: Path | None = None,
+) -> None:
+    # The per-tensor hashes are cached by tensor offset
+    cache = load_hash_cache(filename, cache_path) if cache_path is not None else {"tensors": {}}
+    layer_cache: dict[str, dict[str, str]] = cache["tensors"]
+
+    # We don't need these
+    tensors = [tensor for tensor in reader.tensors if not tensor.name.endswith((".attention.masked_bias", ".attention.bias", ".rotary_emb.inv_freq"))]
+
+    def layer_key(tensor: ReaderTensor) -> str:
+        # (the offsets of the tensors of a split model are only unique within their shard)
+        return tensor.name if isinstance(reader, GGUFSplitReader) else str(tensor.data_offset)
+
+    def cached_layer(tensor: ReaderTensor) -> dict[str, str] | None:
+        entry = layer_cache.get(layer_key(tensor))
+        return entry if entry is not None and entry.get("name") == tensor.name else None
+
+    def cache_layer(tensor: ReaderTensor, sha1_layer: Any, sha256_layer: Any) -> None:
+        layer_cache[layer_key(tensor)] = {"name": tensor.name, "sha1": sha1_layer.hexdigest(), "sha256": sha256_layer.hexdigest()}
+
+    def hash_layer(tensor: ReaderTensor) -> None:
+        sha1_layer = hashlib.sha1()
+        sha256_layer = hashlib.sha256()
+        for chunk in tensor_chunks(tensor):
+            sha1_layer.update(chunk)
+            sha256_layer.update(chunk)
+        cache_layer(tensor, sha1_layer, sha256_layer)
 
-            sha256_layer = hashlib.sha256()
-            sha256_layer.update(tensor.data.data)
-            print("sha256    {0}  {1}:{2}".format(sha256_layer.hexdigest(), filename, tensor.name)) # noqa: NP100
+    # Hash Progress Bar
+    total_weights = sum(tensor.n_elements for tensor in tensors)
+    bar = tqdm(desc="Hashing", total=total_weights, unit="weights", unit_scale=True, disable=disable_progress_bar)
 
-        sha1.update(tensor.data.data)
-        sha256.update(tensor.data.data)
-        uuidv5_sha1.update(tensor.data.data)
+    # Hashing Process
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        # The per-tensor hashes are independent, each tensor is hashed by its own task
+        # (hashlib releases the GIL for big buffers, so they run concurrently)
+        futures = {
+            executor.submit(hash_layer, tensor): tensor
+            for tensor in tensors if not no_layer and cached_layer(tensor) is None
+        }
+
+        file_hashes: dict[str, str] | None = cache.get("file")
+        if file_hashes is None:
+            # The whole file hashes need all the tensors in order,
+            # they are fed by this thread alone while the tensor hashes are computed
+            sha1 = hashlib.sha1()
+            sha256 = hashlib.sha256()
+            uuidv5_sha1 = hashlib.sha1()
+            uuidv5_sha1.update(UUID_NAMESPACE_LLAMA_CPP.bytes)
+            for tensor in tensors:
+                for chunk in tensor_chunks(tensor):
+                    sha1.update(chunk)
+                    sha256.update(chunk)
+                    uuidv5_sha1.update(chunk)
+                bar.update(tensor.n_elements)
+            file_hashes = {
+                "sha1": sha1.hexdigest(),
+                "sha256": sha256.hexdigest(),
+                "uuid": str(uuid.UUID(bytes=uuidv5_sha1.digest()[:16], version=5)),
+            }
+            cache["file"] = file_hashes
+            for future in as_completed(futures):
+                future.result()
+        else:
+            # Only the hashes of some tensors can be missing
+            bar.update(total_weights - sum(tensor.n_elements for tensor in futures.values()))
+            for future in as_completed(futures):
+                future.result()
+                bar.update(futures[future].n_elements)
 
     # Flush Hash Progress Bar
     bar.close()
 
+    if cache_path is not None:
+        save_hash_cache(cache, cache_path)
+
     # Display Hash Output
-    print("sha1      {0}  {1}".format(sha1.hexdigest(), filename)) # noqa: NP100
-    print("sha256    {0}  {1}".format(sha256.hexdigest(), filename)) # noqa: NP100
-    print("uuid      {0}  {1}".format(uuid.UUID(bytes=uuidv5_sha1.digest()[:16], version=5), filename)) # noqa: NP100
+    if not no_layer:
+        for tensor in tensors:
+            layer_hashes = cached_layer(tensor)
+            assert layer_hashes is not None
+            print("sha1      {0}  {1}:{2}".format(layer_hashes["sha1"], filename, tensor.name)) # noqa: NP100
+            print("sha256    {0}  {1}:{2}".format(layer_hashes["sha256"], filename, tensor.name)) # noqa: NP100
+
+    print("sha1      {0}  {1}".format(file_hashes["sha1"], filename)) # noqa: NP100
+    print("sha256    {0}  {1}".format(file_hashes["sha256"], filename)) # noqa: NP100
+    print("uuid      {0}  {1}".format(file_hashes["uuid"], filename)) # noqa: NP100
 
 
 def main() -> None:
@@ -92,10 +167,20 @@ def main() -> None:
     parser.add_argument("--no-layer",    action="store_true", help="exclude per layer hash")
     parser.add_argument("--verbose",     action="store_true", help="increase output verbosity")
     parser.add_argument("--progressbar", action="store_true", help="enable progressbar")
+    parser.add_argument("--threads",     type=int,            help="number of threads used for hashing (default: depends on the number of CPUs)")
+    parser.add_argument("--cache",       action="store_true", help="reuse the hashes of an unchanged file (same size and modification time) from a cache file next to it, and update that cache")
+    parser.add_argument("--cache-file",  type=Path,           help="path of the hash cache file (default: <model>.hashcache.json), implies --cache")
+    parser.add_argument("--all-shards",  action="store_true", help="hash all the shards of a split model (given its first shard) as a single model")
     args = parser.parse_args(None if len(sys.argv) > 1 else ["--help"])
     logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
-    reader = GGUFReader(args.model, 'r')
-    gguf_hash(reader, args.model, not args.progressbar, args.no_layer)
+    cache_path = args.cache_file
+    if cache_path is None and args.cache:
+        cache_path = Path(args.model + ".hashcache.json")
+    if args.all_shards and cache_path is not None:
+        # (the cache is only invalidated by changes to the first shard)
+        parser.error("--cache can't be used with --all-shards")
+    reader = GGUFSplitReader(args.model, 'r', lazy=True) if args.all_shards else GGUFReader(args.model, 'r', lazy=True)
+    gguf_hash(reader, args.model, not args.progressbar, args.no_layer, args.threads, cache_path)
 
 
 if __name__ == '__main__':
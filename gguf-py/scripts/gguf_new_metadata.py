@@ -43,21 +43,9 @@ def get_byteorder(reader: gguf.GGUFReader) -> gguf.GGUFEndian:
         return host_endian
 
 
-def decode_field(field: gguf.ReaderField | None) -> Any:
+def decode_field(field: gguf.ReaderField | gguf.LazyReaderField | None) -> Any:
     if field and field.types:
-        main_type = field.types[0]
-
-        if main_type == gguf.GGUFValueType.ARRAY:
-            sub_type = field.types[-1]
-
-            if sub_type == gguf.GGUFValueType.STRING:
-                return [str(bytes(field.parts[idx]), encoding='utf-8') for idx in field.data]
-            else:
-                return [pv for idx in field.data for pv in field.parts[idx].tolist()]
-        if main_type == gguf.GGUFValueType.STRING:
-            return str(bytes(field.parts[-1]), encoding='utf-8')
-        else:
-            return field.parts[-1][0]
+        return field.contents()
 
     return None
 
@@ -114,23 +102,45 @@ def copy_with_new_metadata(reader: gguf.GGUFReader, writer: gguf.GGUFWriter, new
         logger.debug(f'Adding {key}: "{val.value}" {val.description}')
         writer.add_key_value(key, val.value, val.type)
 
-    total_bytes = 0
-
     for tensor in reader.tensors:
-        total_bytes += tensor.n_bytes
         writer.add_tensor_info(tensor.name, tensor.data.shape, tensor.data.dtype, tensor.data.nbytes, tensor.tensor_type)
 
-    bar = tqdm(desc="Writing", total=total_bytes, unit="byte", unit_scale=True)
-
     writer.write_header_to_file()
     writer.write_kv_data_to_file()
     writer.write_ti_data_to_file()
 
-    for tensor in reader.tensors:
-        writer.write_tensor_data(tensor.data)
-        bar.update(tensor.n_bytes)
 
-    writer.close()
+def copy_tensor_data(reader: gguf.GGUFReader, writer: gguf.GGUFWriter, input_path: Path) -> None:
+    total_bytes = sum(tensor.n_bytes for tensor in reader.tensors)
+
+    bar = tqdm(desc="Writing", total=total_bytes, unit="byte", unit_scale=True)
+
+    # The tensor data doesn't change, it's copied as is without going through Python
+    # (with copy_file_range, or even reflinks when the file system supports them)
+    with open(input_path, 'rb') as fin:
+        for tensor in reader.tensors:
+            writer.copy_tensor_data(tensor.name, fin.fileno(), tensor.data_offset)
+            bar.update(tensor.n_bytes)
+
+    bar.close()
+
+
+def fits_in_place(reader: gguf.GGUFReader, writer: gguf.GGUFWriter) -> bool:
+    # The new metadata can replace the old one when the tensor data doesn't move,
+    # which is the case when it ends in the padding before the tensor data
+    assert writer.fout is not None and len(writer.fout) == 1
+    if gguf.GGUFWriter.ggml_pad(writer.fout[0].tell(), writer.data_alignment) != reader.data_offset:
+        return False
+    return all(writer.tensors[0][tensor.name].offset == tensor.data_offset for tensor in reader.tensors)
+
+
+def write_metadata_in_place(metadata_path: Path, input_path: Path, data_offset: int) -> None:
+    with open(metadata_path, 'rb') as f:
+        metadata = f.read()
+    assert len(metadata) <= data_offset
+    with open(input_path, 'r+b') as f:
+        f.write(metadata)
+        f.write(bytes(data_offset - len(metadata)))
 
 
 def main() -> None:
@@ -139,7 +149,7 @@ def main() -> None:
 
     parser = argparse.ArgumentParser(description="Make a copy of a GGUF file with new metadata")
     parser.add_argument("input",                                       type=Path, help="GGUF format model input filename")
-    parser.add_argument("output",                                      type=Path, help="GGUF format model output filename")
+    parser.add_argument("output",                                      type=Path, help="GGUF format model output filename (not used with --in-place)", nargs="?")
     parser.add_argument("--general-name",                              type=str,  help="The models general.name", metavar='"name"')
     parser.add_argument("--general-description",                       type=str,  help="The models general.description", metavar='"Description ..."')
     parser.add_argument("--chat-template",                             type=str,  help="Chat template string (or JSON string containing templates)", metavar='"{% ... %} ..."')
@@ -148,12 +158,16 @@ def main() -> None:
     parser.add_argument("--remove-metadata",      action="append",     type=str,  help="Remove metadata (by key name) from output model", metavar='general.url')
     parser.add_argument("--special-token",        action="append",     type=str,  help="Special token by value", nargs=2, metavar=(' | '.join(token_names.keys()), '"<token>"'))
     parser.add_argument("--special-token-by-id",  action="append",     type=str,  help="Special token by id", nargs=2, metavar=(' | '.join(token_names.keys()), '0'))
+    parser.add_argument("--in-place",             action="store_true",            help="Modify the input file: only the metadata is rewritten when it fits before the tensor data, otherwise the file is rewritten")
     parser.add_argument("--force",                action="store_true",            help="Bypass warnings without confirmation")
     parser.add_argument("--verbose",              action="store_true",            help="Increase output verbosity")
     args = parser.parse_args(None if len(sys.argv) > 2 else ["--help"])
 
     logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
 
+    if (args.output is None) != args.in_place:
+        parser.error("either an output filename or --in-place is required, but not both")
+
     new_metadata = {}
     remove_metadata = args.remove_metadata or []
 
@@ -189,7 +203,7 @@ def main() -> None:
                 sys.exit(0)
 
     logger.info(f'* Loading: {args.input}')
-    reader = gguf.GGUFReader(args.input, 'r')
+    reader = gguf.GGUFReader(args.input, 'r', lazy=True)
 
     arch = get_field_data(reader, gguf.Keys.General.ARCHITECTURE)
     endianess = get_byteorder(reader)
@@ -220,17 +234,25 @@ def main() -> None:
             else:
                 raise LookupError(f'Token ID {id_int} is not within token list!')
 
-    if os.path.isfile(args.output) and not args.force:
+    if args.in_place:
+        output = args.input.with_name(args.input.name + '.tmp')
+    else:
+        output = args.output
+
+    if (args.in_place or os.path.isfile(args.output)) and not args.force:
         logger.warning('*** Warning *** Warning *** Warning **')
-        logger.warning(f'* The "{args.output}" GGUF file already exists, it will be overwritten!')
+        if args.in_place:
+            logger.warning(f'* The "{args.input}" GGUF file will be modified in place!')
+        else:
+            logger.warning(f'* The "{args.output}" GGUF file already exists, it will be overwritten!')
         logger.warning('* Enter exactly YES if you are positive you want to proceed:')
         response = input('YES, I am sure> ')
         if response != 'YES':
             logger.info("You didn't enter YES. Okay then, see ya!")
             sys.exit(0)
 
-    logger.info(f'* Writing: {args.output}')
-    writer = gguf.GGUFWriter(args.output, arch=arch, endianess=endianess)
+    logger.info(f'* Writing: {output}')
+    writer = gguf.GGUFWriter(output, arch=arch, endianess=endianess)
 
     alignment = get_field_data(reader, gguf.Keys.General.ALIGNMENT)
     if alignment is not None:
@@ -239,6 +261,21 @@ def main() -> None:
 
     copy_with_new_metadata(reader, writer, new_metadata, remove_metadata)
 
+    if args.in_place and fits_in_place(reader, writer):
+        logger.info(f'* Updating the metadata of {args.input} in place')
+        writer.close()
+        write_metadata_in_place(output, args.input, reader.data_offset)
+        os.remove(output)
+        return
+
+    copy_tensor_data(reader, writer, args.input)
+    writer.close()
+
+    if args.in_place:
+        logger.info(f'* The new metadata does not fit in place, replacing {args.input}')
+        del reader
+        os.replace(output, args.input)
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+import sys
+from pathlib import Path
+
+from tqdm import tqdm
+
+# Necessary to load the local gguf package
+if "NO_LOCAL_GGUF" not in os.environ and (Path(__file__).parent.parent.parent / 'gguf-py').exists():
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import gguf
+
+logger = logging.getLogger("gguf-relayout")
+
+# The size of the huge pages of x86-64 (and of most arm64 systems)
+LARGE_PAGE_SIZE = 2 * 1024 * 1024
+
+# Fraction of the size of the tensor data above which the padding is worth a warning
+PADDING_WARNING_RATIO = 0.1
+
+
+def relayout(reader: gguf.GGUFReader, input_path: Path, output_path: Path, alignment: int, disable_progress_bar: bool = False) -> None:
+    little_endian = (reader.byte_order == 'I') == (sys.byteorder == 'little')
+    endianess = gguf.GGUFEndian.LITTLE if little_endian else gguf.GGUFEndian.BIG
+    arch = reader.get_field(gguf.Keys.General.ARCHITECTURE)
+    assert arch is not None
+
+    writer = gguf.GGUFWriter(output_path, arch=arch.contents(), endianess=endianess, load_order=True)
+    writer.add_custom_alignment(alignment)
+
+    for field in reader.fields.values():
+        # Suppress virtual fields and fields written by GGUFWriter
+        if field.name in (gguf.Keys.General.ARCHITECTURE, gguf.Keys.General.ALIGNMENT) or field.name.startswith('GGUF.'):
+            continue
+        writer.add_key_value(field.name, field.contents(), field.types[0])
+
+    for tensor in reader.tensors:
+        writer.add_tensor_info(tensor.name, tensor.data.shape, tensor.data.dtype, tensor.data.nbytes, tensor.tensor_type)
+
+    # each tensor is padded to the alignment
+    total_bytes = sum(tensor.n_bytes for tensor in reader.tensors)
+    padding = sum(gguf.GGUFWriter.ggml_pad(tensor.n_bytes, alignment) for tensor in reader.tensors) - total_bytes
+    message = f"The alignment to {alignment} bytes adds {padding} bytes of padding ({padding / max(total_bytes, 1):.1%} of the tensor data)"
+    if padding > PADDING_WARNING_RATIO * total_bytes:
+        logger.warning(f"{message}, a smaller --alignment would reduce it")
+    else:
+        logger.info(message)
+
+    writer.write_header_to_file()
+    writer.write_kv_data_to_file()
+    writer.write_ti_data_to_file()
+
+    bar = tqdm(desc="Writing", total=total_bytes, unit="byte", unit_scale=True, disable=disable_progress_bar)
+
+    # The tensor data doesn't change, it's copied as is without going through Python
+    with open(input_path, 'rb') as fin:
+        for tensor in reader.tensors:
+            writer.copy_tensor_data(tensor.name, fin.fileno(), tensor.data_offset)
+            bar.update(tensor.n_bytes)
+
+    bar.close()
+    writer.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Make a copy of a GGUF file with its tensors in the order they are used at runtime "
+                    "(token embeddings, then block by block, then output) and with a large alignment, "
+                    "for mmap readahead and transparent huge pages",
+    )
+    parser.add_argument("input",         type=Path,           help="GGUF format model input filename")
+    parser.add_argument("output",        type=Path,           help="GGUF format model output filename")
+    parser.add_argument("--alignment",   type=int,            default=LARGE_PAGE_SIZE, help=f"alignment of the tensor data in bytes, a power of 2 (default: {LARGE_PAGE_SIZE})")
+    parser.add_argument("--force",       action="store_true", help="Bypass warnings without confirmation")
+    parser.add_argument("--progressbar", action="store_true", help="enable progressbar")
+    parser.add_argument("--verbose",     action="store_true", help="Increase output verbosity")
+    args = parser.parse_args(None if len(sys.argv) > 1 else ["--help"])
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+
+    logger.info(f'* Loading: {args.input}')
+    reader = gguf.GGUFReader(args.input, 'r', lazy=True)
+
+    split_count = reader.get_field(gguf.Keys.Split.LLM_KV_SPLIT_COUNT)
+    if split_count is not None and split_count.contents() > 1:
+        logger.error("Split models are not supported, merge them first with llama-gguf-split --merge")
+        sys.exit(1)
+
+    if os.path.isfile(args.output) and not args.force:
+        logger.warning('*** Warning *** Warning *** Warning **')
+        logger.warning(f'* The "{args.output}" GGUF file already exists, it will be overwritten!')
+        logger.warning('* Enter exactly YES if you are positive you want to proceed:')
+        response = input('YES, I am sure> ')
+        if response != 'YES':
+            logger.info("You didn't enter YES. Okay then, see ya!")
+            sys.exit(0)
+
+    logger.info(f'* Writing: {args.output}')
+    relayout(reader, args.input, args.output, args.alignment, disable_progress_bar=not args.progressbar)
+
+
+if __name__ == '__main__':
+    main()
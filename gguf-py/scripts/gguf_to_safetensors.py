@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import Callable, Iterator
+
+import numpy as np
+from tqdm import tqdm
+
+# Necessary to load the local gguf package
+if "NO_LOCAL_GGUF" not in os.environ and (Path(__file__).parent.parent.parent / 'gguf-py').exists():
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import gguf  # noqa: E402
+from gguf import GGMLQuantizationType, GGUFSplitReader, ReaderTensor, SafetensorsWriter  # noqa: E402
+
+
+logger = logging.getLogger("gguf-to-safetensors")
+
+# Number of values dequantized at once (by groups of whole rows)
+DEQUANT_CHUNK_SIZE = 1024 * 1024
+
+# Types which are copied as is (when the byte order of the file is little-endian)
+PASSTHROUGH_TYPES: dict[GGMLQuantizationType, str] = {
+    GGMLQuantizationType.F32:  "F32",
+    GGMLQuantizationType.F16:  "F16",
+    GGMLQuantizationType.BF16: "BF16",
+    GGMLQuantizationType.F64:  "F64",
+    GGMLQuantizationType.I8:   "I8",
+    GGMLQuantizationType.I16:  "I16",
+    GGMLQuantizationType.I32:  "I32",
+    GGMLQuantizationType.I64:  "I64",
+}
+
+# Types of the dequantized tensors
+OUT_TYPES: dict[str, Callable[[np.ndarray], np.ndarray]] = {
+    "F32": lambda data: data,
+    "F16": lambda data: data.astype(np.float16),
+    "BF16": lambda data: gguf.quants.quantize(data, GGMLQuantizationType.BF16),
+}
+
+
+def split_str_to_n_bytes(split_str: str) -> int:
+    if split_str.endswith("K"):
+        n = int(split_str[:-1]) * 1000
+    elif split_str.endswith("M"):
+        n = int(split_str[:-1]) * 1000 * 1000
+    elif split_str.endswith("G"):
+        n = int(split_str[:-1]) * 1000 * 1000 * 1000
+    elif split_str.isnumeric():
+        n = int(split_str)
+    else:
+        raise ValueError(f"Invalid split size: {split_str}, must be a number, optionally followed by K, M, or G")
+
+    if n < 0:
+        raise ValueError(f"Invalid split size: {split_str}, must be positive")
+
+    return n
+
+
+def out_dtype(tensor: ReaderTensor, dequant_type: str) -> str:
+    return PASSTHROUGH_TYPES.get(tensor.tensor_type, dequant_type)
+
+
+# Group the tensors in shards of at most max_size bytes (unless a single tensor is bigger)
+def plan_shards(tensors: list[tuple[ReaderTensor, str]], max_size: int) -> list[list[tuple[ReaderTensor, str]]]:
+    shards: list[list[tuple[ReaderTensor, str]]] = [[]]
+    shard_size = 0
+    for tensor, dtype in tensors:
+        n_bytes = tensor.n_elements * gguf.SAFETENSORS_DTYPES[dtype].itemsize
+        if max_size > 0 and shard_size + n_bytes > max_size and len(shards[-1]) > 0:
+            shards.append([])
+            shard_size = 0
+        shards[-1].append((tensor, dtype))
+        shard_size += n_bytes
+    return shards
+
+
+# The parts of the export of a tensor which can run concurrently, with the number of bytes they write.
+# Tensors which don't need a conversion are copied as is, in the kernel when possible,
+# and the other ones are converted by chunks of rows, each written at its final offset.
+def export_tensor(
+    reader: GGUFSplitReader, shard_fds: list[int], writer: SafetensorsWriter, idx: int, tensor: ReaderTensor, dtype: str,
+) -> Iterator[tuple[Callable[[], None], int]]:
+    shard, _ = reader.locate_tensor(idx)
+    little_endian = (reader.byte_order == 'I') == (sys.byteorder == 'little')
+    if tensor.tensor_type in PASSTHROUGH_TYPES and little_endian:
+        yield (lambda: writer.copy_tensor_data(tensor.name, shard_fds[shard], tensor.data_offset)), tensor.n_bytes
+        return
+
+    rows = tensor.data.reshape((-1, tensor.data.shape[-1]))
+    out_row_size = int(tensor.shape[0]) * gguf.SAFETENSORS_DTYPES[dtype].itemsize
+    chunk = max(1, DEQUANT_CHUNK_SIZE // max(1, int(tensor.shape[0])))
+
+    def convert(start: int) -> None:
+        data = rows[start:start + chunk]
+        if not little_endian:
+            if data.dtype == np.uint8:
+                # BF16 and the quantized types are read as bytes
+                data = gguf.quants.byteswap(data, tensor.tensor_type)
+            else:
+                data = data.astype(data.dtype.newbyteorder("<"))
+        if tensor.tensor_type not in PASSTHROUGH_TYPES:
+            data = OUT_TYPES[dtype](gguf.quants.dequantize(data, tensor.tensor_type))
+        writer.write_tensor_data(tensor.name, data, start * out_row_size)
+
+    for start in range(0, rows.shape[0], chunk):
+        yield partial(convert, start), min(chunk, rows.shape[0] - start) * out_row_size
+
+
+def gguf_to_safetensors(
+    reader: GGUFSplitReader, out_dir: Path, dequant_type: str = "F32", max_shard_size: int = 0,
+    threads: int | None = None, disable_progress_bar: bool = False,
+) -> list[Path]:
+    if dequant_type not in OUT_TYPES:
+        raise ValueError(f"Unsupported type for the dequantized tensors: {dequant_type}")
+    tensor_dtypes = [(tensor, out_dtype(tensor, dequant_type)) for tensor in reader.tensors]
+    for tensor, dtype in tensor_dtypes:
+        if dtype != PASSTHROUGH_TYPES.get(tensor.tensor_type):
+            # fail early for the types which can't be dequantized
+            gguf.quants.dequantize(tensor.data.reshape((-1, tensor.data.shape[-1]))[:0], tensor.tensor_type)
+    indices = {tensor.name: i for i, tensor in enumerate(reader.tensors)}
+
+    shards = plan_shards(tensor_dtypes, max_shard_size)
+    if len(shards) == 1:
+        paths = [out_dir / "model.safetensors"]
+    else:
+        paths = [out_dir / f"model-{i + 1:05d}-of-{len(shards):05d}.safetensors" for i in range(len(shards))]
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    writers: list[SafetensorsWriter] = []
+    input_files = [open(path, "rb") for path in reader.shards]
+    try:
+        for path, shard in zip(paths, shards):
+            writer = SafetensorsWriter(path)
+            for tensor, dtype in shard:
+                writer.add_tensor_info(tensor.name, dtype, tuple(reversed(tensor.shape.tolist())))
+            writer.write_header_to_file()
+            writers.append(writer)
+
+        shard_fds = [f.fileno() for f in input_files]
+        jobs = [
+            job
+            for writer, shard in zip(writers, shards)
+            for tensor, dtype in shard
+            for job in export_tensor(reader, shard_fds, writer, indices[tensor.name], tensor, dtype)
+        ]
+        total_bytes = sum(n_bytes for _, n_bytes in jobs)
+        bar = tqdm(desc="Writing", total=total_bytes, unit="byte", unit_scale=True, disable=disable_progress_bar)
+
+        # The conversions and the copies release the GIL for most of their work,
+        # so with enough threads the export is bound by the speed of the disk
+        def run(job: tuple[Callable[[], None], int]) -> None:
+            job[0]()
+            bar.update(job[1])
+
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            for _ in executor.map(run, jobs):
+                pass
+        bar.close()
+    finally:
+        for writer in writers:
+            writer.close()
+        for f in input_files:
+            f.close()
+
+    if len(shards) > 1:
+        index = {
+            "metadata": {"total_size": sum(writer.data_size for writer in writers)},
+            "weight_map": {tensor.name: path.name for path, shard in zip(paths, shards) for tensor, _ in shard},
+        }
+        index_path = out_dir / "model.safetensors.index.json"
+        with open(index_path, "w", encoding="utf-8") as f:
+            json.dump(index, f, indent=2)
+        paths.append(index_path)
+
+    return paths
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Export the tensors of a GGUF model to safetensors, dequantizing the quantized ones")
+    parser.add_argument("model",            type=str,            help="GGUF format model filename (the first shard for split models)")
+    parser.add_argument("outdir",           type=Path,           help="directory of the safetensors files")
+    parser.add_argument("--outtype",        type=str,            choices=list(OUT_TYPES), default="F32",
+                        help="type of the dequantized tensors (the other tensors keep their type)")
+    parser.add_argument("--max-shard-size", type=str,            default="0", help="max size per shard, N(K|M|G) (default: 0 for a single file)")
+    parser.add_argument("--threads",        type=int,            help="number of threads used for the export (default: depends on the number of CPUs)")
+    parser.add_argument("--progressbar",    action="store_true", help="enable progressbar")
+    parser.add_argument("--verbose",        action="store_true", help="increase output verbosity")
+    args = parser.parse_args(None if len(sys.argv) > 1 else ["--help"])
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+
+    logger.info(f"* Loading: {args.model}")
+    reader = GGUFSplitReader(args.model, 'r', lazy=True)
+    paths = gguf_to_safetensors(reader, args.outdir, args.outtype, split_str_to_n_bytes(args.max_shard_size), args.threads, not args.progressbar)
+    for path in paths:
+        logger.info(f"Wrote {path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+
+import unittest
+from pathlib import Path
+import os
+import sys
+
+import numpy as np
+
+# Necessary to load the local gguf package
+if "NO_LOCAL_GGUF" not in os.environ and (Path(__file__).parent.parent.parent / 'gguf-py').exists():
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import gguf
+
+
+class TestByteswap(unittest.TestCase):
+
+    def test_block_layouts(self):
+        for qtype, (block_size, type_size) in gguf.GGML_QUANT_SIZES.items():
+            with self.subTest(qtype=qtype.name):
+                itemsize = gguf.block_layout_dtype(qtype).itemsize
+                # interleaved types are swapped by groups of blocks
+                self.assertEqual(itemsize % type_size, 0)
+
+    def test_double_swap(self):
+        rng = np.random.default_rng(0)
+        for qtype in gguf.GGML_QUANT_SIZES:
+            with self.subTest(qtype=qtype.name):
+                itemsize = gguf.block_layout_dtype(qtype).itemsize
+                data = rng.integers(0, 256, size=(3, 2 * itemsize), dtype=np.uint8)
+                swapped = gguf.byteswap(data, qtype)
+                self.assertEqual(swapped.shape, data.shape)
+                np.testing.assert_array_equal(gguf.byteswap(swapped, qtype), data)
+
+    def test_simple_types(self):
+        data = np.arange(64, dtype=np.float16)
+        swapped = gguf.byteswap(data, gguf.GGMLQuantizationType.F16)
+        np.testing.assert_array_equal(swapped.view(np.float16), data.byteswap())
+        # the input is left untouched
+        np.testing.assert_array_equal(data, np.arange(64, dtype=np.float16))
+
+    def test_q8_0(self):
+        rng = np.random.default_rng(0)
+        data = rng.integers(0, 256, size=(4, 34), dtype=np.uint8)
+        expected = data.copy()
+        expected[:, [0, 1]] = expected[:, [1, 0]]
+        gguf.byteswap(data, gguf.GGMLQuantizationType.Q8_0, inplace=True)
+        np.testing.assert_array_equal(data, expected)
+
+    def test_q8_1(self):
+        # d and s are halves, like in ggml-common.h
+        rng = np.random.default_rng(0)
+        data = rng.integers(0, 256, size=(4, 36), dtype=np.uint8)
+        expected = data.copy()
+        expected[:, [0, 1, 2, 3]] = expected[:, [1, 0, 3, 2]]
+        gguf.byteswap(data, gguf.GGMLQuantizationType.Q8_1, inplace=True)
+        np.testing.assert_array_equal(data, expected)
+
+    def test_invalid_size(self):
+        with self.assertRaises(ValueError):
+            gguf.byteswap(np.zeros(33, dtype=np.uint8), gguf.GGMLQuantizationType.Q8_0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+
+import importlib
+import importlib.util
+import json
+import subprocess
+import tempfile
+import unittest
+from unittest import mock
+from pathlib import Path
+from typing import Any
+import os
+import sys
+
+import numpy as np
+
+# Necessary to load the local gguf package
+if "NO_LOCAL_GGUF" not in os.environ and (Path(__file__).parent.parent.parent / 'gguf-py').exists():
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import gguf
+
+ROOT = Path(__file__).parent.parent.parent
+HAS_CONVERT = (ROOT / "convert_hf_to_gguf.py").exists()
+HAS_TORCH = importlib.util.find_spec("torch") is not None
+
+
+def write_model(dir_model: Path) -> None:
+    # a model which doesn't modify its tensors, with the types which need to be converted
+    with open(dir_model / "config.json", "w", encoding="utf-8") as f:
+        json.dump({"architectures": ["Qwen2ForCausalLM"], "num_hidden_layers": 1}, f)
+    rng = np.random.default_rng(0)
+    tensors = {
+        "model.embed_tokens.weight": ("F16", rng.standard_normal((8, 32)).astype(np.float16)),
+        "model.layers.0.self_attn.q_proj.weight": ("BF16", (rng.standard_normal((32, 32), dtype=np.float32).view(np.uint32) >> 16).astype(np.uint16)),
+        "model.layers.0.self_attn.q_proj.bias": ("F64", rng.standard_normal((32,))),
+        "model.norm.weight": ("F32", rng.standard_normal((1, 32), dtype=np.float32)),
+    }
+    writer = gguf.SafetensorsWriter(dir_model / "model.safetensors")
+    for name, (dtype, data) in tensors.items():
+        writer.add_tensor_info(name, dtype, data.shape)
+    writer.write_header_to_file()
+    for name, (_, data) in tensors.items():
+        writer.write_tensor_data(name, data)
+    writer.close()
+
+
+def import_convert() -> Any:
+    sys.path.insert(0, str(ROOT))
+    try:
+        return importlib.import_module("convert_hf_to_gguf")
+    finally:
+        sys.path.remove(str(ROOT))
+
+
+def converted_tensors(model: Any) -> dict[str, tuple[gguf.GGMLQuantizationType, np.ndarray]]:
+    model.prepare_tensors()
+    return {
+        name: (ti.dtype, gguf.LazyNumpyTensor.to_eager(ti.tensor))
+        for tensors in model.gguf_writer.tensors
+        for name, ti in tensors.items()
+    }
+
+
+@unittest.skipUnless(HAS_CONVERT, "requires convert_hf_to_gguf.py")
+class TestConvertWithoutTorch(unittest.TestCase):
+
+    def test_no_torch_import(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            write_model(Path(tmpdir))
+            code = (
+                "import sys; from pathlib import Path\n"
+                f"sys.path.insert(0, {str(ROOT)!r})\n"
+                "import convert_hf_to_gguf as convert\n"
+                "dir_model = Path(sys.argv[1])\n"
+                "model = convert.Model.from_model_architecture('Qwen2ForCausalLM')(dir_model, convert.gguf.LlamaFileType.GUESSED, dir_model / 'out.gguf')\n"
+                "assert not model.uses_torch()\n"
+                "model.prepare_tensors()\n"
+                "assert len(model.gguf_writer.tensors[0]) == 4\n"
+                "assert 'torch' not in sys.modules, 'torch was imported'\n"
+            )
+            subprocess.run([sys.executable, "-c", code, tmpdir], check=True)
+
+
+@unittest.skipUnless(HAS_CONVERT and HAS_TORCH, "requires convert_hf_to_gguf.py and torch")
+class TestLazyTorchTensor(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_bf16(self):
+        import torch
+        from gguf.lazy_torch import LazyTorchTensor
+
+        data = np.random.default_rng(0).standard_normal((4, 8), dtype=np.float32)
+        bits = (data.view(np.uint32) >> 16).astype(np.uint16)
+        writer = gguf.SafetensorsWriter(self.dir / "model.safetensors")
+        writer.add_tensor_info("a", "BF16", data.shape)
+        writer.write_header_to_file()
+        writer.write_tensor_data("a", bits)
+        writer.close()
+
+        from_numpy = torch.from_numpy
+
+        # like torch < 2.3
+        def from_numpy_without_unsigned(a: np.ndarray) -> torch.Tensor:
+            if a.dtype in (np.uint16, np.uint32, np.uint64):
+                raise TypeError(f"can't convert np.ndarray of type numpy.{a.dtype}")
+            return from_numpy(a)
+
+        # copy-on-write, like in convert_hf_to_gguf.py
+        reader = gguf.SafetensorsReader(self.dir / "model.safetensors", mode="c")
+        with mock.patch.object(torch, "from_numpy", from_numpy_without_unsigned):
+            t = LazyTorchTensor.to_eager(LazyTorchTensor.from_safetensors_tensor(reader.tensors["a"]))
+        self.assertEqual(t.dtype, torch.bfloat16)
+        np.testing.assert_array_equal(t.float().numpy(), gguf.bf16_to_f32(bits))
+
+    def test_numpy_matches_torch(self):
+        convert = import_convert()
+        write_model(self.dir)
+        model_class = convert.Model.from_model_architecture("Qwen2ForCausalLM")
+
+        class TorchModel(model_class):
+            model_arch = model_class.model_arch
+
+            # (same as the inherited one, but the tensors then go through torch)
+            def modify_tensors(self, data_torch, name, bid):
+                return super().modify_tensors(data_torch, name, bid)
+
+        for eager in (False, True):
+            with self.subTest(eager=eager):
+                models = [cls(self.dir, gguf.LlamaFileType.MOSTLY_F16, self.dir / "out.gguf", eager=eager) for cls in (model_class, TorchModel)]
+                self.assertEqual([model.uses_torch() for model in models], [False, True])
+                expected = converted_tensors(models[1])
+                actual = converted_tensors(models[0])
+                self.assertEqual(list(actual), list(expected))
+                for name, (qtype, data) in expected.items():
+                    self.assertEqual(actual[name][0], qtype)
+                    np.testing.assert_array_equal(actual[name][1], data)
+
+
+if __name__ == '__main__':
+    unittest.main()
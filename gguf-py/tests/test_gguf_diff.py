@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+
+import subprocess
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from pathlib import Path
+import os
+import sys
+
+import numpy as np
+
+# Necessary to load the local gguf package
+if "NO_LOCAL_GGUF" not in os.environ and (Path(__file__).parent.parent.parent / 'gguf-py').exists():
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import gguf
+from scripts import gguf_diff as diff
+
+SCRIPT = Path(__file__).parent.parent / "scripts" / "gguf_diff.py"
+
+Q8_0 = gguf.GGMLQuantizationType.Q8_0
+Q4_0 = gguf.GGMLQuantizationType.Q4_0
+F16 = gguf.GGMLQuantizationType.F16
+F32 = gguf.GGMLQuantizationType.F32
+
+
+def make_values() -> dict[str, np.ndarray]:
+    rng = np.random.default_rng(0)
+    return {name: rng.standard_normal((4, 64), dtype=np.float32) for name in ("a", "b", "c")}
+
+
+def write_gguf(path: Path, types: dict[str, gguf.GGMLQuantizationType], endianess: gguf.GGUFEndian) -> None:
+    writer = gguf.GGUFWriter(path, "llama", endianess=endianess)
+    for name, values in make_values().items():
+        qtype = types[name]
+        data = gguf.quantize(values, qtype)
+        if endianess == gguf.GGUFEndian.BIG and data.dtype == np.uint8:
+            # GGUFWriter only swaps the float and integer types
+            data = gguf.byteswap(data, qtype)
+        writer.add_tensor(name, data, raw_dtype=qtype)
+    writer.write_header_to_file()
+    writer.write_kv_data_to_file()
+    writer.write_tensors_to_file()
+    writer.close()
+
+
+def dequantized(values: np.ndarray, qtype: gguf.GGMLQuantizationType) -> np.ndarray:
+    return gguf.dequantize(gguf.quantize(values, qtype), qtype).astype(np.float64).reshape(-1)
+
+
+class TestGGUFDiff(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmpdir.name)
+        self.types_a = {"a": Q8_0, "b": F32, "c": F32}
+        self.types_b = {"a": F16, "b": Q4_0, "c": F32}
+        write_gguf(self.dir / "a.gguf", self.types_a, gguf.GGUFEndian.LITTLE)
+        write_gguf(self.dir / "a-be.gguf", self.types_a, gguf.GGUFEndian.BIG)
+        write_gguf(self.dir / "b-be.gguf", self.types_b, gguf.GGUFEndian.BIG)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_stats(self):
+        reader_a = gguf.GGUFReader(self.dir / "a.gguf")
+        reader_b = gguf.GGUFReader(self.dir / "b-be.gguf")
+        tensors_b = {tensor.name: tensor for tensor in reader_b.tensors}
+        values = make_values()
+
+        # one row per chunk, to also check how the chunks are merged
+        with mock.patch.object(diff, "DIFF_CHUNK_SIZE", 64), ThreadPoolExecutor(max_workers=2) as executor:
+            for tensor_a in reader_a.tensors:
+                name = tensor_a.name
+                with self.subTest(name=name):
+                    stats = diff.DiffStats()
+                    for chunk_stats in diff.diff_tensors(executor, reader_a, tensor_a, reader_b, tensors_b[name]):
+                        stats = stats.merge(chunk_stats)
+
+                    a = dequantized(values[name], self.types_a[name])
+                    b = dequantized(values[name], self.types_b[name])
+                    self.assertEqual(stats.n, a.size)
+                    self.assertAlmostEqual(stats.max_abs, np.max(np.abs(a - b)))
+                    self.assertAlmostEqual(stats.rmse, np.sqrt(np.mean((a - b) ** 2)))
+                    self.assertAlmostEqual(stats.cos_sim, np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+                    if name == "c":
+                        self.assertEqual(stats.max_abs, 0.0)
+                    else:
+                        self.assertGreater(stats.max_abs, 0.0)
+
+    def test_exit_status(self):
+        for other, status in (("a.gguf", 0), ("a-be.gguf", 0), ("b-be.gguf", 1)):
+            with self.subTest(other=other):
+                result = subprocess.run(
+                    [sys.executable, str(SCRIPT), str(self.dir / "a.gguf"), str(self.dir / other)],
+                    capture_output=True, text=True,
+                )
+                self.assertEqual(result.returncode, status, result.stderr)
+                self.assertIn(f"{2 * status} of 3 tensors differ", result.stdout)
+
+
+if __name__ == '__main__':
+    unittest.main()
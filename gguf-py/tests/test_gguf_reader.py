@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+
+import unittest
+from pathlib import Path
+import io
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+# Necessary to load the local gguf package
+if "NO_LOCAL_GGUF" not in os.environ and (Path(__file__).parent.parent.parent / 'gguf-py').exists():
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import gguf
+
+
+class TestGGUFReader(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write_model(self, path: Path, endianess: gguf.GGUFEndian = gguf.GGUFEndian.LITTLE) -> None:
+        n_vocab = 1000
+        writer = gguf.GGUFWriter(path, "llama", endianess=endianess)
+        writer.add_context_length(4096)
+        writer.add_token_list([f"tok_{i}_é" for i in range(n_vocab)])
+        writer.add_token_scores(np.linspace(-1, 1, n_vocab, dtype=np.float32).tolist())
+        writer.add_token_types([i % 6 for i in range(n_vocab)])
+        writer.add_add_bos_token(True)
+        writer.add_array("test.nested", [[1, 2], [3]])
+        writer.add_tensor("a", np.arange(32, dtype=np.float32).reshape(4, 8))
+        writer.write_header_to_file()
+        writer.write_kv_data_to_file()
+        writer.write_tensors_to_file()
+        writer.close()
+
+    def test_lazy_fields(self):
+        for endianess in (gguf.GGUFEndian.LITTLE, gguf.GGUFEndian.BIG):
+            with self.subTest(endianess=endianess.name):
+                path = self.dir / f"{endianess.name}.gguf"
+                self.write_model(path, endianess)
+
+                eager = gguf.GGUFReader(path)
+                lazy = gguf.GGUFReader(path, lazy=True)
+                self.assertEqual(list(lazy.fields), list(eager.fields))
+                for name, field in eager.fields.items():
+                    lazy_field = lazy.fields[name]
+                    self.assertEqual(lazy_field.offset, field.offset)
+                    self.assertEqual(lazy_field.types, field.types)
+                    self.assertEqual(lazy_field.contents(), field.contents())
+                    self.assertEqual(lazy_field.data, field.data)
+                    self.assertEqual([bytes(part) for part in lazy_field.parts], [bytes(part) for part in field.parts])
+                    if len(field.data) > 2:
+                        for index in (0, 1, -1, slice(2, 5), slice(None, None, -3)):
+                            self.assertEqual(lazy_field.contents(index), field.contents(index))
+
+                tokens = lazy.fields["tokenizer.ggml.tokens"]
+                assert isinstance(tokens, gguf.LazyReaderField)
+                self.assertEqual(tokens.count, 1000)
+                self.assertEqual(tokens.contents(123), "tok_123_é")
+                scores = lazy.fields["tokenizer.ggml.scores"]
+                assert isinstance(scores, gguf.LazyReaderField)
+                self.assertEqual(scores.array().dtype.type, np.float32)
+                self.assertEqual(lazy.data_offset, eager.data_offset)
+                np.testing.assert_array_equal(lazy.tensors[0].data, eager.tensors[0].data)
+
+    def test_string_array(self):
+        path = self.dir / "model.gguf"
+        self.write_model(path)
+        eager = gguf.GGUFReader(path).fields["tokenizer.ggml.tokens"]
+        # the eager reader doesn't make a view per string either, until the parts are accessed
+        assert isinstance(eager, gguf.LazyReaderField)
+        self.assertEqual(eager.contents(7), "tok_7_é")
+        self.assertIsNone(eager._parsed)
+        self.assertEqual(len(eager.parts), 5 + 2 * 1000)
+        field = gguf.GGUFReader(path, lazy=True).fields["tokenizer.ggml.tokens"]
+        assert isinstance(field, gguf.LazyReaderField)
+        strings = field.strings()
+        self.assertEqual(len(strings), 1000)
+        self.assertEqual(strings[0], "tok_0_é")
+        self.assertEqual(strings[-1], "tok_999_é")
+        self.assertEqual(strings[10:13], ["tok_10_é", "tok_11_é", "tok_12_é"])
+        self.assertEqual(strings.get_bytes(42), "tok_42_é".encode("utf-8"))
+        self.assertEqual(list(strings), eager.contents())
+        self.assertEqual(strings.tolist(), [str(bytes(eager.parts[idx]), encoding="utf-8") for idx in eager.data])
+        with self.assertRaises(IndexError):
+            strings[1000]
+
+    def write_split_model(self, path: Path, small_first_shard: bool = False) -> dict[str, np.ndarray]:
+        tensors = {f"t{i}": np.full((2, 8), i, dtype=np.float32) for i in range(5)}
+        writer = gguf.GGUFWriter(path, "llama", split_max_tensors=2, small_first_shard=small_first_shard)
+        writer.add_context_length(4096)
+        for name, data in tensors.items():
+            writer.add_tensor(name, data)
+        writer.write_header_to_file()
+        writer.write_kv_data_to_file()
+        writer.write_tensors_to_file()
+        writer.close()
+        return tensors
+
+    def test_split_reader(self):
+        for small_first_shard in (False, True):
+            with self.subTest(small_first_shard=small_first_shard):
+                path = self.dir / f"split-{small_first_shard}.gguf"
+                tensors = self.write_split_model(path, small_first_shard)
+                shards = sorted(self.dir.glob(f"split-{small_first_shard}-*.gguf"))
+                self.assertEqual(len(shards), 4 if small_first_shard else 3)
+
+                reader = gguf.GGUFSplitReader(shards[0])
+                self.assertEqual(reader.shards, shards)
+                self.assertEqual(reader.fields[gguf.Keys.LLM.CONTEXT_LENGTH.format(arch="llama")].contents(), 4096)
+                self.assertEqual(len(reader.tensors), len(tensors))
+                # the other shards are only opened when needed
+                self.assertEqual(sum(r is not None for r in reader.readers), 1)
+                self.assertEqual(reader.tensors[-1].name, "t4")
+                self.assertEqual([r is not None for r in reader.readers], [True] + [False] * (len(shards) - 2) + [True])
+
+                self.assertEqual([t.name for t in reader.tensors], list(tensors.keys()))
+                for tensor in reader.tensors:
+                    np.testing.assert_array_equal(tensor.data, tensors[tensor.name])
+                self.assertEqual(reader.locate_tensor(4), (len(shards) - 1, 0))
+
+    def test_split_reader_single_file(self):
+        path = self.dir / "model.gguf"
+        self.write_model(path)
+        reader = gguf.GGUFSplitReader(path)
+        self.assertEqual(reader.shards, [path])
+        self.assertEqual([t.name for t in reader.tensors], ["a"])
+
+    def test_split_reader_missing_shard(self):
+        self.write_split_model(self.dir / "model.gguf")
+        (self.dir / "model-00002-of-00003.gguf").unlink()
+        with self.assertRaises(FileNotFoundError):
+            gguf.GGUFSplitReader(self.dir / "model-00001-of-00003.gguf")
+        with self.assertRaises(ValueError):
+            gguf.GGUFSplitReader(self.dir / "model-00003-of-00003.gguf")
+
+    def test_header_reader(self):
+        class CountingBytesIO(io.BytesIO):
+            # stand-in for a slow file, without a file descriptor
+            n_read = 0
+
+            def read(self, size: int | None = -1) -> bytes:
+                data = super().read(size)
+                self.n_read += len(data)
+                return data
+
+        for endianess in (gguf.GGUFEndian.LITTLE, gguf.GGUFEndian.BIG):
+            with self.subTest(endianess=endianess.name):
+                path = self.dir / f"{endianess.name}.gguf"
+                self.write_model(path, endianess)
+                with open(path, "ab") as f:
+                    # make the tensor data bigger than the reads
+                    f.write(bytes(4 * 1024 * 1024))
+                eager = gguf.GGUFReader(path)
+
+                for read_size in (gguf.GGUFHeaderReader.DEFAULT_READ_SIZE, 100):
+                    file = CountingBytesIO(path.read_bytes())
+                    reader = gguf.GGUFHeaderReader(file, lazy=True, read_size=read_size)
+                    # at most read_size bytes, or twice the size of the header, are read
+                    self.assertLessEqual(file.n_read, max(read_size, 2 * eager.data_offset))
+                    self.assertEqual(reader.data_offset, eager.data_offset)
+                    self.assertEqual(reader.byte_order, eager.byte_order)
+                    self.assertEqual(list(reader.fields), list(eager.fields))
+                    for name, field in eager.fields.items():
+                        self.assertEqual(reader.fields[name].contents(), field.contents())
+                    self.assertEqual([f.name for f in reader.tensor_fields], [t.name for t in eager.tensors])
+
+                    n_read = file.n_read
+                    tensor = reader.read_tensor(0)
+                    self.assertEqual(file.n_read - n_read, tensor.n_bytes)
+                    np.testing.assert_array_equal(tensor.data, eager.tensors[0].data)
+                    np.testing.assert_array_equal(reader.tensors[0].data, eager.tensors[0].data)
+
+                # with a path, the file is mapped when the tensors are accessed
+                reader = gguf.GGUFHeaderReader(path)
+                self.assertEqual(len(reader.data), gguf.GGUFHeaderReader.DEFAULT_READ_SIZE)
+                self.assertIsInstance(reader.tensors[0].data.base, np.memmap)
+                np.testing.assert_array_equal(reader.tensors[0].data, eager.tensors[0].data)
+
+    def test_header_reader_truncated(self):
+        path = self.dir / "model.gguf"
+        self.write_model(path)
+        data_offset = gguf.GGUFReader(path).data_offset
+        with self.assertRaises(ValueError):
+            gguf.GGUFHeaderReader(io.BytesIO(path.read_bytes()[:data_offset - 100]), read_size=100)
+
+
+if __name__ == '__main__':
+    unittest.main()
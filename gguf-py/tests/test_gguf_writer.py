@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+
+import unittest
+from unittest import mock
+from pathlib import Path
+import errno
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+# Necessary to load the local gguf package
+if "NO_LOCAL_GGUF" not in os.environ and (Path(__file__).parent.parent.parent / 'gguf-py').exists():
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import gguf
+
+
+def make_tensors() -> dict[str, np.ndarray]:
+    rng = np.random.default_rng(0)
+    return {
+        "a": rng.standard_normal((4, 32), dtype=np.float32),
+        "b": rng.standard_normal((3,), dtype=np.float32).astype(np.float16),
+        "c": gguf.quantize(rng.standard_normal((2, 64), dtype=np.float32), gguf.GGMLQuantizationType.Q8_0),
+        "d": np.arange(7, dtype=np.int32),
+    }
+
+
+def tensor_type(t: np.ndarray) -> gguf.GGMLQuantizationType | None:
+    return gguf.GGMLQuantizationType.Q8_0 if t.dtype == np.uint8 else None
+
+
+class TestGGUFWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write_reference(self, path: Path) -> None:
+        writer = gguf.GGUFWriter(path, "llama")
+        for name, t in make_tensors().items():
+            writer.add_tensor(name, t, raw_dtype=tensor_type(t))
+        writer.write_header_to_file()
+        writer.write_kv_data_to_file()
+        writer.write_tensors_to_file()
+        writer.close()
+
+    def test_threaded_matches_serial(self):
+        self.write_reference(self.dir / "ref.gguf")
+
+        writer = gguf.GGUFWriter(self.dir / "mt.gguf", "llama", thread_count=3, max_inflight_size=256)
+        for name, t in make_tensors().items():
+            writer.add_tensor(name, gguf.LazyNumpyTensor.from_eager(t), raw_dtype=tensor_type(t))
+        writer.write_header_to_file()
+        writer.write_kv_data_to_file()
+        writer.write_tensors_to_file()
+        writer.close()
+
+        self.assertEqual((self.dir / "ref.gguf").read_bytes(), (self.dir / "mt.gguf").read_bytes())
+
+    def test_threaded_evaluation(self):
+        lock = threading.Lock()
+        active: list[int] = [0]
+        peak: list[int] = [0]
+        threads: set[int] = set()
+
+        def slow_copy(a: np.ndarray) -> np.ndarray:
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+                threads.add(threading.get_ident())
+            time.sleep(0.01)
+            with lock:
+                active[0] -= 1
+            return a.copy()
+
+        lazy_copy = gguf.LazyNumpyTensor._wrap_fn(slow_copy)
+        tensors = {f"t{i}": np.full((16,), i, dtype=np.float32) for i in range(8)}
+        # without a budget, the tensors are evaluated by all the threads at once;
+        # with a budget smaller than a tensor, one at a time
+        for max_inflight_size, max_active in ((0, 3), (1, 1)):
+            active[0] = peak[0] = 0
+            threads.clear()
+            path = self.dir / f"inflight-{max_inflight_size}.gguf"
+            writer = gguf.GGUFWriter(path, "llama", thread_count=3, max_inflight_size=max_inflight_size)
+            for name, t in tensors.items():
+                writer.add_tensor(name, lazy_copy(gguf.LazyNumpyTensor.from_eager(t)))
+            writer.write_header_to_file()
+            writer.write_kv_data_to_file()
+            writer.write_tensors_to_file()
+            writer.close()
+
+            self.assertEqual(peak[0], max_active)
+            if max_active > 1:
+                self.assertGreater(len(threads), 1)
+            for rt in gguf.GGUFReader(path).tensors:
+                np.testing.assert_array_equal(rt.data, tensors[rt.name])
+
+    def test_split_threaded_matches_serial(self):
+        paths: dict[int, list[Path]] = {}
+        for thread_count in (1, 2):
+            writer = gguf.GGUFWriter(self.dir / f"split-{thread_count}.gguf", "llama", split_max_tensors=2, thread_count=thread_count)
+            for name, t in make_tensors().items():
+                writer.add_tensor(name, gguf.LazyNumpyTensor.from_eager(t), raw_dtype=tensor_type(t))
+            writer.write_header_to_file()
+            writer.write_kv_data_to_file()
+            fouts = list(writer.fout or ())
+            shards: list[int] = []
+            write_tensor_at_offset = writer._write_tensor_at_offset
+
+            def record_shard(fout, ti):
+                shards.append(fouts.index(fout))
+                return write_tensor_at_offset(fout, ti)
+
+            writer._write_tensor_at_offset = record_shard
+            writer.write_tensors_to_file()
+            writer.close()
+            paths[thread_count] = writer.format_shard_names(self.dir / f"split-{thread_count}.gguf")
+            # with threads, the shards are written at the same time
+            self.assertEqual(shards, [0, 0, 1, 1] if thread_count == 1 else [0, 1, 0, 1])
+
+        self.assertEqual(len(paths[1]), 2)
+        for serial, threaded in zip(paths[1], paths[2]):
+            self.assertEqual(serial.read_bytes(), threaded.read_bytes())
+
+    def test_streaming_out_of_order(self):
+        self.write_reference(self.dir / "ref.gguf")
+
+        tensors = make_tensors()
+        writer = gguf.GGUFWriter(self.dir / "stream.gguf", "llama")
+        for name, t in tensors.items():
+            writer.add_tensor_info(name, t.shape, t.dtype, t.nbytes, raw_dtype=tensor_type(t))
+        writer.write_header_to_file()
+        writer.write_kv_data_to_file()
+        writer.write_ti_data_to_file()
+        for name in reversed(tensors):
+            writer.write_tensor_data(tensors[name], name=name)
+        writer.close()
+
+        self.assertEqual((self.dir / "ref.gguf").read_bytes(), (self.dir / "stream.gguf").read_bytes())
+
+        reader = gguf.GGUFReader(self.dir / "stream.gguf")
+        for rt in reader.tensors:
+            np.testing.assert_array_equal(rt.data, tensors[rt.name])
+
+    def test_copy_tensor_data(self):
+        self.write_reference(self.dir / "ref.gguf")
+
+        reader = gguf.GGUFReader(self.dir / "ref.gguf")
+        writer = gguf.GGUFWriter(self.dir / "copy.gguf", "llama")
+        for rt in reader.tensors:
+            writer.add_tensor_info(rt.name, rt.data.shape, rt.data.dtype, rt.data.nbytes, rt.tensor_type)
+        writer.write_header_to_file()
+        writer.write_kv_data_to_file()
+        writer.write_ti_data_to_file()
+        with open(self.dir / "ref.gguf", "rb") as f:
+            for rt in reversed(reader.tensors):
+                writer.copy_tensor_data(rt.name, f.fileno(), rt.data_offset)
+        writer.close()
+
+        self.assertEqual((self.dir / "ref.gguf").read_bytes(), (self.dir / "copy.gguf").read_bytes())
+
+    def test_copy_tensor_data_fallback(self):
+        self.write_reference(self.dir / "ref.gguf")
+        ref = (self.dir / "ref.gguf").read_bytes()
+        unsupported = OSError(errno.EINVAL, "Invalid argument")
+
+        # when the kernel can't copy these files, the data goes through Python
+        with mock.patch.object(os, "copy_file_range", side_effect=unsupported, create=True), \
+             mock.patch.object(os, "sendfile", side_effect=unsupported, create=True):
+            with open(self.dir / "ref.gguf", "rb") as fin, open(self.dir / "copy.gguf", "wb") as fout:
+                fout.truncate(len(ref))
+                gguf.gguf_writer._copy_file_range(fin.fileno(), fout.fileno(), 0, 0, len(ref))
+
+        self.assertEqual((self.dir / "copy.gguf").read_bytes(), ref)
+
+    def test_load_order(self):
+        names = ["output.weight", "blk.10.attn_q.weight", "token_embd.weight", "blk.2.attn_q.weight", "blk.2.attn_k.weight", "output_norm.weight"]
+        tensors = {name: np.full((i + 1,), i, dtype=np.float32) for i, name in enumerate(names)}
+        writer = gguf.GGUFWriter(self.dir / "ordered.gguf", "llama", split_max_tensors=4, load_order=True)
+        writer.add_custom_alignment(4096)
+        for name, t in tensors.items():
+            writer.add_tensor(name, t)
+        writer.write_header_to_file()
+        writer.write_kv_data_to_file()
+        writer.write_tensors_to_file()
+        writer.close()
+
+        order = ["token_embd.weight", "blk.2.attn_q.weight", "blk.2.attn_k.weight", "blk.10.attn_q.weight", "output.weight", "output_norm.weight"]
+        paths = writer.format_shard_names(self.dir / "ordered.gguf")
+        readers = [gguf.GGUFReader(path) for path in paths]
+        self.assertEqual([rt.name for reader in readers for rt in reader.tensors], order)
+        for reader in readers:
+            self.assertEqual(reader.alignment, 4096)
+            for rt in reader.tensors:
+                self.assertEqual(rt.data_offset % 4096, 0)
+                np.testing.assert_array_equal(rt.data, tensors[rt.name])
+
+        with self.assertRaises(ValueError):
+            gguf.GGUFWriter(None, "llama", use_temp_file=True, load_order=True)
+        with self.assertRaises(ValueError):
+            writer.add_custom_alignment(3000)
+
+    def test_pack_arrays(self):
+        for endianess in (gguf.GGUFEndian.LITTLE, gguf.GGUFEndian.BIG):
+            writer = gguf.GGUFWriter(None, "llama", endianess=endianess)
+            for val, ltype in (
+                (["a", "é", b"\x00b", ""], gguf.GGUFValueType.STRING),
+                ([1, -2, 2**31 - 1, gguf.TokenType.CONTROL], gguf.GGUFValueType.INT32),
+                ([0.5, float("-inf"), float("nan"), 3e38], gguf.GGUFValueType.FLOAT32),
+                ([True, False], gguf.GGUFValueType.BOOL),
+                ([[1, 2], [3]], gguf.GGUFValueType.ARRAY),
+            ):
+                # the same as packing the items one by one
+                items = b"".join(writer._pack_val(item, ltype, add_vtype=False) for item in val)
+                header = writer._pack("I", gguf.GGUFValueType.ARRAY) + writer._pack("I", ltype) + writer._pack("Q", len(val))
+                self.assertEqual(writer._pack_val(val, gguf.GGUFValueType.ARRAY, add_vtype=True), header + items)
+
+            # the values which don't fit in the type
+            with self.assertRaises(struct.error):
+                writer._pack_val([1, 2**31], gguf.GGUFValueType.ARRAY, add_vtype=False)
+            with self.assertRaises(OverflowError):
+                writer._pack_val([0.5, 1e39], gguf.GGUFValueType.ARRAY, add_vtype=False)
+            with self.assertRaises(ValueError):
+                writer._pack_val([1, 0.5], gguf.GGUFValueType.ARRAY, add_vtype=False)
+
+
+if __name__ == '__main__':
+    unittest.main()
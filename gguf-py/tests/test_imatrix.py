@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+
+import unittest
+from pathlib import Path
+import os
+import struct
+import sys
+import tempfile
+
+import numpy as np
+
+# Necessary to load the local gguf package
+if "NO_LOCAL_GGUF" not in os.environ and (Path(__file__).parent.parent.parent / 'gguf-py').exists():
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import gguf
+
+
+def write_imatrix(path: Path, entries: dict[str, tuple[int, np.ndarray]], chunks_count: int | None = None, dataset: str = ""):
+    with open(path, "wb") as f:
+        f.write(struct.pack("<i", len(entries)))
+        for name, (ncall, values) in entries.items():
+            encoded = name.encode("utf-8")
+            f.write(struct.pack("<i", len(encoded)))
+            f.write(encoded)
+            f.write(struct.pack("<ii", ncall, values.size))
+            f.write(values.astype("<f4").tobytes())
+        if chunks_count is not None:
+            encoded = dataset.encode("utf-8")
+            f.write(struct.pack("<ii", chunks_count, len(encoded)))
+            f.write(encoded)
+
+
+class TestImportanceMatrix(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmpdir.name) / "imatrix.dat"
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_load(self):
+        rng = np.random.default_rng(0)
+        values = rng.random(64, dtype=np.float32) * 8
+        experts = rng.random(4 * 32, dtype=np.float32)
+        write_imatrix(self.path, {
+            "blk.0.attn_q.weight": (4, values),
+            "blk.0.ffn_down_exps.weight": (0, experts),
+        }, chunks_count=10, dataset="calibration.txt")
+
+        imatrix = gguf.ImportanceMatrix.load(self.path)
+        self.assertEqual(len(imatrix), 2)
+        self.assertEqual(imatrix.chunks_count, 10)
+        self.assertEqual(imatrix.dataset, "calibration.txt")
+        # the values are divided by the number of calls
+        np.testing.assert_array_equal(imatrix.data["blk.0.attn_q.weight"], values / np.float32(4))
+        np.testing.assert_array_equal(imatrix.data["blk.0.ffn_down_exps.weight"], experts)
+
+        qw = imatrix.get("blk.0.attn_q.weight", (16, 64))
+        assert qw is not None
+        self.assertEqual(qw.shape, (64,))
+        qw = imatrix.get("blk.0.ffn_down_exps.weight", (4, 8, 32))
+        assert qw is not None
+        self.assertEqual(qw.shape, (4, 1, 32))
+        self.assertIsNone(imatrix.get("output.weight", (16, 64)))
+        with self.assertRaises(ValueError):
+            imatrix.get("blk.0.attn_q.weight", (16, 32))
+
+    def test_load_legacy(self):
+        write_imatrix(self.path, {"output.weight": (1, np.ones(32, dtype=np.float32))})
+        imatrix = gguf.ImportanceMatrix.load(self.path)
+        self.assertEqual(imatrix.chunks_count, 0)
+        self.assertIsNone(imatrix.dataset)
+
+    def test_quantize_experts(self):
+        rng = np.random.default_rng(0)
+        data = rng.standard_normal((3, 4, 256), dtype=np.float32)
+        qw = rng.random((3, 1, 256), dtype=np.float32)
+        for qtype in (gguf.GGMLQuantizationType.Q4_0, gguf.GGMLQuantizationType.Q4_K, gguf.GGMLQuantizationType.Q6_K):
+            with self.subTest(qtype=qtype.name):
+                stacked = gguf.quantize(data, qtype, qw)
+                for i in range(data.shape[0]):
+                    np.testing.assert_array_equal(stacked[i], gguf.quantize(data[i], qtype, qw[i, 0]))
+                self.assertFalse(np.array_equal(stacked, gguf.quantize(data, qtype)))
+                # lazy tensors should give the same result
+                lazy = gguf.LazyNumpyTensor.from_eager(data)
+                np.testing.assert_array_equal(gguf.LazyNumpyTensor.to_eager(gguf.quantize(lazy, qtype, qw)), stacked)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import os
+import sys
+
+import numpy as np
+
+# Necessary to load the local gguf package
+if "NO_LOCAL_GGUF" not in os.environ and (Path(__file__).parent.parent.parent / 'gguf-py').exists():
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from gguf.lazy import LazyEvalStats, LazyNumpyTensor
+
+
+class TestLazyEval(unittest.TestCase):
+
+    def test_chain(self):
+        data = np.arange(1024, dtype=np.float32)
+        src = LazyNumpyTensor.from_eager(data)
+        a = src + 1
+        b = a * 2
+        c = b.astype(np.float16)
+        stats = LazyEvalStats()
+        res = LazyNumpyTensor.to_eager(c, stats=stats)
+        np.testing.assert_array_equal(res, ((data + 1) * 2).astype(np.float16))
+        # the intermediate results are released, but not the source and the result
+        self.assertIsNone(a._data)
+        self.assertIsNone(b._data)
+        self.assertIs(src._data, data)
+        self.assertIs(c._data, res)
+        self.assertEqual(stats.n_evaluated, 3)
+        # at most an input and an output are held at once
+        self.assertEqual(stats.peak_nbytes, 2 * data.nbytes)
+
+    def test_shared(self):
+        src = LazyNumpyTensor.from_eager(np.arange(16, dtype=np.float32))
+        a = src + 1
+        b = a * 2
+        c = a * 3
+        LazyNumpyTensor.to_eager(b)
+        # still needed by c
+        self.assertIsNotNone(a._data)
+        stats = LazyEvalStats()
+        np.testing.assert_array_equal(LazyNumpyTensor.to_eager(c, stats=stats), (np.arange(16) + 1) * 3)
+        self.assertEqual(stats.n_evaluated, 1)
+        self.assertIsNone(a._data)
+        # released intermediate results can still be evaluated again
+        np.testing.assert_array_equal(LazyNumpyTensor.to_eager(a), np.arange(16) + 1)
+
+    def test_multiple(self):
+        src = LazyNumpyTensor.from_eager(np.arange(16, dtype=np.float32))
+        a = src + 1
+        b, c = LazyNumpyTensor.to_eager([a + a, a - 1])
+        np.testing.assert_array_equal(b, (np.arange(16) + 1) * 2)
+        np.testing.assert_array_equal(c, np.arange(16))
+        self.assertIsNone(a._data)
+
+    def test_no_keep(self):
+        src = LazyNumpyTensor.from_eager(np.arange(16, dtype=np.float32))
+        a = src + 1
+        b = a * 2
+        c = a * 3
+        res = LazyNumpyTensor.to_eager(b, keep=False)
+        np.testing.assert_array_equal(res, (np.arange(16) + 1) * 2)
+        self.assertIsNone(b._data)
+        # still needed by c
+        LazyNumpyTensor.to_eager(a, keep=False)
+        self.assertIsNotNone(a._data)
+        np.testing.assert_array_equal(LazyNumpyTensor.to_eager(c, keep=False), (np.arange(16) + 1) * 3)
+        self.assertIsNone(a._data)
+
+    def test_deep(self):
+        t = LazyNumpyTensor.from_eager(np.zeros(4, dtype=np.int64))
+        for _ in range(5000):
+            t = t + 1
+        # no RecursionError
+        np.testing.assert_array_equal(LazyNumpyTensor.to_eager(t), np.full(4, 5000))
+
+    def test_threads(self):
+        # like the tensors written by the threads of GGUFWriter, built from a common intermediate result
+        def slow_add(a, b):
+            time.sleep(0.001)
+            return a + b
+
+        lazy_add = LazyNumpyTensor._wrap_fn(slow_add)
+        for _ in range(10):
+            src = LazyNumpyTensor.from_eager(np.arange(16, dtype=np.float32))
+            shared = lazy_add(lazy_add(src, 1), 1)
+            outputs = [lazy_add(shared, i) for i in range(8)]
+            stats = LazyEvalStats()
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                results = list(executor.map(lambda t: LazyNumpyTensor.to_eager(t, stats=stats), outputs))
+            for i, res in enumerate(results):
+                np.testing.assert_array_equal(res, np.arange(16) + 2 + i)
+            # the common intermediate results are only evaluated once, then released
+            self.assertEqual(stats.n_evaluated, 2 + len(outputs))
+            self.assertIsNone(shared._data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+
+import unittest
+from pathlib import Path
+import os
+import sys
+
+import numpy as np
+
+# Necessary to load the local gguf package
+if "NO_LOCAL_GGUF" not in os.environ and (Path(__file__).parent.parent.parent / 'gguf-py').exists():
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import gguf
+from gguf.lazy import LazyNumpyTensor
+
+
+class TestQuantPool(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        rng = np.random.default_rng(0)
+        # enough rows for more than one chunk per worker
+        cls.data = rng.standard_normal((3, 96, 2048), dtype=np.float32)
+        cls.imatrix = rng.random((3, 1, 2048), dtype=np.float32)
+        cls.pools = {
+            "threads": gguf.QuantPool(2),
+            "processes": gguf.QuantPool(2, use_processes=True),
+        }
+
+    @classmethod
+    def tearDownClass(cls):
+        for pool in cls.pools.values():
+            pool.close()
+
+    def check_quantize(self, qtype: gguf.GGMLQuantizationType, imatrix: np.ndarray | None = None):
+        expected = gguf.quantize(self.data, qtype, imatrix)
+        for name, pool in self.pools.items():
+            with self.subTest(pool=name, qtype=qtype.name):
+                np.testing.assert_array_equal(pool.quantize(self.data, qtype, imatrix), expected)
+
+    def test_quantize(self):
+        self.check_quantize(gguf.GGMLQuantizationType.Q8_0)
+
+    def test_quantize_imatrix(self):
+        self.check_quantize(gguf.GGMLQuantizationType.Q4_K, self.imatrix)
+
+    def test_dequantize(self):
+        for qtype in (gguf.GGMLQuantizationType.Q8_0, gguf.GGMLQuantizationType.IQ2_XXS):
+            block_size, type_size = gguf.GGML_QUANT_SIZES[qtype]
+            rng = np.random.default_rng(0)
+            data = rng.integers(0, 256, size=(256, 2048 // block_size * type_size), dtype=np.uint8)
+            # avoid non-finite scales
+            data.reshape((-1, type_size))[:, :2] = np.array([0x00, 0x3c], dtype=np.uint8)
+            expected = gguf.dequantize(data, qtype)
+            for name, pool in self.pools.items():
+                with self.subTest(pool=name, qtype=qtype.name):
+                    np.testing.assert_array_equal(pool.dequantize(data, qtype), expected)
+
+    def test_lazy(self):
+        qtype = gguf.GGMLQuantizationType.Q8_0
+        expected = gguf.quantize(self.data, qtype)
+        lazy = LazyNumpyTensor.from_eager(self.data)
+        res = gguf.quantize(lazy, qtype, pool=self.pools["threads"])
+        np.testing.assert_array_equal(LazyNumpyTensor.to_eager(res), expected)
+
+    def test_small(self):
+        # (too small to be split)
+        data = self.data[0, :2]
+        qtype = gguf.GGMLQuantizationType.Q8_0
+        np.testing.assert_array_equal(self.pools["processes"].quantize(data, qtype), gguf.quantize(data, qtype))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -100,9 +100,11 @@ class GGMLQuants:
             dequant_func(tensor.ctypes.data_as(ctypes.c_void_p), result.ctypes.data_as(c_float_p), result.size)
         return result
 
-    def quantize(self, data: np.ndarray, qtype: GGMLQuantizationType) -> np.ndarray:
+    def quantize(self, data: np.ndarray, qtype: GGMLQuantizationType, imatrix: np.ndarray | None = None) -> np.ndarray:
         result = np.zeros(gguf.quant_shape_to_byte_shape(data.shape, qtype), dtype=np.uint8, order="C")
-        if self.libggml.ggml_quantize_requires_imatrix(qtype.value):
+        if imatrix is not None:
+            qw = imatrix.ctypes.data_as(c_float_p)
+        elif self.libggml.ggml_quantize_requires_imatrix(qtype.value):
             # TODO: is a column-wise sum of squares appropriate?
             qw = np.sum((data * data).reshape((-1, data.shape[-1])), axis=0).ctypes.data_as(c_float_p)
         else:
@@ -146,6 +148,7 @@ def do_test(libggml_path: Path, quick: bool = False):
     np.set_printoptions(precision=None, threshold=(4 * 256) + 1, formatter={"int": lambda n: "0x%02X" % n})
 
     r = np.random.randn(8, 1024, 1024).astype(np.float32, copy=False)
+    imatrix = np.random.random(1024).astype(np.float32, copy=False)
 
     for qtype in (GGMLQuantizationType.F16, *gguf.quants._type_traits.keys()):
         has_dequantize = False
@@ -192,6 +195,18 @@ def do_test(libggml_path: Path, quick: bool = False):
             else:
                 logger.info(f"Quantization to {qtype.name} matches exactly ✅")
 
+            if qtype != GGMLQuantizationType.F16:
+                logger.debug(f"Quantizing to {qtype.name} with an importance matrix with Python")
+                pyq = gguf.quants.quantize(rc, qtype, imatrix)
+
+                logger.debug(f"Quantizing to {qtype.name} with an importance matrix with C")
+                ggq_imatrix = ggml_quants.quantize(rc, qtype, imatrix)
+
+                if not compare_tensors(pyq, ggq_imatrix, qtype):
+                    logger.error(f"Quantization to {qtype.name} with an importance matrix does not match ❌")
+                else:
+                    logger.info(f"Quantization to {qtype.name} with an importance matrix matches exactly ✅")
+
         if has_dequantize:
             if ggq is None and not quick:
                 logger.debug(f"Quantizing to {qtype.name} with C")
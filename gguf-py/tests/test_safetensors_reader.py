@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from typing import Any
+import os
+import sys
+
+import numpy as np
+
+# Necessary to load the local gguf package
+if "NO_LOCAL_GGUF" not in os.environ and (Path(__file__).parent.parent.parent / 'gguf-py').exists():
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import gguf
+from gguf.lazy import LazyNumpyTensor
+
+
+def write_safetensors(path: Path, tensors: dict[str, tuple[str, np.ndarray]], header_extra: dict[str, Any] | None = None):
+    header: dict[str, Any] = {"__metadata__": {"format": "pt"}}
+    offset = 0
+    for name, (dtype, data) in tensors.items():
+        header[name] = {"dtype": dtype, "shape": list(data.shape), "data_offsets": [offset, offset + data.nbytes]}
+        offset += data.nbytes
+    header.update(header_extra or {})
+    header_bytes = json.dumps(header).encode("utf-8")
+    with open(path, "wb") as f:
+        f.write(np.uint64(len(header_bytes)).astype("<u8").tobytes())
+        f.write(header_bytes)
+        for _, data in tensors.values():
+            f.write(data.astype(data.dtype.newbyteorder("<")).tobytes())
+
+
+class TestSafetensorsReader(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmpdir.name) / "model.safetensors"
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_read(self):
+        rng = np.random.default_rng(0)
+        f32 = rng.standard_normal((3, 5), dtype=np.float32)
+        # truncation to BF16
+        bf16 = (f32.view(np.uint32) >> 16).astype(np.uint16)
+        i64 = np.arange(7, dtype=np.int64)
+        write_safetensors(self.path, {"a": ("F32", f32), "b": ("BF16", bf16), "c": ("I64", i64), "d": ("F16", np.zeros((), dtype=np.float16))})
+
+        reader = gguf.SafetensorsReader(self.path)
+        self.assertEqual(reader.metadata, {"format": "pt"})
+        self.assertEqual(reader.keys(), ["a", "b", "c", "d"])
+        np.testing.assert_array_equal(reader.get_tensor("a"), f32)
+        np.testing.assert_array_equal(reader.get_tensor("c"), i64)
+        self.assertEqual(reader.tensors["b"].dtype, "BF16")
+        self.assertEqual(reader.tensors["d"].shape, ())
+        np.testing.assert_array_equal(gguf.bf16_to_f32(reader.get_tensor("b")), (bf16.astype(np.uint32) << 16).view(np.float32))
+
+        # the tensors are views of the file
+        tensor = reader.tensors["c"]
+        self.assertEqual(tensor.n_bytes, i64.nbytes)
+        np.testing.assert_array_equal(reader.data[tensor.data_offset:tensor.data_offset + tensor.n_bytes].view("<i8"), i64)
+
+    def test_lazy(self):
+        f32 = np.arange(96, dtype=np.float32).reshape((3, 32))
+        write_safetensors(self.path, {"a": ("F32", f32)})
+        reader = gguf.SafetensorsReader(self.path)
+        lazy = reader.get_lazy_tensor("a")
+        self.assertEqual(lazy.shape, (3, 32))
+        res = LazyNumpyTensor.to_eager(gguf.quants.Q8_0.quantize(lazy))
+        np.testing.assert_array_equal(res, gguf.quantize(f32, gguf.GGMLQuantizationType.Q8_0))
+
+    def test_invalid(self):
+        f32 = np.zeros((4,), dtype=np.float32)
+        write_safetensors(self.path, {"a": ("F32", f32)}, {"b": {"dtype": "F32", "shape": [8], "data_offsets": [0, 32]}})
+        with self.assertRaises(ValueError):
+            gguf.SafetensorsReader(self.path)
+        write_safetensors(self.path, {"a": ("F32", f32)}, {"b": {"dtype": "C64", "shape": [1], "data_offsets": [0, 8]}})
+        with self.assertRaises(ValueError):
+            gguf.SafetensorsReader(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+
+import tempfile
+import unittest
+from pathlib import Path
+import os
+import sys
+
+import numpy as np
+
+# Necessary to load the local gguf package
+if "NO_LOCAL_GGUF" not in os.environ and (Path(__file__).parent.parent.parent / 'gguf-py').exists():
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import gguf
+
+
+class TestSafetensorsWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_round_trip(self):
+        rng = np.random.default_rng(0)
+        f32 = rng.standard_normal((6, 5), dtype=np.float32)
+        i64 = np.arange(7, dtype=np.int64)
+        src = self.dir / "src.bin"
+        src.write_bytes(b"abc" + i64.tobytes())
+
+        writer = gguf.SafetensorsWriter(self.dir / "model.safetensors", {"format": "pt", "source": "test"})
+        writer.add_tensor_info("a", "F32", f32.shape)
+        writer.add_tensor_info("b", "I64", i64.shape)
+        writer.add_tensor_info("c", "F16", ())
+        writer.write_header_to_file()
+        # written by parts, in any order
+        writer.write_tensor_data("a", f32[3:], 3 * 5 * 4)
+        writer.write_tensor_data("a", f32[:3])
+        with open(src, "rb") as f:
+            writer.copy_tensor_data("b", f.fileno(), 3)
+        writer.write_tensor_data("c", np.array(1.5, dtype=np.float16))
+        writer.close()
+
+        reader = gguf.SafetensorsReader(self.dir / "model.safetensors")
+        self.assertEqual(reader.metadata, {"format": "pt", "source": "test"})
+        self.assertEqual(reader.keys(), ["a", "b", "c"])
+        np.testing.assert_array_equal(reader.get_tensor("a"), f32)
+        np.testing.assert_array_equal(reader.get_tensor("b"), i64)
+        self.assertEqual(reader.get_tensor("c").shape, ())
+        self.assertEqual(float(reader.get_tensor("c")), 1.5)
+        # the data is aligned
+        self.assertEqual(reader.tensors["a"].data_offset % 8, 0)
+
+    def test_errors(self):
+        writer = gguf.SafetensorsWriter(self.dir / "model.safetensors")
+        writer.add_tensor_info("a", "F32", (2, 2))
+        with self.assertRaises(ValueError):
+            writer.add_tensor_info("a", "F32", (2, 2))
+        with self.assertRaises(ValueError):
+            writer.add_tensor_info("b", "Q4_0", (2, 2))
+        with self.assertRaises(ValueError):
+            writer.write_tensor_data("a", np.zeros((2, 2), dtype=np.float32))
+        writer.write_header_to_file()
+        with self.assertRaises(ValueError):
+            writer.write_tensor_data("a", np.zeros((2, 2), dtype=np.float32), 4)
+        with self.assertRaises(ValueError):
+            writer.add_tensor_info("c", "F32", (2, 2))
+        writer.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
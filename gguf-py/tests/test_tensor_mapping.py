@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+
+import unittest
+from pathlib import Path
+import os
+import sys
+
+# Necessary to load the local gguf package
+if "NO_LOCAL_GGUF" not in os.environ and (Path(__file__).parent.parent.parent / 'gguf-py').exists():
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import gguf
+from gguf import MODEL_ARCH, MODEL_TENSOR
+
+
+class TestTensorNameMap(unittest.TestCase):
+
+    def test_names(self):
+        tmap = gguf.TensorNameMap(MODEL_ARCH.LLAMA, 12)
+        self.assertEqual(tmap.get_type_and_name("model.embed_tokens"), (MODEL_TENSOR.TOKEN_EMBD, "token_embd"))
+        self.assertEqual(tmap.get_type_and_name("model.layers.11.self_attn.q_proj.weight", try_suffixes=(".weight", ".bias")),
+                         (MODEL_TENSOR.ATTN_Q, "blk.11.attn_q.weight"))
+        self.assertEqual(tmap["blk.3.ffn_up"], "blk.3.ffn_up")
+        self.assertEqual(tmap.get_name("rotary_pos_emb.inv_freq"), "rope_freqs")
+        self.assertIn("model.layers.0.mlp.down_proj", tmap)
+        self.assertEqual(tmap.max_name_length(), max(len(name) for _, name in tmap.mapping.values()))
+
+    def test_invalid_block_ids(self):
+        tmap = gguf.TensorNameMap(MODEL_ARCH.LLAMA, 12)
+        for name in ("model.layers.12.self_attn.q_proj", "model.layers.01.self_attn.q_proj", "model.layers.x.self_attn.q_proj"):
+            with self.subTest(name=name):
+                self.assertIsNone(tmap.get_name(name))
+                self.assertNotIn(name, tmap)
+                with self.assertRaises(KeyError):
+                    tmap[name]
+        self.assertIsNone(gguf.TensorNameMap(MODEL_ARCH.LLAMA, 0).get_name("model.layers.0.self_attn.q_proj"))
+
+    def test_mapping(self):
+        # every expanded name is mapped in the same way
+        for arch in (MODEL_ARCH.LLAMA, MODEL_ARCH.QWEN2MOE, MODEL_ARCH.T5, MODEL_ARCH.ARCTIC):
+            tmap = gguf.TensorNameMap(arch, 3)
+            with self.subTest(arch=arch.name):
+                for key, result in tmap.mapping.items():
+                    self.assertEqual(tmap.get_type_and_name(key), result)
+
+    def test_arch_block_mappings(self):
+        arctic = gguf.TensorNameMap(MODEL_ARCH.ARCTIC, 2)
+        self.assertEqual(arctic.get_type("model.layers.1.residual_layernorm"), MODEL_TENSOR.FFN_NORM)
+        self.assertEqual(arctic.get_type("model.layers.1.post_attention_layernorm"), MODEL_TENSOR.FFN_NORM_EXP)
+        # the overrides of an architecture don't affect the others
+        llama = gguf.TensorNameMap(MODEL_ARCH.LLAMA, 2)
+        self.assertEqual(llama.get_type("model.layers.1.post_attention_layernorm"), MODEL_TENSOR.FFN_NORM)
+
+    def test_cached(self):
+        self.assertIs(gguf.get_tensor_name_map(MODEL_ARCH.LLAMA, 7), gguf.get_tensor_name_map(MODEL_ARCH.LLAMA, 7))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+
+import json
+import random
+import tempfile
+import unittest
+from unittest import mock
+from pathlib import Path
+import os
+import sys
+
+# Necessary to load the local gguf package
+if "NO_LOCAL_GGUF" not in os.environ and (Path(__file__).parent.parent.parent / 'gguf-py').exists():
+    sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import gguf
+
+
+# Straightforward version of bpe_merge: merge the pair with the lowest rank until there are none below max_rank
+def reference_bpe(mergeable_ranks: dict[bytes, int], token: bytes, max_rank: int | None = None) -> list[bytes]:
+    parts = [bytes([b]) for b in token]
+    while True:
+        ranks = [mergeable_ranks.get(a + b) for a, b in zip(parts[:-1], parts[1:])]
+        candidates = [(rank, i) for i, rank in enumerate(ranks) if rank is not None]
+        if not candidates:
+            return parts
+        rank, i = min(candidates)
+        if max_rank is not None and rank >= max_rank:
+            return parts
+        parts = parts[:i] + [parts[i] + parts[i + 1]] + parts[i + 2:]
+
+
+class TestTiktokenMerges(unittest.TestCase):
+
+    def test_token_bytes_to_string(self):
+        self.assertEqual(gguf.token_bytes_to_string(b"hello"), "hello")
+        self.assertEqual(gguf.token_bytes_to_string(b" world\n"), "ĠworldĊ")
+        self.assertEqual(gguf.token_bytes_to_string("é".encode("utf-8")), "Ã©")
+        # each byte has its own character
+        self.assertEqual(len(set(gguf.token_bytes_to_string(bytes(range(256))))), 256)
+
+    def test_bpe_merge(self):
+        rng = random.Random(0)
+        for _ in range(200):
+            ranks: dict[bytes, int] = {}
+            for _ in range(rng.randint(1, 40)):
+                ranks.setdefault(bytes(rng.choice(b"abc") for _ in range(rng.randint(2, 5))), len(ranks))
+            for _ in range(20):
+                token = bytes(rng.choice(b"abc") for _ in range(rng.randint(0, 10)))
+                max_rank = rng.choice([None, rng.randint(0, 40)])
+                self.assertEqual(gguf.bpe_merge(ranks, token, max_rank), reference_bpe(ranks, token, max_rank))
+
+    def test_tiktoken_merges(self):
+        ranks = {bytes([i]): i for i in range(256)}
+        for token in (b"ab", b"cd", b"abcd", b"  ", b"    ", b"abcdab"):
+            ranks[token] = len(ranks)
+        self.assertEqual(gguf.tiktoken_merges(ranks), [
+            [b"a", b"b"], [b"c", b"d"], [b"ab", b"cd"], [b" ", b" "], [b"  ", b"  "], [b"abcd", b"ab"],
+        ])
+        # the same in parallel
+        many = dict(ranks)
+        for i in range(2000):
+            many[b"x" + str(i).encode()] = len(many)
+        self.assertEqual(gguf.tiktoken_merges(many, n_workers=2), gguf.tiktoken_merges(many))
+
+
+class TestTokenizerJsonVocab(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmpdir.name)
+        tokenizer_json = {
+            "added_tokens": [
+                {"id": 2, "content": "ab", "special": False},
+                {"id": 5, "content": "<s>", "special": True},
+                {"id": 6, "content": "<x>", "special": False},
+            ],
+            "model": {"type": "BPE", "vocab": {"a": 0, "b": 1, "ab": 2, "\u0120": 3, "\u0120a": 4}, "merges": ["a b", "\u0120 a"]},
+        }
+        (self.dir / "tokenizer.json").write_text(json.dumps(tokenizer_json), encoding="utf-8")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write_config(self, tokenizer_config: dict, special_tokens_map: dict | None = None):
+        (self.dir / "tokenizer_config.json").write_text(json.dumps(tokenizer_config), encoding="utf-8")
+        if special_tokens_map is not None:
+            (self.dir / "special_tokens_map.json").write_text(json.dumps(special_tokens_map), encoding="utf-8")
+
+    def test_vocab(self):
+        self.write_config({"tokenizer_class": "PreTrainedTokenizerFast", "eos_token": "<x>"})
+        vocab = gguf.TokenizerJsonVocab(self.dir)
+        self.assertEqual(vocab.vocab, {"a": 0, "b": 1, "ab": 2, "\u0120": 3, "\u0120a": 4, "<s>": 5, "<x>": 6})
+        self.assertEqual(vocab.added_tokens, {"ab": 2, "<s>": 5, "<x>": 6})
+        self.assertEqual(vocab.special_ids, {5, 6})
+
+        # the defaults of the tokenizer class, overridden by special_tokens_map.json
+        self.write_config({"tokenizer_class": "LlamaTokenizerFast", "unk_token": None, "bos_token": "a"}, {"eos_token": {"content": "b"}})
+        vocab = gguf.TokenizerJsonVocab(self.dir)
+        self.assertEqual(vocab.added_tokens, {"a": 0, "b": 1, "ab": 2, "<s>": 5, "<x>": 6})
+        self.assertEqual(vocab.special_ids, {0, 1, 5})
+
+        # added_tokens_decoder overrides tokenizer.json, and special_tokens_map.json is then ignored
+        self.write_config({"tokenizer_class": "PreTrainedTokenizerFast", "added_tokens_decoder": {"5": {"content": "<s>", "special": False}}})
+        self.assertEqual(gguf.TokenizerJsonVocab(self.dir).special_ids, set())
+
+    def test_unsupported(self):
+        for tokenizer_config in (
+            {},
+            {"tokenizer_class": "CustomTokenizer"},
+            {"tokenizer_class": "PreTrainedTokenizerFast", "auto_map": {"AutoTokenizer": ["tokenization.CustomTokenizer", None]}},
+            {"tokenizer_class": "PreTrainedTokenizerFast", "eos_token": "<new>"},
+            {"tokenizer_class": "GPT2TokenizerFast"},  # <|endoftext|> isn't in the vocab
+            {"tokenizer_class": "PreTrainedTokenizerFast", "added_tokens_decoder": {"7": {"content": "<new>", "special": True}}},
+        ):
+            self.write_config(tokenizer_config)
+            with self.assertRaises(FileNotFoundError):
+                gguf.TokenizerJsonVocab(self.dir)
+
+    def test_cached_chkhsh(self):
+        self.write_config({"tokenizer_class": "PreTrainedTokenizerFast"})
+        compute = mock.Mock(return_value="1234")
+        with mock.patch.dict(os.environ, {"LLAMA_CACHE": str(self.dir / "cache")}):
+            self.assertEqual(gguf.cached_chkhsh(self.dir, "text", compute), "1234")
+            self.assertEqual(gguf.cached_chkhsh(self.dir, "text", compute), "1234")
+            self.assertEqual(compute.call_count, 1)
+            # a different text or tokenizer is computed again
+            gguf.cached_chkhsh(self.dir, "other text", compute)
+            self.assertEqual(compute.call_count, 2)
+            self.write_config({"tokenizer_class": "PreTrainedTokenizerFast", "eos_token": "<s>"})
+            gguf.cached_chkhsh(self.dir, "text", compute)
+            self.assertEqual(compute.call_count, 3)
+
+    def test_cached_chkhsh_disabled(self):
+        self.write_config({"tokenizer_class": "PreTrainedTokenizerFast"})
+        compute = mock.Mock(return_value="1234")
+        with mock.patch.dict(os.environ, {"LLAMA_CACHE": str(self.dir / "cache")}):
+            for _ in range(2):
+                self.assertEqual(gguf.cached_chkhsh(self.dir, "text", compute, use_cache=False), "1234")
+            self.assertEqual(compute.call_count, 2)
+            self.assertFalse((self.dir / "cache").exists())
+
+        # a cache directory which can't be created, below a file
+        (self.dir / "file").write_bytes(b"")
+        with mock.patch.dict(os.environ, {"LLAMA_CACHE": str(self.dir / "file" / "cache")}):
+            with self.assertLogs("gguf.vocab", level="WARNING"):
+                self.assertEqual(gguf.cached_chkhsh(self.dir, "text", compute), "1234")
+            self.assertEqual(compute.call_count, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
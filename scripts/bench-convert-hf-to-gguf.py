@@ -0,0 +1,529 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Any, Callable, Generator, Iterator
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+
+logger = logging.getLogger("bench-convert-hf-to-gguf")
+
+DESCRIPTION = """Benchmarks convert_hf_to_gguf.py on synthetic HF checkpoints. Example usage:
+
+$ git checkout master
+$ ./scripts/bench-convert-hf-to-gguf.py --work-dir /tmp/bench -o master.json
+$ git checkout some_branch
+$ ./scripts/bench-convert-hf-to-gguf.py --work-dir /tmp/bench -o some_branch.json --compare master.json
+
+The checkpoints (random safetensors shards, config.json and tokenizer.json) are generated in the work directory,
+and reused by later runs with the same parameters. Each conversion runs in a fresh process, to measure its peak RSS.
+
+The time of Model.write() is split into phases:
+  read:           loading the tensors from the safetensors files
+  modify_tensors: the model-specific transformations, and the conversion of the tensors to numpy
+  quantize:       the conversion to the output type (including F16 and F32)
+  write:          writing the tensor data to the output file (with --threads, including the wait for the other threads)
+  vocab:          loading the tokenizer and adding the vocab to the metadata
+  other:          everything else
+With lazy evaluation, most of the work happens while writing, and is split in the same way.
+With --threads, the phases are summed over the threads, so they can add up to more than the total time.
+"""
+
+PHASES = ("read", "modify_tensors", "quantize", "write", "vocab")
+
+# Architectures of the synthetic checkpoints, keyed by a short name
+ARCHITECTURES = {
+    "llama": "LlamaForCausalLM",
+    "qwen2moe": "Qwen2MoeForCausalLM",
+    "bert": "BertModel",
+}
+
+
+def make_config(arch: str, args: argparse.Namespace) -> dict[str, Any]:
+    n_embd = args.hidden_size
+    n_head = max(n_embd // 64, 1)
+    config: dict[str, Any] = {
+        "architectures": [ARCHITECTURES[arch]],
+        "hidden_size": n_embd,
+        "intermediate_size": 4 * n_embd if arch == "bert" else 8 * n_embd // 3 // 64 * 64,
+        "num_hidden_layers": args.layers,
+        "num_attention_heads": n_head,
+        "vocab_size": args.vocab_size,
+        "torch_dtype": "float16" if args.dtype == "f16" else "float32",
+    }
+    if arch == "llama":
+        config.update({
+            "model_type": "llama",
+            "num_key_value_heads": max(n_head // 4, 1),
+            "max_position_embeddings": 4096,
+            "rms_norm_eps": 1e-5,
+            "rope_theta": 10000.0,
+        })
+    elif arch == "qwen2moe":
+        config.update({
+            "model_type": "qwen2_moe",
+            "num_key_value_heads": n_head,
+            "max_position_embeddings": 4096,
+            "rms_norm_eps": 1e-6,
+            "rope_theta": 1000000.0,
+            "num_experts": args.experts,
+            "num_experts_per_tok": 2,
+            "moe_intermediate_size": n_embd // 2,
+            "shared_expert_intermediate_size": 2 * n_embd,
+        })
+    elif arch == "bert":
+        config.update({
+            "model_type": "bert",
+            "max_position_embeddings": 512,
+            "type_vocab_size": 2,
+            "layer_norm_eps": 1e-12,
+        })
+    return config
+
+
+def make_tensor_shapes(config: dict[str, Any]) -> dict[str, tuple[int, ...]]:
+    arch = config["architectures"][0]
+    n_vocab = config["vocab_size"]
+    n_embd = config["hidden_size"]
+    n_ff = config["intermediate_size"]
+    n_head = config["num_attention_heads"]
+    n_embd_kv = n_embd // n_head * config.get("num_key_value_heads", n_head)
+
+    shapes: dict[str, tuple[int, ...]] = {}
+    if arch == "BertModel":
+        shapes["embeddings.word_embeddings.weight"] = (n_vocab, n_embd)
+        shapes["embeddings.position_embeddings.weight"] = (config["max_position_embeddings"], n_embd)
+        shapes["embeddings.token_type_embeddings.weight"] = (config["type_vocab_size"], n_embd)
+        shapes["embeddings.LayerNorm.weight"] = (n_embd,)
+        shapes["embeddings.LayerNorm.bias"] = (n_embd,)
+        for i in range(config["num_hidden_layers"]):
+            layer = f"encoder.layer.{i}"
+            for name, shape in (
+                ("attention.self.query", (n_embd, n_embd)),
+                ("attention.self.key", (n_embd, n_embd)),
+                ("attention.self.value", (n_embd, n_embd)),
+                ("attention.output.dense", (n_embd, n_embd)),
+                ("intermediate.dense", (n_ff, n_embd)),
+                ("output.dense", (n_embd, n_ff)),
+            ):
+                shapes[f"{layer}.{name}.weight"] = shape
+                shapes[f"{layer}.{name}.bias"] = shape[:1]
+            for name in ("attention.output.LayerNorm", "output.LayerNorm"):
+                shapes[f"{layer}.{name}.weight"] = (n_embd,)
+                shapes[f"{layer}.{name}.bias"] = (n_embd,)
+        return shapes
+
+    shapes["model.embed_tokens.weight"] = (n_vocab, n_embd)
+    for i in range(config["num_hidden_layers"]):
+        layer = f"model.layers.{i}"
+        shapes[f"{layer}.input_layernorm.weight"] = (n_embd,)
+        shapes[f"{layer}.self_attn.q_proj.weight"] = (n_embd, n_embd)
+        shapes[f"{layer}.self_attn.k_proj.weight"] = (n_embd_kv, n_embd)
+        shapes[f"{layer}.self_attn.v_proj.weight"] = (n_embd_kv, n_embd)
+        shapes[f"{layer}.self_attn.o_proj.weight"] = (n_embd, n_embd)
+        shapes[f"{layer}.post_attention_layernorm.weight"] = (n_embd,)
+        if arch == "Qwen2MoeForCausalLM":
+            for name in ("q_proj", "k_proj", "v_proj"):
+                shapes[f"{layer}.self_attn.{name}.bias"] = shapes[f"{layer}.self_attn.{name}.weight"][:1]
+            n_ff_exp = config["moe_intermediate_size"]
+            n_ff_shexp = config["shared_expert_intermediate_size"]
+            shapes[f"{layer}.mlp.gate.weight"] = (config["num_experts"], n_embd)
+            for xid in range(config["num_experts"]):
+                shapes[f"{layer}.mlp.experts.{xid}.gate_proj.weight"] = (n_ff_exp, n_embd)
+                shapes[f"{layer}.mlp.experts.{xid}.up_proj.weight"] = (n_ff_exp, n_embd)
+                shapes[f"{layer}.mlp.experts.{xid}.down_proj.weight"] = (n_embd, n_ff_exp)
+            shapes[f"{layer}.mlp.shared_expert.gate_proj.weight"] = (n_ff_shexp, n_embd)
+            shapes[f"{layer}.mlp.shared_expert.up_proj.weight"] = (n_ff_shexp, n_embd)
+            shapes[f"{layer}.mlp.shared_expert.down_proj.weight"] = (n_embd, n_ff_shexp)
+            shapes[f"{layer}.mlp.shared_expert_gate.weight"] = (1, n_embd)
+        else:
+            shapes[f"{layer}.mlp.gate_proj.weight"] = (n_ff, n_embd)
+            shapes[f"{layer}.mlp.up_proj.weight"] = (n_ff, n_embd)
+            shapes[f"{layer}.mlp.down_proj.weight"] = (n_embd, n_ff)
+    shapes["model.norm.weight"] = (n_embd,)
+    shapes["lm_head.weight"] = (n_vocab, n_embd)
+    return shapes
+
+
+def write_safetensors(dir_model: Path, shapes: dict[str, tuple[int, ...]], dtype: np.dtype, shard_size: int, seed: int) -> None:
+    from safetensors.numpy import save_file
+
+    rng = np.random.default_rng(seed)
+
+    # group the tensors in shards of at most shard_size bytes (but at least one tensor per shard)
+    shards: list[list[str]] = [[]]
+    size = 0
+    for name, shape in shapes.items():
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        if shard_size > 0 and len(shards[-1]) > 0 and size + nbytes > shard_size:
+            shards.append([])
+            size = 0
+        shards[-1].append(name)
+        size += nbytes
+
+    weight_map: dict[str, str] = {}
+    for i, names in enumerate(shards):
+        part_name = "model.safetensors" if len(shards) == 1 else f"model-{i + 1:05d}-of-{len(shards):05d}.safetensors"
+        tensors: dict[str, np.ndarray] = {}
+        for name in names:
+            data = rng.standard_normal(shapes[name], dtype=np.float32) * np.float32(0.02)
+            if name.endswith(("norm.weight", "LayerNorm.weight")):
+                data += np.float32(1)
+            tensors[name] = data.astype(dtype)
+            weight_map[name] = part_name
+        save_file(tensors, str(dir_model / part_name), metadata={"format": "pt"})
+        del tensors
+
+    if len(shards) > 1:
+        total_size = sum(int(np.prod(shape)) * dtype.itemsize for shape in shapes.values())
+        with open(dir_model / "model.safetensors.index.json", "w", encoding="utf-8") as f:
+            json.dump({"metadata": {"total_size": total_size}, "weight_map": weight_map}, f, indent=2)
+
+
+def write_tokenizer(dir_model: Path, arch: str, vocab_size: int, seed: int) -> None:
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers
+
+    rng = np.random.default_rng(seed)
+
+    if arch == "bert":
+        # WordPiece vocab made of random lowercase words and word pieces
+        specials = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]"]
+        letters = [chr(c) for c in range(ord("a"), ord("z") + 1)]
+        vocab_list = specials + letters + [f"##{c}" for c in letters]
+        seen = set(vocab_list)
+        while len(vocab_list) < vocab_size:
+            word = "".join(rng.choice(letters, size=int(rng.integers(2, 9))))
+            if rng.random() < 0.3:
+                word = f"##{word}"
+            if word not in seen:
+                seen.add(word)
+                vocab_list.append(word)
+        vocab = {tok: i for i, tok in enumerate(vocab_list)}
+        tokenizer = Tokenizer(models.WordPiece(vocab, unk_token="[UNK]"))
+        tokenizer.pre_tokenizer = pre_tokenizers.BertPreTokenizer()
+        tokenizer.decoder = decoders.WordPiece()
+        tokenizer_config = {
+            "tokenizer_class": "PreTrainedTokenizerFast",
+            "unk_token": "[UNK]", "pad_token": "[PAD]", "cls_token": "[CLS]", "sep_token": "[SEP]", "mask_token": "[MASK]",
+        }
+    else:
+        # byte-level BPE vocab, with random (but valid) merges
+        specials = ["<|endoftext|>", "<|im_start|>", "<|im_end|>"]
+        vocab_list = list(pre_tokenizers.ByteLevel.alphabet())
+        vocab_list.sort()
+        seen = set(vocab_list)
+        merges: list[tuple[str, str]] = []
+        n_tokens = vocab_size - len(specials)
+        while len(vocab_list) < n_tokens:
+            a, b = (vocab_list[int(i)] for i in rng.integers(0, len(vocab_list), size=2))
+            if len(a) + len(b) > 12 or a + b in seen:
+                continue
+            seen.add(a + b)
+            vocab_list.append(a + b)
+            merges.append((a, b))
+        vocab = {tok: i for i, tok in enumerate(vocab_list)}
+        tokenizer = Tokenizer(models.BPE(vocab, merges))
+        tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+        tokenizer.decoder = decoders.ByteLevel()
+        tokenizer_config = {
+            "tokenizer_class": "PreTrainedTokenizerFast",
+            "bos_token": specials[0], "eos_token": specials[0],
+        }
+
+    tokenizer.add_special_tokens(specials)
+    tokenizer.save(str(dir_model / "tokenizer.json"))
+    with open(dir_model / "tokenizer_config.json", "w", encoding="utf-8") as f:
+        json.dump(tokenizer_config, f, indent=2)
+
+
+def make_checkpoint(work_dir: Path, arch: str, args: argparse.Namespace) -> Path:
+    config = make_config(arch, args)
+    spec = {"config": config, "shard_size": args.shard_size, "seed": args.seed}
+    dir_model = work_dir / arch
+    spec_file = dir_model / "bench-spec.json"
+
+    # reuse the checkpoint generated by a previous run with the same parameters
+    if spec_file.is_file():
+        with open(spec_file, "r", encoding="utf-8") as f:
+            if json.load(f) == spec:
+                logger.info(f"Reusing synthetic {arch} checkpoint in {dir_model}")
+                return dir_model
+        for path in dir_model.iterdir():
+            path.unlink()
+
+    logger.info(f"Generating synthetic {arch} checkpoint in {dir_model}")
+    dir_model.mkdir(parents=True, exist_ok=True)
+    with open(dir_model / "config.json", "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+    write_tokenizer(dir_model, arch, config["vocab_size"], args.seed)
+    dtype = np.dtype(np.float16 if args.dtype == "f16" else np.float32)
+    write_safetensors(dir_model, make_tensor_shapes(config), dtype, args.shard_size, args.seed)
+    # written last, so that interrupted generations are not reused
+    with open(spec_file, "w", encoding="utf-8") as f:
+        json.dump(spec, f, indent=2)
+    return dir_model
+
+
+# Accumulates the time spent in each phase.
+# Nested phases are exclusive: the time spent in an inner phase is not counted in the outer one.
+class PhaseTimer:
+    def __init__(self):
+        self.totals: dict[str, float] = defaultdict(float)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _add(self, phase: str, duration: float) -> None:
+        with self._lock:
+            self.totals[phase] += duration
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Generator[None, None, None]:
+        stack: list[list[Any]] = self._local.__dict__.setdefault("stack", [])
+        now = time.perf_counter()
+        if len(stack) > 0:
+            self._add(stack[-1][0], now - stack[-1][1])
+        stack.append([name, now])
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            phase, start = stack.pop()
+            self._add(phase, now - start)
+            if len(stack) > 0:
+                stack[-1][1] = now
+
+    def wrap(self, name: str, fn: Callable[..., Any]) -> Callable[..., Any]:
+        def timed_fn(*args, **kwargs):
+            with self.phase(name):
+                return fn(*args, **kwargs)
+        return timed_fn
+
+    # Time the evaluation of a lazy tensor (but not the evaluation of its arguments)
+    def wrap_lazy(self, name: str, t: Any) -> Any:
+        import gguf
+
+        if isinstance(t, gguf.LazyBase) and t._func is not None:
+            t._func = self.wrap(name, t._func)
+        return t
+
+
+def run_conversion(dir_model: Path, fname_out: Path, outtype: str, lazy: bool, threads: int) -> dict[str, Any]:
+    sys.path.insert(0, str(ROOT))
+    import convert_hf_to_gguf
+    import gguf
+    import torch
+
+    logging.basicConfig(level=logging.WARNING)
+
+    timer = PhaseTimer()
+    Model = convert_hf_to_gguf.Model
+
+    hparams = Model.load_hparams(dir_model)
+    model_class = Model.from_model_architecture(hparams["architectures"][0])
+
+    class BenchModel(model_class):
+        model_arch = model_class.model_arch
+
+        # the pre-tokenizer of a synthetic tokenizer is never recognized
+        def get_vocab_base_pre(self, tokenizer=None) -> str:
+            del tokenizer  # unused
+            return "gpt-2"
+
+        def get_tensors(self) -> Iterator[tuple[str, Any]]:
+            it = super().get_tensors()
+            while True:
+                with timer.phase("read"):
+                    try:
+                        name, data = next(it)
+                    except StopIteration:
+                        return
+                    timer.wrap_lazy("read", data)
+                yield name, data
+
+        def set_vocab(self):
+            with timer.phase("vocab"):
+                super().set_vocab()
+
+        def modify_tensors(self, data_torch, name: str, bid: int | None):
+            with timer.phase("modify_tensors"):
+                return list(super().modify_tensors(data_torch, name, bid))
+
+    quantize = gguf.quants.quantize
+
+    def timed_quantize(data: np.ndarray, *args: Any, **kwargs: Any) -> np.ndarray:
+        with timer.phase("quantize"):
+            res = quantize(data, *args, **kwargs)
+            return timer.wrap_lazy("quantize", res) if res is not data else res
+
+    gguf.quants.quantize = timed_quantize
+    # the evaluation of lazy tensors which isn't reading or quantizing is what modify_tensors did
+    setattr(gguf.LazyBase, "to_eager", classmethod(timer.wrap("modify_tensors", gguf.LazyBase.to_eager.__func__)))
+
+    ftype = convert_hf_to_gguf.gguf.LlamaFileType[{
+        "f32": "ALL_F32", "f16": "MOSTLY_F16", "bf16": "MOSTLY_BF16", "q8_0": "MOSTLY_Q8_0",
+    }.get(outtype, f"MOSTLY_{outtype.upper()}")]
+
+    start = time.perf_counter()
+    with torch.inference_mode():
+        model = BenchModel(dir_model=dir_model, ftype=ftype, fname_out=fname_out, eager=not lazy,
+                           thread_count=threads, max_inflight_size=4 * 1000 * 1000 * 1000)
+        writer = model.gguf_writer
+        setattr(writer, "write_tensors_to_file", timer.wrap("write", writer.write_tensors_to_file))
+        with timer.phase("other"):
+            model.write()
+    total = time.perf_counter() - start
+
+    # ru_maxrss is in kilobytes on Linux, but in bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        peak_rss *= 1024
+
+    phases = {phase: round(timer.totals.get(phase, 0.0), 4) for phase in PHASES}
+    phases["other"] = round(timer.totals.get("other", 0.0), 4)
+
+    return {
+        "time_total": round(total, 4),
+        "phases": phases,
+        "peak_rss_bytes": peak_rss,
+        "n_tensors": len(gguf.GGUFReader(fname_out).tensors),
+        "output_bytes": fname_out.stat().st_size,
+    }
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: list[dict[str, Any]], baseline: dict[str, Any]) -> None:
+    def key(r: dict[str, Any]) -> tuple:
+        return (r["arch"], r["outtype"], r["lazy"], r["threads"])
+
+    old = {key(r): r for r in baseline["results"]}
+    print(f"{'arch':<10} {'outtype':<8} {'lazy':<5} {'threads':>7} {'old [s]':>9} {'new [s]':>9} {'speedup':>8} {'old RSS':>9} {'new RSS':>9}")  # noqa: NP100
+    for r in results:
+        o = old.get(key(r))
+        if o is None:
+            continue
+        print(  # noqa: NP100
+            f"{r['arch']:<10} {r['outtype']:<8} {str(r['lazy']):<5} {r['threads']:>7} "
+            f"{o['time_total']:>9.2f} {r['time_total']:>9.2f} {o['time_total'] / r['time_total']:>7.2f}x "
+            f"{o['peak_rss_bytes'] / 1024**2:>7.0f}Mi {r['peak_rss_bytes'] / 1024**2:>7.0f}Mi"
+        )
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=DESCRIPTION, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--arch", type=str, nargs="+", default=list(ARCHITECTURES), choices=list(ARCHITECTURES),
+                        help="architectures of the synthetic checkpoints")
+    parser.add_argument("--outtype", type=str, nargs="+", default=["f16"],
+                        help="output types to benchmark (same names as the --outtype of convert_hf_to_gguf.py)")
+    parser.add_argument("--hidden-size", type=int, default=1024, help="embedding length of the synthetic models")
+    parser.add_argument("--layers", type=int, default=4, help="number of layers of the synthetic models")
+    parser.add_argument("--vocab-size", type=int, default=32000, help="vocab size of the synthetic models")
+    parser.add_argument("--experts", type=int, default=8, help="number of experts of the synthetic MoE models")
+    parser.add_argument("--dtype", type=str, default="f16", choices=["f16", "f32"], help="type of the synthetic tensors")
+    parser.add_argument("--shard-size", type=int, default=100 * 1000 * 1000, help="max size in bytes of the safetensors shards (0 for a single file)")
+    parser.add_argument("--seed", type=int, default=42, help="seed of the synthetic tensors and vocab")
+    parser.add_argument("--no-lazy", action="store_true", help="also benchmark the conversion without lazy evaluation")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1], help="thread counts to benchmark")
+    parser.add_argument("--repetitions", type=int, default=1, help="number of runs of each conversion (the fastest is kept)")
+    parser.add_argument("--work-dir", type=Path, default=None,
+                        help="directory where the synthetic checkpoints are generated (default: a temporary directory)")
+    parser.add_argument("-o", "--output", type=Path, default=None, help="file to write the results to, in JSON (default: stdout)")
+    parser.add_argument("--compare", type=Path, default=None, help="results of a previous run to compare against")
+    parser.add_argument("--verbose", action="store_true", help="increase output verbosity")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+
+    with contextlib.ExitStack() as stack:
+        if args.work_dir is not None:
+            work_dir = args.work_dir
+            work_dir.mkdir(parents=True, exist_ok=True)
+        else:
+            work_dir = Path(stack.enter_context(tempfile.TemporaryDirectory(prefix="bench-convert-")))
+
+        results: list[dict[str, Any]] = []
+        for arch in args.arch:
+            dir_model = make_checkpoint(work_dir, arch, args)
+            input_bytes = sum(p.stat().st_size for p in dir_model.glob("*.safetensors"))
+            fname_out = work_dir / f"{arch}.gguf"
+            for outtype in args.outtype:
+                for lazy in (True, False) if args.no_lazy else (True,):
+                    for threads in args.threads:
+                        best: dict[str, Any] | None = None
+                        for _ in range(args.repetitions):
+                            # a fresh process for each run, to measure its peak RSS
+                            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+                                res = executor.submit(run_conversion, dir_model, fname_out, outtype, lazy, threads).result()
+                            if best is None or res["time_total"] < best["time_total"]:
+                                best = res
+                        assert best is not None
+                        fname_out.unlink()
+                        result = {"arch": arch, "outtype": outtype, "lazy": lazy, "threads": threads, "input_bytes": input_bytes, **best}
+                        logger.info(f"{arch} {outtype} lazy={lazy} threads={threads}: {result['time_total']:.2f}s "
+                                    f"({', '.join(f'{k}={v:.2f}s' for k, v in result['phases'].items())}), "
+                                    f"peak RSS {result['peak_rss_bytes'] / 1024**2:.0f} MiB")
+                        results.append(result)
+
+    report = {
+        "commit": git_revision(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "system": {
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "cpu_count": os.cpu_count(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+        },
+        "params": {
+            "hidden_size": args.hidden_size,
+            "layers": args.layers,
+            "vocab_size": args.vocab_size,
+            "experts": args.experts,
+            "dtype": args.dtype,
+            "shard_size": args.shard_size,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"Results written to {args.output}")
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()  # noqa: NP100
+
+    if args.compare is not None:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
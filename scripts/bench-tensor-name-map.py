@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Callable
+
+# Necessary to load the local gguf package
+if "NO_LOCAL_GGUF" not in os.environ and (Path(__file__).parent.parent / 'gguf-py').exists():
+    sys.path.insert(0, str(Path(__file__).parent.parent / 'gguf-py'))
+
+import gguf
+
+logger = logging.getLogger("bench-tensor-name-map")
+
+DESCRIPTION = """Micro-benchmark of gguf.TensorNameMap, which maps the tensor names of HF models to GGUF tensor names.
+
+For each architecture, this measures:
+  compile: creating the first map of the architecture (which compiles its name templates)
+  build:   creating another map (with another number of blocks)
+  cached:  gguf.get_tensor_name_map() for an already used (architecture, number of blocks)
+  expand:  expanding the names of every block (TensorNameMap.mapping), what the map used to do on creation
+  lookup:  mapping a name with get_name(), with the ".weight" and ".bias" suffixes to try
+"""
+
+
+def best_time(fn: Callable[[], object], repetitions: int) -> float:
+    best = float("inf")
+    for _ in range(repetitions):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_arch(arch: gguf.MODEL_ARCH, n_blocks: int, repetitions: int) -> dict[str, float]:
+    # (the compilation is only done once per architecture)
+    gguf.TensorNameMap._compiled.pop(arch, None)
+    start = time.perf_counter()
+    tmap = gguf.TensorNameMap(arch, n_blocks)
+    t_compile = time.perf_counter() - start
+
+    t_build = best_time(lambda: gguf.TensorNameMap(arch, n_blocks + 1), repetitions)
+    gguf.get_tensor_name_map(arch, n_blocks)
+    t_cached = best_time(lambda: gguf.get_tensor_name_map(arch, n_blocks), repetitions)
+
+    t_expand = best_time(lambda: gguf.TensorNameMap(arch, n_blocks).mapping, repetitions)
+
+    names = [name + ".weight" for name in tmap.mapping]
+    suffixes = (".weight", ".bias")
+
+    def lookup():
+        for name in names:
+            tmap.get_name(name, try_suffixes=suffixes)
+
+    t_lookup = best_time(lookup, repetitions) / max(len(names), 1)
+
+    return {"names": len(names), "compile": t_compile, "build": t_build, "cached": t_cached, "expand": t_expand, "lookup": t_lookup}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=DESCRIPTION, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--arch", nargs="+", default=["llama", "qwen2moe", "deepseek2", "t5"],
+                        choices=sorted(gguf.MODEL_ARCH_NAMES.values()), help="architectures to benchmark")
+    parser.add_argument("--blocks", type=int, default=1000, help="number of blocks (layers)")
+    parser.add_argument("--repetitions", type=int, default=5, help="number of repetitions (the best time is reported)")
+    parser.add_argument("--verbose", action="store_true", help="increase output verbosity")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+
+    arch_by_name = {name: arch for arch, name in gguf.MODEL_ARCH_NAMES.items()}
+
+    print(f"{'arch':<12} {'names':>8} {'compile':>10} {'build':>10} {'cached':>10} {'expand':>10} {'lookup':>10}")  # noqa: NP100
+    for arch_name in args.arch:
+        res = bench_arch(arch_by_name[arch_name], args.blocks, args.repetitions)
+        logger.debug(f"{arch_name}: {res}")
+        print(f"{arch_name:<12} {res['names']:>8} {res['compile'] * 1e3:>8.2f}ms {res['build'] * 1e6:>8.2f}us "  # noqa: NP100
+              f"{res['cached'] * 1e6:>8.2f}us {res['expand'] * 1e3:>8.2f}ms {res['lookup'] * 1e6:>8.2f}us")
+
+
+if __name__ == "__main__":
+    main()